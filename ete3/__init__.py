@@ -58,6 +58,9 @@ from .phyloxml import Phyloxml, PhyloxmlTree
 from .nexml import Nexml, NexmlTree
 from .evol import EvolTree
 from .coretype.arraytable import *
+from .coretype.frozentree import *
+from .coretype.topology import *
+from .coretype.consensus import *
 from .clustering.clustertree import *
 
 try:
@@ -0,0 +1,452 @@
+# #START_LICENSE###########################################################
+#
+#
+# This file is part of the Environment for Tree Exploration program
+# (ETE).  http://etetoolkit.org
+#
+# ETE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ETE is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ETE.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#                     ABOUT THE ETE PACKAGE
+#                     =====================
+#
+# ETE is distributed under the GPL copyleft license (2008-2015).
+#
+# If you make use of ETE in published work, please cite:
+#
+# Jaime Huerta-Cepas, Joaquin Dopazo and Toni Gabaldon.
+# ETE: a python Environment for Tree Exploration. Jaime BMC
+# Bioinformatics 2010,:24doi:10.1186/1471-2105-11-24
+#
+# Note that extra references to the specific methods implemented in
+# the toolkit may be available in the documentation.
+#
+# More info at http://etetoolkit.org. Contact: huerta@embl.de
+#
+#
+# #END_LICENSE#############################################################
+"""
+Consensus trees built from split frequencies.
+
+The splits (clades in rooted mode, or bipartitions in unrooted mode) of a
+collection of trees with the same leaves (i.e. bootstrap replicates or the
+samples of a MCMC run) are encoded as integer bitsets (see
+:mod:`ete3.coretype.splits`) and counted together with the total length of
+the branches defining them. Trees are read one at a time, so memory usage
+depends on the number of different splits rather than on the number of
+trees, and splits can be counted in several processes.
+
+The same split counts are used to map the support of a collection of trees
+onto the branches of a reference tree, either as the classic split
+frequency (bootstrap or posterior support) or as the transfer bootstrap
+expectation.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+from bisect import bisect_left, bisect_right
+
+import six
+
+from .tree import TreeNode, TreeError
+from .splits import get_leaf_index, TreeSplits
+from ..utils import count_bits, imap_chunks
+
+__all__ = ["SplitCounter", "get_consensus_tree", "map_split_support"]
+
+CONSENSUS_METHODS = ("strict", "majority", "extended", "greedy")
+
+SUPPORT_METHODS = ("frequency", "transfer")
+
+def _bit_positions(bits):
+    """ Yields the positions of the bits set in an integer. """
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+def _get_tree_splits(tree, leaf_index, attr, unrooted, **kargs):
+    """ Returns the TreeSplits of a tree, checking that it contains all the
+    leaves in leaf_index. """
+    splits = TreeSplits(tree, leaf_index, attr=attr, unrooted=unrooted, **kargs)
+    if (splits.ignored_leaves or len(splits.leaves) != len(leaf_index)
+        or len(set(splits.leaves)) != len(leaf_index)):
+        raise TreeError("All trees must contain the same leaves")
+    return splits
+
+def _count_splits(tree, leaf_index, attr, unrooted, counts, lengths):
+    """ Adds the splits of a tree and the length of the branches defining
+    them to the counts and lengths dictionaries. """
+    splits = _get_tree_splits(tree, leaf_index, attr, unrooted, branch_lengths=True)
+    for key, length in six.iteritems(splits.lengths):
+        counts[key] = counts.get(key, 0) + 1
+        lengths[key] = lengths.get(key, 0.0) + length
+
+
+class SplitCounter(object):
+    """
+    .. versionadded:: 3.1.2
+
+    Counts the splits found in a stream of trees containing the same leaves
+    and builds strict, majority-rule and extended majority-rule consensus
+    trees from them.
+
+    :argument None leaf_names: leaf names of all the trees. If not
+      provided, the leaves of the first tree added are used (leaf order
+      determines the size of split bitsets, so using the leaf order of one
+      of the trees is recommended).
+
+    :argument name attr: leaf attribute used as leaf name.
+
+    :argument False unrooted: If True, trees are compared as unrooted.
+
+    :argument 0 newick_format: subnewick format used to read trees given as
+      newick strings.
+
+    **Example:**
+
+    ::
+
+      counter = SplitCounter(unrooted=True)
+      counter.update(iter_newick("bootstrap.nw"), n_jobs=4)
+      consensus = counter.get_consensus("majority")
+
+    """
+
+    def __init__(self, leaf_names=None, attr="name", unrooted=False, newick_format=0):
+        self.attr = attr
+        self.unrooted = unrooted
+        self.newick_format = newick_format
+        #: number of trees added
+        self.total = 0
+        #: leaf names, in the order of their bit positions
+        self.leaf_names = None
+        self._leaf_index = None
+        # split key -> number of trees containing the split
+        self._counts = {}
+        # split key -> total length of the branches defining the split
+        self._lengths = {}
+        if leaf_names is not None:
+            self._set_leaves(leaf_names)
+
+    def __len__(self):
+        return len(self._counts)
+
+    def _set_leaves(self, leaf_names):
+        leaf_index = get_leaf_index(leaf_names)
+        if len(leaf_index) != len(leaf_names):
+            raise TreeError("Duplicated items found in tree")
+        self.leaf_names = list(leaf_names)
+        self._leaf_index = leaf_index
+
+    def _read_tree(self, tree):
+        if isinstance(tree, six.string_types):
+            tree = TreeNode(tree, format=self.newick_format)
+        if self._leaf_index is None:
+            self._set_leaves([getattr(leaf, self.attr, None) for leaf in tree.iter_leaves()])
+        return tree
+
+    def add(self, tree):
+        """ Adds the splits of a tree (a TreeNode instance or a newick
+        string). """
+        tree = self._read_tree(tree)
+        _count_splits(tree, self._leaf_index, self.attr, self.unrooted,
+                      self._counts, self._lengths)
+        self.total += 1
+
+    def update(self, trees, n_jobs=1, chunksize=1000):
+        """ Adds all the trees in an iterable.
+
+        :argument 1 n_jobs: number of processes used to count splits. If
+          None, all available CPUs are used. Trees are sent to the processes
+          in chunks, so newick strings, which are parsed by the worker
+          processes, are much faster than TreeNode instances.
+
+        :argument 1000 chunksize: number of trees per chunk.
+        """
+        trees = iter(trees)
+        if n_jobs == 1:
+            for tree in trees:
+                self.add(tree)
+            return
+
+        if self._leaf_index is None:
+            # the first tree sets the leaf index shared by all processes
+            for tree in trees:
+                self.add(tree)
+                break
+
+        settings = (self._leaf_index, self.attr, self.unrooted, self.newick_format)
+        for total, counts, lengths in imap_chunks(_split_worker_count, settings, trees,
+                                                  n_jobs, chunksize, ordered=False):
+            self._merge(total, counts, lengths)
+
+    def _merge(self, total, counts, lengths):
+        self.total += total
+        self_counts, self_lengths = self._counts, self._lengths
+        for key, count in six.iteritems(counts):
+            self_counts[key] = self_counts.get(key, 0) + count
+            self_lengths[key] = self_lengths.get(key, 0.0) + lengths[key]
+
+    def _iter_informative(self):
+        """ Yields (count, bitset, key) tuples for all non trivial splits. """
+        nleaves = len(self.leaf_names)
+        max_size = nleaves - 2 if self.unrooted else nleaves - 1
+        for key, count in six.iteritems(self._counts):
+            offset, bits = key
+            size = count_bits(bits)
+            if 1 < size <= max_size:
+                yield count, bits << offset, key
+
+    def get_split_frequencies(self, min_freq=0.0):
+        """ Returns a list of (leaf names, frequency, mean branch length)
+        tuples with all the non trivial splits found in more than a
+        min_freq fraction of the trees, sorted by decreasing frequency. In
+        unrooted mode, leaf names are those at the side of the split not
+        containing the first leaf. """
+        splits = []
+        for count, bitset, key in self._iter_informative():
+            freq = count / float(self.total)
+            if freq > min_freq:
+                names = tuple(sorted(self.leaf_names[i] for i in _bit_positions(bitset)))
+                splits.append((names, freq, self._lengths[key] / count))
+        splits.sort(key=lambda split: (-split[1], split[0]))
+        return splits
+
+    def get_consensus(self, method="majority", min_freq=None):
+        """ Returns the consensus tree of all added trees as a new TreeNode
+        instance. Support values are the fraction of trees containing each
+        split, and branch lengths are the mean length of the branches
+        defining each split in those trees.
+
+        :argument majority method: ``strict`` keeps only splits found in
+          all trees, ``majority`` keeps splits found in more than half of
+          the trees (or in more than min_freq), and ``extended`` (or its
+          alias ``greedy``) adds the rest of splits found in more than
+          min_freq by decreasing frequency, as long as they are compatible
+          with those already in the tree (extended majority-rule or greedy
+          consensus, as in PHYLIP consense).
+
+        :argument None min_freq: min frequency of splits. It defaults to 0.5
+          for the majority rule and to 0 for the extended majority rule.
+          Splits are added by decreasing frequency and incompatible splits
+          are discarded, so values lower than 0.5 can also be used with the
+          majority rule.
+        """
+        if method not in CONSENSUS_METHODS:
+            raise ValueError("method must be one of %s" %', '.join(CONSENSUS_METHODS))
+        if not self.total:
+            raise TreeError("No trees were added")
+
+        total = self.total
+        if method == "strict":
+            min_count = total - 1
+        elif min_freq is not None:
+            min_count = min_freq * total
+        else:
+            min_count = 0.5 * total if method == "majority" else 0
+
+        candidates = sorted(((count, bitset, key) for count, bitset, key in self._iter_informative()
+                             if count > min_count),
+                            key=lambda split: (-split[0], split[1]))
+        nleaves = len(self.leaf_names)
+        max_splits = max(nleaves - 3 if self.unrooted else nleaves - 2, 0)
+        accepted = []
+        for count, bitset, key in candidates:
+            if len(accepted) == max_splits:
+                break
+            # two splits are compatible if they are nested or disjoint
+            for other, _, _ in accepted:
+                shared = other & bitset
+                if shared and shared != bitset and shared != other:
+                    break
+            else:
+                accepted.append((bitset, count, key))
+
+        # splits are added from larger to smaller, each one as a child of
+        # the smallest split already added containing its leaves
+        accepted.sort(key=lambda split: -count_bits(split[0]))
+        counts, lengths = self._counts, self._lengths
+        root = TreeNode()
+        leaf_parents = [root] * nleaves
+        for bitset, count, key in accepted:
+            positions = list(_bit_positions(bitset))
+            node = leaf_parents[positions[0]].add_child()
+            node.support = count / float(total)
+            node.dist = lengths[key] / count
+            for i in positions:
+                leaf_parents[i] = node
+
+        for i, name in enumerate(self.leaf_names):
+            leaf = leaf_parents[i].add_child(name=name)
+            if self.unrooted and i == 0:
+                key = (1, ((1 << nleaves) - 1) >> 1)
+            else:
+                key = (i, 1)
+            if key in counts:
+                leaf.dist = lengths[key] / counts[key]
+            leaf.support = 1.0
+        return root
+
+def _split_worker_count(settings, trees):
+    leaf_index, attr, unrooted, newick_format = settings
+    counts, lengths = {}, {}
+    for tree in trees:
+        if isinstance(tree, six.string_types):
+            tree = TreeNode(tree, format=newick_format)
+        _count_splits(tree, leaf_index, attr, unrooted, counts, lengths)
+    return len(trees), counts, lengths
+
+def get_consensus_tree(trees, method="majority", min_freq=None, unrooted=False,
+                       attr="name", newick_format=0, n_jobs=1):
+    """
+    .. versionadded:: 3.1.2
+
+    Returns the consensus tree of a collection of trees containing the same
+    leaves (see :func:`SplitCounter.get_consensus`).
+
+    :argument trees: an iterable of TreeNode instances or newick strings.
+    """
+    counter = SplitCounter(attr=attr, unrooted=unrooted, newick_format=newick_format)
+    counter.update(trees, n_jobs=n_jobs)
+    return counter.get_consensus(method=method, min_freq=min_freq)
+
+def map_split_support(reference, trees, method="frequency", attr="name", unrooted=False,
+                      newick_format=0, n_jobs=1, chunksize=1000):
+    """
+    .. versionadded:: 3.1.2
+
+    Sets the support value of every node in a reference tree (but the root)
+    from the splits found in a collection of trees containing the same
+    leaves (i.e. bootstrap replicates). Only the splits of the reference
+    tree are tracked, so trees are read one at a time and each one is
+    processed in linear time (or quadratic time for transfer support).
+
+    :argument reference: a TreeNode instance, whose support values are
+      replaced.
+
+    :argument trees: an iterable of TreeNode instances or newick strings.
+
+    :argument frequency method: ``frequency`` uses the fraction of trees
+      containing each split (classic bootstrap or posterior support).
+      ``transfer`` uses the transfer bootstrap expectation (Lemoine et al.,
+      Nature 2018): 1 minus the mean transfer distance from each split to
+      the closest split of every tree, divided by p-1, where p is the number
+      of leaves at the smaller side of the split. Transfer support is
+      always computed on unrooted trees.
+
+    :argument name attr: leaf attribute used as leaf name.
+
+    :argument False unrooted: If True, trees are compared as unrooted.
+
+    :argument 0 newick_format: subnewick format used to read trees given as
+      newick strings.
+
+    :argument 1 n_jobs: number of processes used to read the trees. If
+      None, all available CPUs are used.
+
+    :argument 1000 chunksize: number of trees sent at once to each process.
+
+    :returns: the number of trees read.
+    """
+    if method not in SUPPORT_METHODS:
+        raise ValueError("method must be one of %s" %', '.join(SUPPORT_METHODS))
+    if method == "transfer":
+        unrooted = True
+
+    leaf_names = [getattr(leaf, attr, None) for leaf in reference.iter_leaves()]
+    leaf_index = get_leaf_index(leaf_names)
+    if len(leaf_index) != len(leaf_names):
+        raise TreeError("Duplicated items found in tree")
+    node_keys = _get_tree_splits(reference, leaf_index, attr, unrooted, node_keys=True).node_keys
+    del node_keys[reference]
+    # reference splits are identified by their position in this list
+    ref_keys = sorted(set(node_keys.values()))
+    settings = (leaf_index, attr, unrooted, newick_format, method, ref_keys)
+
+    if n_jobs == 1:
+        total, scores = _score_splits(settings, trees)
+    else:
+        total, scores = 0, [0] * len(ref_keys)
+        for chunk_total, chunk_scores in imap_chunks(_score_splits, settings, trees,
+                                                     n_jobs, chunksize, ordered=False):
+            total += chunk_total
+            scores = [a + b for a, b in zip(scores, chunk_scores)]
+    if not total:
+        raise TreeError("No trees were given")
+
+    nleaves = len(leaf_names)
+    support = {}
+    for key, score in zip(ref_keys, scores):
+        if method == "frequency":
+            support[key] = score / float(total)
+        else:
+            size = count_bits(key[1])
+            max_distance = min(size, nleaves - size) - 1
+            support[key] = 1.0 - score / float(total * max_distance) if max_distance > 0 else 1.0
+    for node, key in six.iteritems(node_keys):
+        node.support = support[key]
+    return total
+
+def _score_splits(settings, trees):
+    """ Returns the number of trees read and, for every reference split, the
+    number of trees containing it (frequency method) or the sum of its
+    transfer distances to the trees (transfer method). """
+    leaf_index, attr, unrooted, newick_format, method, ref_keys = settings
+    if method == "frequency":
+        ref_ids = dict((key, i) for i, key in enumerate(ref_keys))
+    else:
+        ref_bitsets = [(bits << offset, count_bits(bits)) for offset, bits in ref_keys]
+
+    total, scores = 0, [0] * len(ref_keys)
+    for tree in trees:
+        if isinstance(tree, six.string_types):
+            tree = TreeNode(tree, format=newick_format)
+        splits = _get_tree_splits(tree, leaf_index, attr, unrooted)
+        if method == "frequency":
+            for key in splits.keys:
+                i = ref_ids.get(key)
+                if i is not None:
+                    scores[i] += 1
+        else:
+            for i, distance in enumerate(_get_transfer_distances(ref_bitsets, splits.keys,
+                                                                 len(leaf_index))):
+                scores[i] += distance
+        total += 1
+    return total, scores
+
+def _get_transfer_distances(ref_bitsets, keys, nleaves):
+    """ Returns the transfer distance from every reference split, given as
+    (bitset, size) tuples, to the closest split in a set of unrooted split
+    keys. Both are the side of the split not containing the leaf at bit 0.
+    """
+    splits = sorted((count_bits(bits), bits << offset) for offset, bits in keys if bits)
+    sizes = [size for size, _ in splits]
+    distances = []
+    for bitset, size in ref_bitsets:
+        # distance to the trivial split of a leaf at the smaller side
+        best = min(size, nleaves - size) - 1
+        # the distance to a split with n leaves is at least |size - n| and
+        # nleaves - size - n, so only splits within these ranges of sizes
+        # can be closer
+        ranges = [(bisect_right(sizes, size - best), bisect_left(sizes, size + best)),
+                  (bisect_right(sizes, nleaves - size - best), len(sizes))]
+        for start, end in ranges:
+            for i in range(start, end):
+                if best <= 0:
+                    break
+                moved = count_bits(bitset ^ splits[i][1])
+                best = min(best, moved, nleaves - moved)
+        distances.append(max(best, 0))
+    return distances
@@ -0,0 +1,295 @@
+# #START_LICENSE###########################################################
+#
+#
+# This file is part of the Environment for Tree Exploration program
+# (ETE).  http://etetoolkit.org
+#
+# ETE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ETE is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ETE.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#                     ABOUT THE ETE PACKAGE
+#                     =====================
+#
+# ETE is distributed under the GPL copyleft license (2008-2015).
+#
+# If you make use of ETE in published work, please cite:
+#
+# Jaime Huerta-Cepas, Joaquin Dopazo and Toni Gabaldon.
+# ETE: a python Environment for Tree Exploration. Jaime BMC
+# Bioinformatics 2010,:24doi:10.1186/1471-2105-11-24
+#
+# Note that extra references to the specific methods implemented in
+# the toolkit may be available in the documentation.
+#
+# More info at http://etetoolkit.org. Contact: huerta@embl.de
+#
+#
+# #END_LICENSE#############################################################
+from __future__ import absolute_import
+from __future__ import print_function
+
+import six
+from six.moves import range
+
+from .. import numpy
+from .tree import TreeNode, TreeError
+
+__all__ = ["FrozenTree"]
+
+class FrozenTree(object):
+    """
+    .. versionadded:: 3.1.2
+
+    Immutable and compact representation of a tree topology, intended for
+    read-only analyses over large trees or large collections of trees.
+
+    Nodes are identified by their position in the preorder traversal of the
+    original tree (the root is always node 0), and all node data is stored in
+    numpy arrays indexed by such identifiers:
+
+      - parent: parent node id (-1 for the root)
+      - dist, support: branch length and support of each node
+      - depth: number of branches from the root
+      - root_dist: branch length distance to the root
+      - subtree_end: the descendants of node i are nodes i+1 to
+        subtree_end[i]-1
+      - leaves: ids of all leaf nodes, in preorder
+      - leaf_start, leaf_end: the leaves under node i are
+        leaves[leaf_start[i]:leaf_end[i]]
+      - name_ids: position of each leaf name in the leaf_names list (-1 for
+        internal nodes)
+
+    :argument tree: a TreeNode instance.
+
+    :argument None leaf_names: a list of leaf names that can be shared among
+      many FrozenTree instances. Names not found in the list are appended to
+      it. If not provided, a new list is created.
+
+    **Example:**
+
+    ::
+
+      names = []
+      trees = [FrozenTree(Tree(nw), leaf_names=names) for nw in newicks]
+      print(trees[0].get_distance("A", "B"))
+
+    """
+
+    def __init__(self, tree, leaf_names=None):
+        if numpy is None:
+            raise RuntimeError("numpy is required to use FrozenTree. Please install it and try again")
+
+        if leaf_names is None:
+            leaf_names = []
+        self.leaf_names = leaf_names
+        name2id = dict((name, i) for i, name in enumerate(leaf_names))
+
+        parent, dist, support, depth, root_dist, name_ids = [], [], [], [], [], []
+        internal_names = {}
+        # iterative preorder traversal, storing the id of each node's parent
+        to_visit = [(tree, -1)]
+        while to_visit:
+            node, up = to_visit.pop()
+            nid = len(parent)
+            parent.append(up)
+            dist.append(node.dist)
+            support.append(node.support)
+            if up == -1:
+                depth.append(0)
+                root_dist.append(0.0)
+            else:
+                depth.append(depth[up] + 1)
+                root_dist.append(root_dist[up] + node.dist)
+
+            if node.children:
+                name_ids.append(-1)
+                if node.name:
+                    internal_names[nid] = node.name
+                to_visit.extend((ch, nid) for ch in reversed(node.children))
+            else:
+                name_id = name2id.get(node.name)
+                if name_id is None:
+                    name_id = name2id[node.name] = len(leaf_names)
+                    leaf_names.append(node.name)
+                name_ids.append(name_id)
+
+        # subtree sizes are accumulated in reverse preorder
+        size = [1] * len(parent)
+        for nid in range(len(parent) - 1, 0, -1):
+            size[parent[nid]] += size[nid]
+
+        self.parent = numpy.array(parent, dtype=numpy.int32)
+        self.dist = numpy.array(dist, dtype=numpy.float64)
+        self.support = numpy.array(support, dtype=numpy.float64)
+        self.depth = numpy.array(depth, dtype=numpy.int32)
+        self.root_dist = numpy.array(root_dist, dtype=numpy.float64)
+        self.name_ids = numpy.array(name_ids, dtype=numpy.int32)
+        self.subtree_end = numpy.arange(len(parent), dtype=numpy.int32) + \
+                           numpy.array(size, dtype=numpy.int32)
+        self.internal_names = internal_names
+
+        self.leaves = numpy.flatnonzero(self.name_ids >= 0).astype(numpy.int32)
+        self.leaf_start = numpy.searchsorted(self.leaves, numpy.arange(len(parent))).astype(numpy.int32)
+        self.leaf_end = numpy.searchsorted(self.leaves, self.subtree_end).astype(numpy.int32)
+
+        for array in [self.parent, self.dist, self.support, self.depth,
+                      self.root_dist, self.name_ids, self.subtree_end,
+                      self.leaves, self.leaf_start, self.leaf_end]:
+            array.flags.writeable = False
+
+        self._name2node = None
+
+    def __len__(self):
+        """ Number of leaves in the tree. """
+        return len(self.leaves)
+
+    def __repr__(self):
+        return "FrozenTree (%d nodes, %d leaves) (%s)" %(
+            self.n_nodes, len(self.leaves), hex(self.__hash__()))
+
+    @property
+    def n_nodes(self):
+        """ Total number of nodes in the tree. """
+        return len(self.parent)
+
+    def is_leaf(self, node):
+        """ Returns True if the node is a leaf. """
+        return self.name_ids[node] >= 0
+
+    def get_name(self, node):
+        """ Returns the name of a node. """
+        name_id = self.name_ids[node]
+        if name_id >= 0:
+            return self.leaf_names[name_id]
+        else:
+            return self.internal_names.get(int(node), "")
+
+    def get_node_ids(self, *names):
+        """ Returns the ids of the nodes with the provided names. Leaf names
+        are expected to be unique. Internal node names can also be used,
+        as in :func:`TreeNode.get_distance`, as long as no other node has
+        the same name. """
+        if self._name2node is None:
+            name2node = dict((self.leaf_names[self.name_ids[nid]], int(nid))
+                             for nid in self.leaves)
+            if len(name2node) < len(self.leaves):
+                raise TreeError("Duplicated leaf names found")
+            # internal names shared with any other node are ambiguous
+            for nid, name in six.iteritems(self.internal_names):
+                name2node[name] = None if name in name2node else nid
+            self._name2node = name2node
+        try:
+            node_ids = [self._name2node[name] for name in names]
+        except KeyError as e:
+            raise ValueError("Node names not found: %s" %e)
+        if None in node_ids:
+            raise TreeError("Ambiguous node name: %s" %names[node_ids.index(None)])
+        return node_ids
+
+    def _translate(self, nodes):
+        return [self.get_node_ids(n)[0] if isinstance(n, six.string_types) else n
+                for n in nodes]
+
+    def traverse(self, strategy="levelorder", node=0):
+        """
+        Returns an array with the ids of the nodes under the given node
+        (including itself) in the requested traversal order: "preorder",
+        "postorder" or "levelorder".
+        """
+        node = self._translate([node])[0]
+        start, end = node, self.subtree_end[node]
+        if strategy == "preorder":
+            return numpy.arange(start, end, dtype=numpy.int32)
+        elif strategy == "postorder":
+            # a node is visited when its whole subtree has been visited
+            # (deeper nodes first if several subtrees end at the same point)
+            order = numpy.lexsort((-self.depth[start:end], self.subtree_end[start:end]))
+        elif strategy == "levelorder":
+            order = numpy.argsort(self.depth[start:end], kind="mergesort")
+        else:
+            raise TreeError("Unknown traversal strategy: %s" %strategy)
+        return (order + start).astype(numpy.int32)
+
+    def get_leaves(self, node=0):
+        """ Returns an array with the ids of the leaves under a node. """
+        node = self._translate([node])[0]
+        return self.leaves[self.leaf_start[node]:self.leaf_end[node]]
+
+    def get_leaf_names(self, node=0):
+        """ Returns the list of leaf names under a node. """
+        return [self.leaf_names[i] for i in self.name_ids[self.get_leaves(node)]]
+
+    def get_cached_content(self):
+        """
+        Returns the leaf content of all nodes in the tree as three arrays:
+        (leaves, leaf_start, leaf_end), so the leaf ids under node i are
+        leaves[leaf_start[i]:leaf_end[i]]. No per node containers are
+        created.
+        """
+        return self.leaves, self.leaf_start, self.leaf_end
+
+    def get_common_ancestors(self, nodes1, nodes2):
+        """
+        Returns an array with the first common ancestor of each pair of
+        nodes in the nodes1 and nodes2 arrays.
+        """
+        anc = numpy.array(self._translate(nodes1), dtype=numpy.int32)
+        target = numpy.array(self._translate(nodes2), dtype=numpy.int32)
+        # climb from the first node until its subtree contains the second one
+        pending = (target < anc) | (target >= self.subtree_end[anc])
+        while pending.any():
+            anc[pending] = self.parent[anc[pending]]
+            pending[pending] = (target[pending] < anc[pending]) | \
+                               (target[pending] >= self.subtree_end[anc[pending]])
+        return anc
+
+    def get_common_ancestor(self, node1, node2):
+        """ Returns the first common ancestor of two nodes. """
+        return int(self.get_common_ancestors([node1], [node2])[0])
+
+    def get_distances(self, nodes1, nodes2, topology_only=False):
+        """
+        Returns an array with the distances between each pair of nodes in
+        the nodes1 and nodes2 arrays. If topology_only is True, the number
+        of nodes between each pair is returned instead, as in
+        :func:`TreeNode.get_distance` (the node in nodes1 is not counted
+        unless it is the common ancestor of both nodes).
+        """
+        nodes1 = numpy.array(self._translate(nodes1), dtype=numpy.int32)
+        nodes2 = numpy.array(self._translate(nodes2), dtype=numpy.int32)
+        anc = self.get_common_ancestors(nodes1, nodes2)
+        if topology_only:
+            d = self.depth[nodes1] + self.depth[nodes2] - 2 * self.depth[anc]
+            return d - (nodes1 != anc)
+        else:
+            return self.root_dist[nodes1] + self.root_dist[nodes2] - 2 * self.root_dist[anc]
+
+    def get_distance(self, node1, node2, topology_only=False):
+        """ Returns the distance between two nodes as a float, like
+        :func:`TreeNode.get_distance`. See :func:`FrozenTree.get_distances`."""
+        return float(self.get_distances([node1], [node2], topology_only=topology_only)[0])
+
+    def to_tree(self, tree_class=TreeNode):
+        """ Converts the frozen topology back into a regular tree. """
+        nodes = []
+        for nid in range(self.n_nodes):
+            node = tree_class()
+            node.dist = self.dist[nid]
+            node.support = self.support[nid]
+            node.name = self.get_name(nid)
+            up = self.parent[nid]
+            if up >= 0:
+                nodes[up].add_child(node)
+            nodes.append(node)
+        return nodes[0]
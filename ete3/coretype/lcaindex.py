@@ -0,0 +1,252 @@
+# #START_LICENSE###########################################################
+#
+#
+# This file is part of the Environment for Tree Exploration program
+# (ETE).  http://etetoolkit.org
+#
+# ETE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ETE is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ETE.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#                     ABOUT THE ETE PACKAGE
+#                     =====================
+#
+# ETE is distributed under the GPL copyleft license (2008-2015).
+#
+# If you make use of ETE in published work, please cite:
+#
+# Jaime Huerta-Cepas, Joaquin Dopazo and Toni Gabaldon.
+# ETE: a python Environment for Tree Exploration. Jaime BMC
+# Bioinformatics 2010,:24doi:10.1186/1471-2105-11-24
+#
+# Note that extra references to the specific methods implemented in
+# the toolkit may be available in the documentation.
+#
+# More info at http://etetoolkit.org. Contact: huerta@embl.de
+#
+#
+# #END_LICENSE#############################################################
+from __future__ import absolute_import
+from __future__ import print_function
+
+import six
+from six.moves import range
+
+from .. import numpy
+from .tree import TreeError
+
+__all__ = ["LCAIndex"]
+
+class LCAIndex(object):
+    """
+    .. versionadded:: 3.1.2
+
+    Precomputed index answering lowest common ancestor (LCA) and distance
+    queries on a tree in constant time. It is usually created with
+    :func:`TreeNode.build_lca_index`.
+
+    Nodes are numbered in preorder. The LCA of two nodes u and v (u before
+    v) is the parent of the shallowest node found between u (excluded) and
+    v in preorder, which is obtained from a sparse table of range minimum
+    queries over node depths (O(n log n) to build, O(1) per query).
+
+    The index is a snapshot of the tree topology: it must be rebuilt if the
+    tree is modified.
+
+    :argument tree: a TreeNode instance. Only the subtree under it is
+      indexed.
+
+    **Example:**
+
+    ::
+
+      t = Tree("((A:1,(B:1,C:1):1):1,D:1);")
+      index = t.build_lca_index()
+      print(index.get_common_ancestor("B", "C"))
+      print(index.get_distance("A", "C"))
+      matrix = index.leaf_distance_matrix()
+
+    """
+
+    def __init__(self, tree):
+        nodes, parent, depth, root_dist = [], [], [], []
+        node2id = {}
+        # iterative preorder traversal, storing the id of each node's parent
+        to_visit = [(tree, -1)]
+        while to_visit:
+            node, up = to_visit.pop()
+            node2id[node] = len(nodes)
+            nodes.append(node)
+            parent.append(up)
+            if up == -1:
+                depth.append(0)
+                root_dist.append(0.0)
+            else:
+                depth.append(depth[up] + 1)
+                root_dist.append(root_dist[up] + node.dist)
+            to_visit.extend((ch, node2id[node]) for ch in reversed(node.children))
+
+        self.nodes = nodes
+        self.parent = parent
+        self.depth = depth
+        self.root_dist = root_dist
+        self.leaves = [n for n in nodes if not n.children]
+        self._node2id = node2id
+        self._name2node = None
+        self._np_table = None
+
+        # table[k][i] is the shallowest node among nodes i to i + 2**k - 1
+        table = [list(range(len(nodes)))]
+        span = 1
+        while span * 2 <= len(nodes):
+            prev = table[-1]
+            table.append([a if depth[a] <= depth[b] else b
+                          for a, b in zip(prev, prev[span:])])
+            span *= 2
+        self._table = table
+
+    def __len__(self):
+        """ Number of indexed nodes. """
+        return len(self.nodes)
+
+    def _get_id(self, node):
+        if isinstance(node, six.string_types):
+            if self._name2node is None:
+                name2node = {}
+                for n in self.nodes:
+                    if n.name in name2node:
+                        # ambiguous names are marked, so they can't be used
+                        name2node[n.name] = None
+                    else:
+                        name2node[n.name] = n
+                self._name2node = name2node
+            try:
+                target = self._name2node[node]
+            except KeyError:
+                raise ValueError("Node names not found: %s" %node)
+            if target is None:
+                raise TreeError("Ambiguous node name: %s" %node)
+            node = target
+
+        try:
+            return self._node2id[node]
+        except KeyError:
+            raise TreeError("Node not found in the indexed tree: %s" %node)
+
+    def _lca(self, a, b):
+        """ Returns the id of the LCA of node ids a and b. """
+        if a == b:
+            return a
+        if a > b:
+            a, b = b, a
+        k = (b - a).bit_length() - 1
+        level = self._table[k]
+        x, y = level[a + 1], level[b - (1 << k) + 1]
+        depth = self.depth
+        return self.parent[x if depth[x] <= depth[y] else y]
+
+    def get_common_ancestor(self, *target_nodes):
+        """
+        Returns the first common ancestor of the given nodes (node
+        instances or unique node names).
+        """
+        if len(target_nodes) == 1 and type(target_nodes[0]) \
+                in set([set, tuple, list, frozenset]):
+            target_nodes = target_nodes[0]
+        if not target_nodes:
+            raise TreeError("No target nodes provided")
+
+        ids = [self._get_id(n) for n in target_nodes]
+        anc = ids[0]
+        for nid in ids[1:]:
+            anc = self._lca(anc, nid)
+        return self.nodes[anc]
+
+    def get_depth(self, node):
+        """ Returns the number of branches between the node and the root. """
+        return self.depth[self._get_id(node)]
+
+    def get_root_distance(self, node):
+        """ Returns the branch length distance between the node and the
+        root. """
+        return self.root_dist[self._get_id(node)]
+
+    def get_distance(self, target, target2, topology_only=False):
+        """
+        Returns the distance between two nodes, as
+        :func:`TreeNode.get_distance` does.
+
+        :argument target: a node within the indexed tree.
+
+        :argument target2: a node within the indexed tree.
+
+        :argument False topology_only: If set to True, distance will
+          refer to the number of nodes between target and target2.
+        """
+        a, b = self._get_id(target), self._get_id(target2)
+        anc = self._lca(a, b)
+        if topology_only:
+            depth = self.depth
+            dist = depth[b] - depth[anc] + depth[a] - depth[anc]
+            if a != anc:
+                # target itself is not counted
+                dist -= 1
+            return float(dist)
+        return self.root_dist[a] + self.root_dist[b] - 2 * self.root_dist[anc]
+
+    def leaf_distance_matrix(self, topology_only=False):
+        """
+        Returns a numpy array with the distances among all leaves of the
+        tree. Rows and columns follow the order of leaves in the
+        :attr:`leaves` list (preorder).
+
+        :argument False topology_only: If set to True, distances will
+          refer to the number of nodes between leaves.
+        """
+        if numpy is None:
+            raise RuntimeError("numpy is required to compute distance matrices. Please install it and try again")
+
+        if self._np_table is None:
+            table = numpy.empty((len(self._table), len(self.nodes)), dtype=numpy.int32)
+            for k, level in enumerate(self._table):
+                table[k, :len(level)] = level
+                table[k, len(level):] = 0
+            self._np_table = table
+        table = self._np_table
+        parent = numpy.array(self.parent, dtype=numpy.int32)
+        depth = numpy.array(self.depth, dtype=numpy.int32)
+        if topology_only:
+            values = depth.astype(numpy.float64)
+        else:
+            values = numpy.array(self.root_dist, dtype=numpy.float64)
+
+        leaves = numpy.array([self._node2id[n] for n in self.leaves], dtype=numpy.int64)
+        # floor(log2(x)) for all possible range lengths
+        log2 = numpy.zeros(len(self.nodes) + 1, dtype=numpy.int64)
+        for k in range(1, len(self._table)):
+            log2[1 << k:] += 1
+
+        matrix = numpy.zeros((len(leaves), len(leaves)), dtype=numpy.float64)
+        for i in range(len(leaves) - 1):
+            a = leaves[i]
+            b = leaves[i + 1:]
+            k = log2[b - a]
+            x = table[k, a + 1]
+            y = table[k, b - (1 << k) + 1]
+            anc = parent[numpy.where(depth[x] <= depth[y], x, y)]
+            dist = values[a] + values[b] - 2 * values[anc]
+            if topology_only:
+                dist -= 1
+            matrix[i, i + 1:] = dist
+            matrix[i + 1:, i] = dist
+        return matrix
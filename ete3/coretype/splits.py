@@ -0,0 +1,238 @@
+# #START_LICENSE###########################################################
+#
+#
+# This file is part of the Environment for Tree Exploration program
+# (ETE).  http://etetoolkit.org
+#
+# ETE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ETE is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ETE.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#                     ABOUT THE ETE PACKAGE
+#                     =====================
+#
+# ETE is distributed under the GPL copyleft license (2008-2015).
+#
+# If you make use of ETE in published work, please cite:
+#
+# Jaime Huerta-Cepas, Joaquin Dopazo and Toni Gabaldon.
+# ETE: a python Environment for Tree Exploration. Jaime BMC
+# Bioinformatics 2010,:24doi:10.1186/1471-2105-11-24
+#
+# Note that extra references to the specific methods implemented in
+# the toolkit may be available in the documentation.
+#
+# More info at http://etetoolkit.org. Contact: huerta@embl.de
+#
+#
+# #END_LICENSE#############################################################
+"""
+Tree bipartitions (splits) encoded as integer bitsets.
+
+Leaf names (or any other leaf attribute) shared by the trees being compared
+are mapped to bit positions, and the clade under each node is represented
+by a Python integer in which bit i is set if the i-th leaf is part of the
+clade. Bitsets are computed in a single postorder traversal and can be
+hashed and compared much faster than sorted tuples of leaf names.
+
+To keep bitsets small, each clade is stored as a ``(offset, bits)`` tuple,
+where offset is the position of its first leaf and bits is the bitset
+shifted by offset. If leaf positions follow the leaf order of one of the
+trees, all its clades are contiguous ranges of bits, so their size is
+proportional to the number of leaves they contain rather than to the size
+of the tree.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+__all__ = ["get_leaf_index", "TreeSplits", "EMPTY_SPLIT"]
+
+# Key used for splits with no leaves at one of their sides
+EMPTY_SPLIT = (0, 0)
+
+def get_leaf_index(leaf_attrs):
+    """ Returns a dictionary mapping each leaf attribute value to its bit
+    position. Values are expected in the leaf order of one of the trees
+    being compared (i.e. as returned by get_leaf_names()), as it produces
+    the most compact bitsets for similar trees. """
+    return dict((value, i) for i, value in enumerate(leaf_attrs))
+
+class TreeSplits(object):
+    """
+    Splits of a tree, computed in a single postorder traversal.
+
+    :argument tree: a TreeNode instance.
+
+    :argument leaf_index: dictionary mapping leaf attribute values to bit
+      positions (see :func:`get_leaf_index`). Leaves whose attribute is not
+      in the index are ignored.
+
+    :argument name attr: leaf attribute used as leaf name.
+
+    :argument False unrooted: If True, each edge is represented by the side
+      of the bipartition that does not contain the leaf at bit 0, so the two
+      sides of an edge produce the same key.
+
+    :argument False branch_lengths: If True, the branch lengths of the nodes
+      defining each split are summed up in the lengths attribute.
+
+    :argument False node_keys: If True, the split key of every node is
+      stored in the node_keys attribute.
+
+    Attributes:
+
+      - keys: the set of split keys, as ``(offset, bits)`` tuples. Splits
+        with no leaves (or no leaves at one side in unrooted mode) are
+        represented by EMPTY_SPLIT.
+      - all_bits: bitset containing all indexed leaves.
+      - leaves: indexed leaf values found in the tree, in preorder.
+      - ignored_leaves: number of leaves not found in the index.
+      - lengths: dictionary with the total branch length of the nodes
+        defining each split key (i.e. the two branches at the sides of a
+        binary root in unrooted mode, or the branches of single child
+        nodes), only if branch_lengths is True.
+      - node_keys: dictionary mapping each node to its split key, only if
+        node_keys is True.
+    """
+
+    def __init__(self, tree, leaf_index, attr="name", unrooted=False, branch_lengths=False,
+                 node_keys=False):
+        self.unrooted = unrooted
+        self.all_bits = (1 << len(leaf_index)) - 1
+        # leaf at the first position of sorted leaf values. It is used to
+        # sort the sides of unrooted splits as they were sorted tuples.
+        self._first_bit = leaf_index[min(leaf_index)] if leaf_index else 0
+        # indexed leaf values found in the tree, in preorder. The indexed
+        # leaves under any node are a contiguous range of this list.
+        self.leaves = []
+        self.ignored_leaves = 0
+        # split key -> (start, end, complementary) where leaves[start:end]
+        # are the leaves of the node defining the split. In unrooted mode,
+        # complementary is True if the key is the other side of the edge.
+        self._ranges = {}
+        # (split key, complementary) -> support of the highest node defining
+        # that side of the split
+        self._support = {}
+        self.lengths = {} if branch_lengths else None
+        self.node_keys = {} if node_keys else None
+
+        leaves = self.leaves
+        ranges = self._ranges
+        support = self._support
+        lengths = self.lengths
+        node_keys = self.node_keys
+        all_bits = self.all_bits
+        missing = object()
+
+        # pending internal nodes: [offset, bits, start position]
+        stack = []
+        for post, node in tree.iter_prepostorder():
+            if post:
+                offset, bits, start = stack.pop()
+            elif node.children:
+                stack.append([0, 0, len(leaves)])
+                continue
+            else:
+                start = len(leaves)
+                offset = leaf_index.get(getattr(node, attr, missing), None)
+                if offset is None:
+                    offset, bits = 0, 0
+                    self.ignored_leaves += 1
+                else:
+                    bits = 1
+                    leaves.append(getattr(node, attr))
+
+            if stack and bits:
+                parent = stack[-1]
+                if not parent[1]:
+                    parent[0], parent[1] = offset, bits
+                elif offset >= parent[0]:
+                    parent[1] |= bits << (offset - parent[0])
+                else:
+                    parent[1] = (parent[1] << (parent[0] - offset)) | bits
+                    parent[0] = offset
+
+            if unrooted and bits and not offset:
+                # the clade contains the leaf at bit 0, so the other side
+                # of the edge is used as key
+                bits ^= all_bits
+                if bits:
+                    offset = (bits & -bits).bit_length() - 1
+                    bits >>= offset
+                key, complementary = (offset, bits), True
+            else:
+                key, complementary = (offset, bits), False
+
+            support[key, complementary] = node.support
+            if lengths is not None:
+                lengths[key] = lengths.get(key, 0.0) + node.dist
+            if node_keys is not None:
+                node_keys[node] = key
+            if key not in ranges:
+                ranges[key] = (start, len(leaves), complementary)
+
+        self.keys = set(ranges)
+
+    def contains(self, key, bit):
+        """ Returns True if the leaf at the given bit position is part of
+        the split side represented by key. """
+        offset, bits = key
+        return bit >= offset and bool((bits >> (bit - offset)) & 1)
+
+    def get_size(self, key):
+        """ Returns the number of leaves in the side of the split
+        represented by key. """
+        start, end, complementary = self._ranges[key]
+        if complementary:
+            return len(self.leaves) - (end - start)
+        return end - start
+
+    def is_informative(self, key):
+        """ Returns True if both sides of the split (or the clade, in rooted
+        mode) contain more than one leaf. """
+        size = self.get_size(key)
+        if self.unrooted:
+            return size > 1 and len(self.leaves) - size > 1
+        return size > 1
+
+    def get_unsupported(self, min_support):
+        """ Returns the set of split keys whose support is lower than
+        min_support. In unrooted mode, the support of the node defining the
+        side of the edge with the first sorted leaf value is used, or the
+        other side if no node defines it. """
+        support = self._support
+        if self.unrooted:
+            unsupported = set()
+            for key in self.keys:
+                # empty sides are sorted first
+                first = key != EMPTY_SPLIT and not self.contains(key, self._first_bit)
+                if support.get((key, first), support.get((key, not first), 999999999)) < min_support:
+                    unsupported.add(key)
+            return unsupported
+        return set(key for key in self.keys if support[key, False] < min_support)
+
+    def get_names(self, key):
+        """ Returns the sorted tuple of leaf values in a split. In unrooted
+        mode, a sorted tuple with the two sorted sides of the edge is
+        returned. """
+        start, end, complementary = self._ranges[key]
+        leaves = self.leaves
+        if not self.unrooted:
+            return tuple(sorted(leaves[start:end]))
+        inside = tuple(sorted(leaves[start:end]))
+        outside = tuple(sorted(leaves[:start] + leaves[end:]))
+        return tuple(sorted([inside, outside]))
+
+    def to_names(self, keys):
+        """ Converts a set of split keys into a set of leaf value tuples. """
+        return set(self.get_names(key) for key in keys)
@@ -0,0 +1,288 @@
+# #START_LICENSE###########################################################
+#
+#
+# This file is part of the Environment for Tree Exploration program
+# (ETE).  http://etetoolkit.org
+#
+# ETE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ETE is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ETE.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#                     ABOUT THE ETE PACKAGE
+#                     =====================
+#
+# ETE is distributed under the GPL copyleft license (2008-2015).
+#
+# If you make use of ETE in published work, please cite:
+#
+# Jaime Huerta-Cepas, Joaquin Dopazo and Toni Gabaldon.
+# ETE: a python Environment for Tree Exploration. Jaime BMC
+# Bioinformatics 2010,:24doi:10.1186/1471-2105-11-24
+#
+# Note that extra references to the specific methods implemented in
+# the toolkit may be available in the documentation.
+#
+# More info at http://etetoolkit.org. Contact: huerta@embl.de
+#
+#
+# #END_LICENSE#############################################################
+"""
+Canonical representation of tree topologies.
+
+The canonical newick of a tree is obtained by sorting the children of every
+node by the smallest leaf name under them, so two trees get the same string
+if and only if they have the same topology and leaf names (which should be
+unique). Branch lengths, support values, internal node names and nodes with
+a single child are ignored. In unrooted mode, the tree is hung from the leaf
+with the smallest name, so the position of the root is ignored too.
+
+Canonical newicks are computed in linear time (only the children of each
+node are sorted), and they can be used as keys to count the unique
+topologies of large collections of trees (see :class:`TopologyCounter`).
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import re
+from hashlib import md5
+
+import six
+
+__all__ = ["TopologyCounter", "get_canonical_newick", "get_topology_hash"]
+
+# names with any of these characters are quoted in canonical newicks
+_SPECIAL_CHARS = re.compile(r"[\s()\[\]:;,']")
+
+def _quote(name):
+    if _SPECIAL_CHARS.search(name):
+        return "'%s'" %name.replace("'", "''")
+    return name
+
+def get_canonical_newick(tree, attr="name", unrooted=False):
+    """
+    .. versionadded:: 3.1.2
+
+    Returns the canonical newick of a tree (see
+    :func:`TreeNode.get_canonical_newick`).
+
+    :argument tree: a TreeNode instance.
+
+    :argument name attr: leaf attribute used as leaf name.
+
+    :argument False unrooted: If True, the position of the root is ignored.
+    """
+    top = tree
+    while len(top.children) == 1:
+        top = top.children[0]
+    if not top.children:
+        return "%s;" %_quote("%s" %(getattr(top, attr, ""),))
+
+    # children of each node, sorted from the root (or from the leaf used as
+    # root in unrooted mode)
+    if unrooted:
+        labels = dict((leaf, "%s" %(getattr(leaf, attr, ""),)) for leaf in top.iter_leaves())
+        anchor = min(labels, key=labels.get)
+        parent = {anchor: None}
+        preorder = [anchor]
+        children = {}
+        for node in preorder:
+            neighbors = list(node.children)
+            if node is not top:
+                neighbors.append(node.up)
+            children[node] = [nb for nb in neighbors if nb is not parent[node]]
+            for ch in children[node]:
+                parent[ch] = node
+                preorder.append(ch)
+        root = children[anchor][0]
+    else:
+        labels = {}
+        children = None
+        root = top
+        preorder = list(top.traverse("preorder"))
+
+    # smallest leaf name under each node
+    min_label = {}
+    for node in reversed(preorder):
+        node_children = node.children if children is None else children[node]
+        if node_children:
+            min_label[node] = min(min_label[ch] for ch in node_children)
+        elif node in labels:
+            min_label[node] = labels[node]
+        else:
+            min_label[node] = labels[node] = "%s" %(getattr(node, attr, ""),)
+
+    tokens = []
+    if unrooted:
+        tokens.extend(["(", _quote(labels[anchor]), ","])
+    pending = [root]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, six.string_types):
+            tokens.append(node)
+            continue
+        node_children = node.children if children is None else children[node]
+        # nodes with a single child are skipped
+        while len(node_children) == 1:
+            node = node_children[0]
+            node_children = node.children if children is None else children[node]
+        if not node_children:
+            tokens.append(_quote(labels[node]))
+            continue
+        tokens.append("(")
+        pending.append(")")
+        for i, ch in enumerate(sorted(node_children, key=min_label.get, reverse=True)):
+            if i:
+                pending.append(",")
+            pending.append(ch)
+    if unrooted:
+        tokens.append(")")
+    tokens.append(";")
+    return "".join(tokens)
+
+def get_topology_hash(tree, attr="name", unrooted=False):
+    """
+    .. versionadded:: 3.1.2
+
+    Returns the md5 hex digest of the canonical newick of a tree (see
+    :func:`get_canonical_newick`).
+    """
+    newick = get_canonical_newick(tree, attr=attr, unrooted=unrooted)
+    return md5(newick.encode("utf-8")).hexdigest()
+
+
+class TopologyCounter(object):
+    """
+    .. versionadded:: 3.1.2
+
+    Counts the unique topologies found in a stream of trees (i.e. the
+    samples of a MCMC run), identified by their canonical newick (see
+    :func:`TreeNode.get_canonical_newick`), and reports their frequencies,
+    credible sets and the most frequent (MAP) topology.
+
+    Memory usage is bounded by max_topologies. When a new topology is found
+    and the limit has been reached, the counts of all tracked topologies are
+    decreased by one and those reaching zero are discarded (Misra-Gries
+    summary). Any topology found in more than a 1/(max_topologies+1)
+    fraction of the trees is never discarded, and the counts of tracked
+    topologies are then underestimated by at most the value of the
+    ``error`` attribute (0 while counts are exact).
+
+    :argument False unrooted: If True, trees are compared as unrooted.
+
+    :argument name attr: leaf attribute used as leaf name.
+
+    :argument 100000 max_topologies: max number of topologies tracked at
+      the same time. Use None for no limit.
+
+    :argument 0 newick_format: subnewick format used to read trees given as
+      newick strings.
+
+    **Example:**
+
+    ::
+
+      counter = TopologyCounter(unrooted=True)
+      counter.update(iter_newick("mcmc_samples.nw.gz"))
+      newick, frequency = counter.get_map_topology()
+      credible_set = counter.get_credible_set(0.95)
+
+    """
+
+    def __init__(self, unrooted=False, attr="name", max_topologies=100000, newick_format=0):
+        if max_topologies is not None and max_topologies < 1:
+            raise ValueError("max_topologies must be a positive number")
+        self.unrooted = unrooted
+        self.attr = attr
+        self.max_topologies = max_topologies
+        self.newick_format = newick_format
+        #: number of trees added
+        self.total = 0
+        #: max number of trees missing from the count of any topology
+        self.error = 0
+        self._counts = {}
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __contains__(self, tree):
+        return self._get_key(tree) in self._counts
+
+    def _get_key(self, tree):
+        if isinstance(tree, six.string_types):
+            from .tree import TreeNode
+            tree = TreeNode(tree, format=self.newick_format)
+        return get_canonical_newick(tree, attr=self.attr, unrooted=self.unrooted)
+
+    def add(self, tree):
+        """ Adds a tree (a TreeNode instance or a newick string) and returns
+        its canonical newick. """
+        key = self._get_key(tree)
+        counts = self._counts
+        self.total += 1
+        if key in counts:
+            counts[key] += 1
+        elif self.max_topologies is None or len(counts) < self.max_topologies:
+            counts[key] = 1
+        else:
+            # the new topology and one tree of every tracked topology are
+            # discarded
+            self.error += 1
+            for other, count in list(counts.items()):
+                if count > 1:
+                    counts[other] = count - 1
+                else:
+                    del counts[other]
+        return key
+
+    def update(self, trees):
+        """ Adds all the trees in an iterable. """
+        for tree in trees:
+            self.add(tree)
+
+    def get_count(self, tree):
+        """ Returns the number of times a topology (given as a tree, a newick
+        or a canonical newick) was found. """
+        return self._counts.get(self._get_key(tree), 0)
+
+    def most_common(self, n=None):
+        """ Returns a list of (canonical newick, count) tuples with the n
+        most frequent topologies (all if n is None), sorted by decreasing
+        count. """
+        items = sorted(six.iteritems(self._counts), key=lambda item: (-item[1], item[0]))
+        return items if n is None else items[:n]
+
+    def get_frequencies(self):
+        """ Returns a list of (canonical newick, frequency) tuples with all
+        tracked topologies, sorted by decreasing frequency. """
+        total = float(self.total)
+        return [(newick, count / total) for newick, count in self.most_common()]
+
+    def get_map_topology(self):
+        """ Returns the (canonical newick, frequency) tuple of the most
+        frequent topology, or None if no trees were added. """
+        frequencies = self.get_frequencies()
+        return frequencies[0] if frequencies else None
+
+    def get_credible_set(self, level=0.95):
+        """ Returns the smallest list of (canonical newick, frequency) tuples
+        of the most frequent topologies whose cumulative frequency is at
+        least level (or all tracked topologies if their total frequency is
+        lower). """
+        credible_set = []
+        cumulative = 0.0
+        for newick, freq in self.get_frequencies():
+            if cumulative >= level:
+                break
+            credible_set.append((newick, freq))
+            cumulative += freq
+        return credible_set
@@ -41,16 +41,18 @@ from __future__ import print_function
 
 import random
 import copy
+import gc
 import itertools
 from collections import deque
 from hashlib import md5
-from functools import cmp_to_key
 
 import six
 from six.moves import (cPickle, map, range, zip)
 
 from ..parser.newick import read_newick, write_newick
+from .splits import get_leaf_index, TreeSplits, EMPTY_SPLIT
 from .. import utils
+from .. import numpy
 
 # the following imports are necessary to set fixed styles and faces
 try:
@@ -61,7 +63,7 @@ except ImportError:
 else:
     TREEVIEW = True
 
-__all__ = ["Tree", "TreeNode"]
+__all__ = ["Tree", "TreeNode", "rf_matrix"]
 
 DEFAULT_COMPACT = False
 DEFAULT_SHOWINTERNAL = False
@@ -69,6 +71,9 @@ DEFAULT_DIST = 1.0
 DEFAULT_SUPPORT = 1.0
 DEFAULT_NAME = ""
 
+# Features that every node has, even before its feature set is created
+_BASIC_FEATURES = frozenset(["dist", "support", "name"])
+
 class TreeError(Exception):
     """
     A problem occurred during a TreeNode operation
@@ -119,6 +124,12 @@ class TreeNode(object):
         t3 = Tree('/home/user/myNewickFile.txt')
     """
 
+    # Basic node data is stored in fixed slots. Custom features and any
+    # other attribute go to the instance dictionary, which is only created
+    # when first needed, so plain topology nodes take much less memory.
+    __slots__ = ["_children", "_up", "_dist", "_support", "_img_style",
+                 "_features", "_content", "name", "__dict__", "__weakref__"]
+
     def _get_dist(self):
         return self._dist
     def _set_dist(self, value):
@@ -152,6 +163,14 @@ class TreeNode(object):
         else:
             raise TreeError("Incorrect children type")
 
+    def _get_features(self):
+        # the set of feature names is created on first access
+        if self._features is None:
+            self._features = set(_BASIC_FEATURES)
+        return self._features
+    def _set_features(self, value):
+        self._features = value
+
     def _get_style(self):
         if self._img_style is None:
             self._set_style(None)
@@ -172,6 +191,8 @@ class TreeNode(object):
     up = property(fget=_get_up, fset=_set_up)
     #: A list of children nodes
     children = property(fget=_get_children, fset=_set_children)
+    #: Set of feature names available in this node
+    features = property(fget=_get_features, fset=_set_features)
 
     def _set_face_areas(self, value):
         if isinstance(value, _FaceAreas):
@@ -194,9 +215,11 @@ class TreeNode(object):
         self._dist = DEFAULT_DIST
         self._support = DEFAULT_SUPPORT
         self._img_style = None
-        self.features = set([])
-        # Add basic features
-        self.features.update(["dist", "support", "name"])
+        # Basic features ("dist", "support", "name") are implicit until
+        # the feature set is created
+        self._features = None
+        # persistent leaf content cache (see get_cached_content)
+        self._content = None
         if dist is not None:
             self.dist = dist
         if support is not None:
@@ -211,6 +234,30 @@ class TreeNode(object):
                         quoted_names=quoted_node_names)
 
 
+    def __getstate__(self):
+        # The leaf content cache is not pickled, as it would multiply the
+        # size of pickled trees (it is rebuilt on demand).
+        dict_state, slots_state = _get_node_state(self)
+        slots_state.pop("_content", None)
+        return (dict_state, slots_state)
+
+    def __setstate__(self, state):
+        self._content = None
+        # Trees pickled by versions of ETE not using slots store all their
+        # attributes in a single dictionary.
+        if isinstance(state, tuple):
+            dict_state, slots_state = state
+        else:
+            dict_state, slots_state = state, None
+        for attrs in (dict_state, slots_state):
+            if attrs:
+                for key, value in six.iteritems(attrs):
+                    setattr(self, key, value)
+        if not hasattr(self, "_features"):
+            self._features = None
+        if not hasattr(self, "_img_style"):
+            self._img_style = None
+
     def __nonzero__(self):
         return True
 
@@ -272,14 +319,14 @@ class TreeNode(object):
         Add or update a node's feature.
         """
         setattr(self, pr_name, pr_value)
-        self.features.add(pr_name)
+        if self._features is not None or pr_name not in _BASIC_FEATURES:
+            self.features.add(pr_name)
 
     def add_features(self, **features):
         """
         Add or update several features. """
         for fname, fvalue in six.iteritems(features):
-            setattr(self, fname, fvalue)
-            self.features.add(fname)
+            self.add_feature(fname, fvalue)
 
     def del_feature(self, pr_name):
         """
@@ -514,57 +561,122 @@ class TreeNode(object):
           #       \-J
 
         """
-        def cmp_nodes(x, y):
-            # if several nodes are in the same path of two kept nodes,
-            # only one should be maintained. This prioritize internal
-            # nodes that are already in the to_keep list and then
-            # deeper nodes (closer to the leaves).
-            if n2depth[x] > n2depth[y]:
-                return -1
-            elif n2depth[x] < n2depth[y]:
-                return 1
-            else:
-                return 0
+        keep, children, dists = self._get_pruned_structure(nodes, preserve_branch_length)
+
+        # removed nodes are detached, and the children of kept nodes are
+        # replaced in bulk
+        for node in self.iter_descendants():
+            if node not in keep:
+                node.up = None
+        for node, new_children in six.iteritems(children):
+            old_children = node.children
+            if len(old_children) != len(new_children) or \
+               any(ch1 is not ch2 for ch1, ch2 in zip(old_children, new_children)):
+                node.children = new_children
+                for ch in new_children:
+                    if ch._up is not node:
+                        ch.up = node
+        for node, dist in six.iteritems(dists):
+            node.dist = dist
 
+    def get_pruned_copy(self, nodes, preserve_branch_length=False):
+        """
+        .. versionadded:: 3.1.2
+
+        Returns a pruned copy of this node (see :func:`prune`), leaving the
+        original tree unchanged. Only the retained nodes are copied, so it is
+        much faster than copying a large tree and pruning the copy. As in
+        copy(method="fast"), names, branch lengths and support values are
+        copied, while other node attributes are shared with the original
+        nodes.
+
+        :var nodes: a list of node names or node objects that should be retained
+
+        :param False preserve_branch_length: If True, branch lengths
+          of the removed nodes are transferred (summed up) to the
+          branches of the retained nodes, thus keeping original
+          distances among nodes.
+        """
+        keep, children, dists = self._get_pruned_structure(nodes, preserve_branch_length)
+        return self._fast_copy(children, dists)
+
+    def _get_pruned_structure(self, nodes, preserve_branch_length=False):
+        """ Returns the structure of the tree resulting from prune() without
+        modifying it: the set of kept nodes, a dictionary with the new list of
+        children of each of them, and a dictionary with the new branch length
+        of the kept nodes whose branch length changes. """
         to_keep = set(_translate_nodes(self, *nodes))
-        start, node2path = self.get_common_ancestor(to_keep, get_path=True)
+        if not to_keep:
+            raise TreeError("Nodes are not connected!")
+        # as in get_common_ancestor(), a single node is connected to self
+        seeds = to_keep if len(to_keep) > 1 else to_keep | set([self])
         to_keep.add(self)
 
-        # Calculate which kept nodes are visiting the same nodes in
-        # their path to the common ancestor.
-        n2count = {}
-        n2depth = {}
-        for seed, path in six.iteritems(node2path):
-            for visited_node in path:
-                if visited_node not in n2depth:
-                    depth = visited_node.get_distance(start, topology_only=True)
-                    n2depth[visited_node] = depth
-                if visited_node is not seed:
-                    n2count.setdefault(visited_node, set()).add(seed)
-
-        # if several internal nodes are in the path of exactly the same kept
-        # nodes, only one (the deepest) should be maintain.
-        visitors2nodes = {}
-        for node, visitors in six.iteritems(n2count):
-            # keep nodes connection at least two other nodes
-            if len(visitors)>1:
-                visitor_key = frozenset(visitors)
-                visitors2nodes.setdefault(visitor_key, set()).add(node)
-
-        for visitors, nodes in six.iteritems(visitors2nodes):
-            if not (to_keep & nodes):
-                sorted_nodes = sorted(nodes, key=cmp_to_key(cmp_nodes))
-                to_keep.add(sorted_nodes[0])
-
-        for n in self.get_descendants('postorder'):
-            if n not in to_keep:
-                if preserve_branch_length:
-                    if len(n.children) == 1:
-                        n.children[0].dist += n.dist
-                    elif len(n.children) > 1 and n.up:
-                        n.up.dist += n.dist
-
-                n.delete(prevent_nondicotomic=False)
+        # number of seeds under each node, and its only child containing
+        # seeds (None if there are no seeds under it, False if several
+        # children contain seeds)
+        postorder = list(self.traverse("postorder"))
+        nseeds = {}
+        seed_child = {}
+        for node in postorder:
+            count = 1 if node in seeds else 0
+            child = None
+            nchildren = 0
+            for ch in node._children:
+                if nseeds[ch]:
+                    count += nseeds[ch]
+                    child = ch
+                    nchildren += 1
+            nseeds[node] = count
+            seed_child[node] = child if nchildren < 2 else False
+        if nseeds[self] != len(seeds):
+            raise TreeError("Nodes are not connected!")
+
+        # Internal nodes in the path of the same set of seeds (at least two)
+        # are grouped, and the deepest one of each group is kept unless the
+        # group already contains a kept node. The deepest node of a group is
+        # either the common ancestor of its seeds or the parent of a single
+        # seed with other seeds under it, and the group is made of its
+        # ancestors up to the next node with other seeds under it.
+        extra = []
+        for node, child in six.iteritems(seed_child):
+            if node in to_keep:
+                continue
+            if child is False or (child is not None and child in seeds and nseeds[child] > 1):
+                current = node
+                while True:
+                    parent = current._up
+                    if seed_child[parent] is not current:
+                        extra.append(node)
+                        break
+                    elif parent in to_keep:
+                        break
+                    current = parent
+        to_keep.update(extra)
+
+        # Removed nodes are processed in postorder, so each of them passes
+        # its current children to the end of the children list of its
+        # parent, as in delete().
+        children = {}
+        dists = {}
+        for node in postorder:
+            kept = []
+            moved = []
+            for ch in node._children:
+                if ch in to_keep:
+                    kept.append(ch)
+                else:
+                    moved.extend(children.pop(ch))
+            children[node] = kept + moved if moved else kept
+            if preserve_branch_length and node not in to_keep:
+                dist = dists.pop(node, node.dist)
+                if len(children[node]) == 1:
+                    target = children[node][0]
+                    dists[target] = dists.get(target, target.dist) + dist
+                elif len(children[node]) > 1:
+                    target = node.up
+                    dists[target] = dists.get(target, target.dist) + dist
+        return to_keep, children, dists
 
 
     def swap_children(self):
@@ -1019,6 +1131,28 @@ class TreeNode(object):
                 current = current.up
         return dist
 
+    def build_lca_index(self):
+        """
+        .. versionadded:: 3.1.2
+
+        Returns an :class:`LCAIndex` instance for the subtree under this
+        node, which answers common ancestor, depth and distance queries in
+        constant time. Use it instead of :func:`get_common_ancestor` or
+        :func:`get_distance` when many queries are needed on a tree that is
+        not modified in between.
+
+        **Example:**
+
+        ::
+
+          index = t.build_lca_index()
+          d = index.get_distance("A", "B")
+          matrix = index.leaf_distance_matrix()
+
+        """
+        from .lcaindex import LCAIndex
+        return LCAIndex(self)
+
     def get_farthest_node(self, topology_only=False):
         """
         Returns the node's farthest descendant or ancestor node, and the
@@ -1393,6 +1527,13 @@ class TreeNode(object):
              objects even if attributes point to lambda functions,
              etc.)
 
+           - "fast": The node structure is cloned node by node without
+             any serialisation (fastest). Branch lengths, support values
+             and names are copied, while the values of any other node
+             attribute are shared with the original nodes (shallow
+             copy), so mutable feature values (i.e. lists) should not
+             be modified in place.
+
         """
         method = method.lower()
         if method=="newick":
@@ -1400,64 +1541,165 @@ class TreeNode(object):
         elif method=="newick-extended":
             self.write(features=[], format_root_node=True)
             new_node = self.__class__(self.write(features=[]))
+        elif method == "fast":
+            new_node = self._fast_copy()
         elif method == "deepcopy":
-            parent = self.up
-            self.up = None
-            new_node = copy.deepcopy(self)
-            self.up = parent
+            # parent is unlinked by hand, so cached content is kept
+            parent = self._up
+            self._up = None
+            try:
+                new_node = copy.deepcopy(self)
+            finally:
+                self._up = parent
         elif method == "cpickle":
-            parent = self.up
-            self.up = None
-            new_node = six.moves.cPickle.loads(six.moves.cPickle.dumps(self, 2))
-            self.up = parent
+            parent = self._up
+            self._up = None
+            try:
+                new_node = six.moves.cPickle.loads(six.moves.cPickle.dumps(self, 2))
+            finally:
+                self._up = parent
         else:
             raise TreeError("Invalid copy method")
 
         return new_node
 
+    def _fast_copy(self, children=None, dists=None, copy_values=False):
+        """ Iterative structural clone used by copy(method="fast"). If
+        provided, the children and dists dictionaries are used instead of
+        the current children (only nodes in them are copied) and branch
+        lengths of the copied nodes. If copy_values is True, mutable
+        attribute values (i.e. feature lists) are deep copied too, so the
+        copy does not share any of them with the original tree. """
+        # The cyclic garbage collector is paused while nodes are created, as
+        # it would otherwise scan the growing tree again and again.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            copy_style = copy.copy
+            new_root = None
+            # nodes to clone and the clone of their parent
+            to_visit = [(self, None)]
+            while to_visit:
+                node, new_up = to_visit.pop()
+                cls = node.__class__
+                new = cls.__new__(cls)
+                dict_state, slots_state = _get_node_state(node)
+                if len(slots_state) > len(_NODE_SLOTS):
+                    # slots added by subclasses
+                    for name, value in six.iteritems(slots_state):
+                        setattr(new, name, value)
+                if dict_state:
+                    if copy_values:
+                        dict_state = dict((key, value if isinstance(value, _IMMUTABLE_TYPES)
+                                           else copy.deepcopy(value))
+                                          for key, value in six.iteritems(dict_state))
+                    new.__dict__.update(dict_state)
+                new._dist = node._dist if not dists else dists.get(node, node._dist)
+                new._support = node._support
+                new.name = node.name
+                new._children = []
+                new._content = None
+                features = node._features
+                new._features = set(features) if features is not None else None
+                style = node._img_style
+                new._img_style = copy_style(style) if style is not None else None
+
+                new._up = new_up
+                if new_up is None:
+                    new_root = new
+                else:
+                    new_up._children.append(new)
+                node_children = node._children if children is None else children[node]
+                if node_children:
+                    to_visit.extend([(ch, new) for ch in reversed(node_children)])
+        finally:
+            if gc_enabled:
+                gc.enable()
+        return new_root
+
     def _asciiArt(self, char1='-', show_internal=True, compact=False, attributes=None):
         """
         Returns the ASCII representation of the tree.
 
-        Code based on the PyCogent GPL project.
+        Code based on the PyCogent GPL project. Lines are built without
+        recursion: a first postorder pass computes the size and middle line
+        of each node block, and a second preorder pass appends the prefix
+        of each node to the lines of its block.
         """
         if not attributes:
             attributes = ["name"]
-        node_name = ', '.join(map(str, [getattr(self, v) for v in attributes if hasattr(self, v)]))
 
-        LEN = max(3, len(node_name) if not self.children or show_internal else 3)
-        PAD = ' ' * LEN
-        PA = ' ' * (LEN-1)
-        if not self.is_leaf():
-            mids = []
-            result = []
-            for c in self.children:
-                if len(self.children) == 1:
+        # node -> (name, LEN, number of lines, mid line, mid line of each child)
+        blocks = {}
+        for node in self._iter_descendants_postorder():
+            node_name = ', '.join(map(str, [getattr(node, v) for v in attributes if hasattr(node, v)]))
+            LEN = max(3, len(node_name) if not node.children or show_internal else 3)
+            if node.children:
+                mids = []
+                end = 0
+                for c in node.children:
+                    mids.append(blocks[c][3] + end)
+                    end += blocks[c][2]
+                    if not compact:
+                        end += 1
+                if not compact:
+                    end -= 1
+                mid = int((mids[0] + mids[-1]) / 2)
+                blocks[node] = (node_name, LEN, end, mid, mids)
+            else:
+                blocks[node] = (node_name, LEN, 1, 0, None)
+
+        lines = [[] for _ in range(blocks[self][2])]
+        # lines whose next appended piece loses its first char, as the name
+        # of an internal node may overwrite the first char of its child line
+        trimmed = set()
+        to_visit = [(self, 0, char1)]
+        while to_visit:
+            node, start, char1 = to_visit.pop(-1)
+            node_name, LEN, end, mid, mids = blocks[node]
+            if not node.children:
+                line = char1 + '-' + node_name
+                if start in trimmed:
+                    trimmed.discard(start)
+                    line = line[1:]
+                lines[start].append(line)
+                continue
+
+            PAD = ' ' * LEN
+            PA = ' ' * (LEN-1)
+            (lo, hi) = (mids[0], mids[-1])
+            prefixes = [PAD] * (lo+1) + [PA+'|'] * (hi-lo-1) + [PAD] * (end-hi)
+            prefixes[mid] = char1 + '-'*(LEN-2) + prefixes[mid][-1]
+            if show_internal:
+                stem = prefixes[mid]
+                prefixes[mid] = stem[0] + node_name + stem[len(node_name)+1:]
+            for i in range(end):
+                prefix = prefixes[i]
+                if start + i in trimmed:
+                    trimmed.discard(start + i)
+                    prefix = prefix[1:]
+                lines[start + i].append(prefix)
+            if show_internal and len(node_name) + 1 > LEN:
+                trimmed.add(start + mid)
+
+            ch_start = start
+            children = []
+            for c in node.children:
+                if len(node.children) == 1:
                     char2 = '/'
-                elif c is self.children[0]:
+                elif c is node.children[0]:
                     char2 = '/'
-                elif c is self.children[-1]:
+                elif c is node.children[-1]:
                     char2 = '\\'
                 else:
                     char2 = '-'
-                (clines, mid) = c._asciiArt(char2, show_internal, compact, attributes)
-                mids.append(mid+len(result))
-                result.extend(clines)
+                children.append((c, ch_start, char2))
+                ch_start += blocks[c][2]
                 if not compact:
-                    result.append('')
-            if not compact:
-                result.pop()
-            (lo, hi, end) = (mids[0], mids[-1], len(result))
-            prefixes = [PAD] * (lo+1) + [PA+'|'] * (hi-lo-1) + [PAD] * (end-hi)
-            mid = int((lo + hi) / 2)
-            prefixes[mid] = char1 + '-'*(LEN-2) + prefixes[mid][-1]
-            result = [p+l for (p,l) in zip(prefixes, result)]
-            if show_internal:
-                stem = result[mid]
-                result[mid] = stem[0] + node_name + stem[len(node_name)+1:]
-            return (result, mid)
-        else:
-            return ([char1 + '-' + node_name], 0)
+                    ch_start += 1
+            to_visit.extend(reversed(children))
+
+        return ([''.join(line) for line in lines], blocks[self][3])
 
     def get_ascii(self, show_internal=True, compact=False, attributes=None):
         """
@@ -1567,9 +1809,33 @@ class TreeNode(object):
             should be cached (i.e. name, distance, etc.). When none,
             the whole node instance is cached.
 
+        :param set container_type: type of the containers returned for
+            each node (set, list or frozenset).
+
+        :param True leaves_only: If False, the content of each node also
+            includes the internal nodes under it (and itself).
+
         :param _store: (internal use)
 
-        """
+        .. versionchanged:: 3.1.2
+           frozenset containers. When requested for the leaf nodes under
+           each node (default store_attr and leaves_only), they are kept
+           in a persistent cache attached to each node and shared by all
+           calls, so subsequent calls only compute the content of nodes
+           whose children have changed. Other container types are built
+           again on every call.
+        """
+
+        if container_type is frozenset:
+            if store_attr is None and leaves_only and _store is None:
+                return self._get_persistent_content()
+            content = self.get_cached_content(store_attr, set, leaves_only)
+            for node, values in six.iteritems(content):
+                content[node] = frozenset(values)
+            if _store is not None:
+                _store.update(content)
+                return _store
+            return content
 
         if _store is None:
             _store = {}
@@ -1586,35 +1852,108 @@ class TreeNode(object):
 
             return _val
 
-        for ch in self.children:
-            ch.get_cached_content(store_attr=store_attr,
-                                  container_type=container_type,
-                                  leaves_only=leaves_only,
-                                  _store=_store)
-
-        if self.children:
-            if not leaves_only:
-                val = container_type(get_value(self))
-            else:
-                val = container_type()
-            for ch in self.children:
-                if type(val) == list:
-                    val.extend(_store[ch])
-                if type(val) == set:
-                    val.update(_store[ch])
-
+        # Nodes are visited in postorder, so the content of all children is
+        # available when their parent is processed.
+        for node in self._iter_descendants_postorder():
+            if node.children:
                 if not leaves_only:
+                    val = container_type(get_value(node))
+                else:
+                    val = container_type()
+                for ch in node.children:
                     if type(val) == list:
-                        val.extend(get_value(ch))
+                        val.extend(_store[ch])
                     if type(val) == set:
-                        val.update(get_value(ch))
+                        val.update(_store[ch])
 
-            _store[self] = val
-        else:
-            _store[self] = container_type(get_value(self))
+                    if not leaves_only:
+                        if type(val) == list:
+                            val.extend(get_value(ch))
+                        if type(val) == set:
+                            val.update(get_value(ch))
+
+                _store[node] = val
+            else:
+                _store[node] = container_type(get_value(node))
 
         return _store
 
+    def _get_persistent_content(self):
+        """ Returns the frozenset of leaves under each node, computing only
+        those whose cached content is missing or was built from different
+        children, or that have a descendant in such case. """
+        preorder = []
+        to_visit = [self]
+        while to_visit:
+            node = to_visit.pop()
+            preorder.append(node)
+            to_visit.extend(node._children)
+
+        # nodes are visited in postorder (children first)
+        store = {}
+        changed = set()
+        for node in reversed(preorder):
+            children = node._children
+            cached = node._content
+            # nodes do not define __eq__, so tuples are compared by identity
+            if (type(cached) is _NodeContent and cached.children == tuple(children)
+                and changed.isdisjoint(children)):
+                content = cached.leaves
+            else:
+                if children:
+                    content = frozenset().union(*[store[ch] for ch in children])
+                else:
+                    content = frozenset([node])
+                node._content = _NodeContent(tuple(children), content)
+                changed.add(node)
+            store[node] = content
+        return store
+
+    def get_cached_leaf_ranges(self):
+        """
+        .. versionadded:: 3.1.2
+
+        Memory efficient alternative to :func:`get_cached_content`. Returns
+        a list with all leaves under this node in preorder, and a dictionary
+        mapping each node to a (start, end) tuple, so the leaves under a
+        node are leaves[start:end].
+
+        The result is kept in a persistent cache, which is only reused if
+        the nodes under this node and their children are the same, in the
+        same order.
+        """
+        cached = self._content
+        if type(cached) is _LeafRanges and cached.matches(self):
+            return cached.leaves, cached.ranges
+
+        leaves = []
+        ranges = {}
+        preorder = []
+        for post, node in self.iter_prepostorder():
+            if not post:
+                preorder.append(node)
+                if node._children:
+                    ranges[node] = len(leaves)
+                else:
+                    ranges[node] = (len(leaves), len(leaves) + 1)
+                    leaves.append(node)
+            else:
+                ranges[node] = (ranges[node], len(leaves))
+
+        self._content = _LeafRanges(leaves, ranges, preorder)
+        return leaves, ranges
+
+    def clear_cached_content(self):
+        """
+        .. versionadded:: 3.1.2
+
+        Releases the memory used by the persistent cache of
+        :func:`get_cached_content` and :func:`get_cached_leaf_ranges` in
+        the whole tree containing this node.
+        """
+        for node in self.get_tree_root().traverse():
+            node._content = None
+
     def robinson_foulds(self, t2, attr_t1="name", attr_t2="name",
                         unrooted_trees=False, expand_polytomies=False,
                         polytomy_size_limit=5, skip_large_polytomies=False,
@@ -1657,15 +1996,17 @@ class TreeNode(object):
             raise TreeError("expand_polytomies and unrooted_trees arguments cannot be enabled at the same time")
 
 
-        attrs_t1 = set([getattr(n, attr_t1) for n in ref_t.iter_leaves() if hasattr(n, attr_t1)])
-        attrs_t2 = set([getattr(n, attr_t2) for n in target_t.iter_leaves() if hasattr(n, attr_t2)])
+        leaves_t1 = ref_t.get_leaves()
+        leaves_t2 = target_t.get_leaves()
+        attrs_t1 = set([getattr(n, attr_t1) for n in leaves_t1 if hasattr(n, attr_t1)])
+        attrs_t2 = set([getattr(n, attr_t2) for n in leaves_t2 if hasattr(n, attr_t2)])
         common_attrs = attrs_t1 & attrs_t2
         # release mem
         attrs_t1, attrs_t2 = None, None
 
         # Check for duplicated items (is it necessary? can we optimize? what's the impact in performance?')
-        size1 = len([True for n in ref_t.iter_leaves() if getattr(n, attr_t1, None) in common_attrs])
-        size2 = len([True for n in target_t.iter_leaves() if getattr(n, attr_t2, None) in common_attrs])
+        size1 = len([True for n in leaves_t1 if getattr(n, attr_t1, None) in common_attrs])
+        size2 = len([True for n in leaves_t2 if getattr(n, attr_t2, None) in common_attrs])
         if size1 > len(common_attrs):
             raise TreeError('Duplicated items found in source tree')
         if size2 > len(common_attrs):
@@ -1694,61 +2035,29 @@ class TreeNode(object):
             else:
                 polytomy_correction = max([corr1, corr2])
 
+        # leaf attributes are mapped to bit positions, so every clade is
+        # represented by a single integer bitset computed in one postorder
+        # traversal (see coretype.splits)
+        leaf_index = get_leaf_index([getattr(n, attr_t1) for n in leaves_t1
+                                     if getattr(n, attr_t1, None) in common_attrs])
+        leaves_t1, leaves_t2 = None, None
+        target_splits = [TreeSplits(t2, leaf_index, attr=attr_t2, unrooted=unrooted_trees)
+                         for t2 in target_trees]
+
         min_comparison = None
         for t1 in ref_trees:
-            t1_content = t1.get_cached_content()
-            t1_leaves = t1_content[t1]
-            if unrooted_trees:
-                edges1 = set([
-                        tuple(sorted([tuple(sorted([getattr(n, attr_t1) for n in content if hasattr(n, attr_t1) and getattr(n, attr_t1) in common_attrs])),
-                                      tuple(sorted([getattr(n, attr_t1) for n in t1_leaves-content if hasattr(n, attr_t1) and getattr(n, attr_t1) in common_attrs]))]))
-                        for content in six.itervalues(t1_content)])
-                edges1.discard(((),()))
-            else:
-                edges1 = set([
-                        tuple(sorted([getattr(n, attr_t1) for n in content if hasattr(n, attr_t1) and getattr(n, attr_t1) in common_attrs]))
-                        for content in six.itervalues(t1_content)])
-                edges1.discard(())
-
-            if min_support_t1:
-                support_t1 = dict([
-                        (tuple(sorted([getattr(n, attr_t1) for n in content if hasattr(n, attr_t1) and getattr(n, attr_t1) in common_attrs])), branch.support)
-                        for branch, content in six.iteritems(t1_content)])
-
-            for t2 in target_trees:
-                t2_content = t2.get_cached_content()
-                t2_leaves = t2_content[t2]
-                if unrooted_trees:
-                    edges2 = set([
-                            tuple(sorted([
-                                        tuple(sorted([getattr(n, attr_t2) for n in content if hasattr(n, attr_t2) and getattr(n, attr_t2) in common_attrs])),
-                                        tuple(sorted([getattr(n, attr_t2) for n in t2_leaves-content if hasattr(n, attr_t2) and getattr(n, attr_t2) in common_attrs]))]))
-                            for content in six.itervalues(t2_content)])
-                    edges2.discard(((),()))
-                else:
-                    edges2 = set([
-                            tuple(sorted([getattr(n, attr_t2) for n in content if hasattr(n, attr_t2) and getattr(n, attr_t2) in common_attrs]))
-                            for content in six.itervalues(t2_content)])
-                    edges2.discard(())
-
-                if min_support_t2:
-                    support_t2 = dict([
-                        (tuple(sorted(([getattr(n, attr_t2) for n in content if hasattr(n, attr_t2) and getattr(n, attr_t2) in common_attrs]))), branch.support)
-                        for branch, content in six.iteritems(t2_content)])
+            splits1 = TreeSplits(t1, leaf_index, attr=attr_t1, unrooted=unrooted_trees)
+            edges1 = _get_valid_splits(splits1)
 
+            for splits2 in target_splits:
+                edges2 = _get_valid_splits(splits2)
 
                 # if a support value is passed as a constraint, discard lowly supported branches from the analysis
                 discard_t1, discard_t2 = set(), set()
-                if min_support_t1 and unrooted_trees:
-                    discard_t1 = set([p for p in edges1 if support_t1.get(p[0], support_t1.get(p[1], 999999999)) < min_support_t1])
-                elif min_support_t1:
-                    discard_t1 = set([p for p in edges1 if support_t1[p] < min_support_t1])
-
-                if min_support_t2 and unrooted_trees:
-                    discard_t2 = set([p for p in edges2 if support_t2.get(p[0], support_t2.get(p[1], 999999999)) < min_support_t2])
-                elif min_support_t2:
-                    discard_t2 = set([p for p in edges2 if support_t2[p] < min_support_t2])
-
+                if min_support_t1:
+                    discard_t1 = splits1.get_unsupported(min_support_t1) & edges1
+                if min_support_t2:
+                    discard_t2 = splits2.get_unsupported(min_support_t2) & edges2
 
                 #rf = len(edges1 ^ edges2) - (len(discard_t1) + len(discard_t2)) - polytomy_correction # poly_corr is 0 if the flag is not enabled
                 #rf = len((edges1-discard_t1) ^ (edges2-discard_t2)) - polytomy_correction
@@ -1760,8 +2069,8 @@ class TreeNode(object):
                 if unrooted_trees:
                     # thought this may work, but it does not, still I don't see why
                     #max_parts = (len(common_attrs)*2) - 6 - len(discard_t1) - len(discard_t2)
-                    max_parts = (len([p for p in edges1 - discard_t1 if len(p[0])>1 and len(p[1])>1]) +
-                                 len([p for p in edges2 - discard_t2 if len(p[0])>1 and len(p[1])>1]))
+                    max_parts = (len([p for p in edges1 - discard_t1 if splits1.is_informative(p)]) +
+                                 len([p for p in edges2 - discard_t2 if splits2.is_informative(p)]))
                 else:
                     # thought this may work, but it does not, still I don't see why
                     #max_parts = (len(common_attrs)*2) - 4 - len(discard_t1) - len(discard_t2)
@@ -1769,14 +2078,21 @@ class TreeNode(object):
                     # Otherwise we need to count the actual number of valid
                     # partitions in each tree -2 is to avoid counting the root
                     # partition of the two trees (only needed in rooted trees)
-                    max_parts = (len([p for p in edges1 - discard_t1 if len(p)>1]) +
-                                 len([p for p in edges2 - discard_t2 if len(p)>1])) - 2
-
-                    # print max_parts
+                    max_parts = (len([p for p in edges1 - discard_t1 if splits1.is_informative(p)]) +
+                                 len([p for p in edges2 - discard_t2 if splits2.is_informative(p)])) - 2
 
                 if not min_comparison or min_comparison[0] > rf:
-                    min_comparison = [rf, max_parts, common_attrs, edges1, edges2, discard_t1, discard_t2]
-
+                    min_comparison = [rf, max_parts, common_attrs, edges1, edges2, discard_t1, discard_t2,
+                                      splits1, splits2]
+
+        # splits are translated into tuples of sorted leaf attributes only
+        # for the best comparison
+        splits1, splits2 = min_comparison[7:]
+        min_comparison = min_comparison[:7]
+        min_comparison[3] = splits1.to_names(min_comparison[3])
+        min_comparison[4] = splits2.to_names(min_comparison[4])
+        min_comparison[5] = splits1.to_names(min_comparison[5])
+        min_comparison[6] = splits2.to_names(min_comparison[6])
         return min_comparison
 
 
@@ -2019,6 +2335,9 @@ class TreeNode(object):
         The id is, by default, calculated based on the terminal node's names. Any
         other node attribute could be used instead.
 
+        Note that the cost of this method grows quadratically with the size
+        of the tree. Use :func:`get_topology_hash` for large trees or large
+        collections of trees.
 
         '''
         edge_keys = []
@@ -2028,6 +2347,81 @@ class TreeNode(object):
             edge_keys.append(sorted([k1, k2]))
         return md5(str(sorted(edge_keys)).encode('utf-8')).hexdigest()
 
+    def get_canonical_newick(self, attr="name", unrooted=False):
+        """
+        .. versionadded:: 3.1.2
+
+        Returns a newick string representing the topology of the tree under
+        this node, in which the children of every node are sorted by the
+        smallest leaf name under them. Two trees with the same topology and
+        leaf names (which should be unique) produce the same string. Branch
+        lengths, support values, internal node names and nodes with a single
+        child are ignored. It is computed in linear time.
+
+        :argument name attr: leaf attribute used as leaf name.
+
+        :argument False unrooted: If True, the tree is written as hung from
+          the leaf with the smallest name, so the position of the root is
+          ignored.
+
+        **Example:**
+
+        ::
+
+          t = Tree("((C,(B,A)),D);")
+          print(t.get_canonical_newick())
+          # (((A,B),C),D);
+          print(t.get_canonical_newick(unrooted=True))
+          # (A,(B,(C,D)));
+
+        """
+        from .topology import get_canonical_newick
+        return get_canonical_newick(self, attr=attr, unrooted=unrooted)
+
+    def get_topology_hash(self, attr="name", unrooted=False):
+        """
+        .. versionadded:: 3.1.2
+
+        Returns the md5 hex digest of the canonical newick of the tree (see
+        :func:`get_canonical_newick`), a linear time alternative to
+        :func:`get_topology_id`. See also :class:`TopologyCounter`.
+
+        :argument name attr: leaf attribute used as leaf name.
+
+        :argument False unrooted: If True, the position of the root is
+          ignored.
+        """
+        from .topology import get_topology_hash
+        return get_topology_hash(self, attr=attr, unrooted=unrooted)
+
+    def map_split_support(self, trees, method="frequency", attr="name", unrooted=False,
+                          n_jobs=1):
+        """
+        .. versionadded:: 3.1.2
+
+        Sets the support value of every node in the tree (but the root) to
+        the fraction of trees in a collection (i.e. bootstrap replicates
+        with the same leaves) containing its split, or to its transfer
+        bootstrap expectation. Trees are read one at a time, so they can
+        be streamed from a file (see :func:`ete3.parser.newick.iter_newick`).
+
+        :argument trees: an iterable of TreeNode instances or newick strings.
+
+        :argument frequency method: ``frequency`` or ``transfer`` (see
+          :func:`ete3.coretype.consensus.map_split_support`).
+
+        :argument name attr: leaf attribute used as leaf name.
+
+        :argument False unrooted: If True, trees are compared as unrooted.
+
+        :argument 1 n_jobs: number of processes used to read the trees.
+
+        :returns: the number of trees read.
+        """
+        from .consensus import map_split_support
+        return map_split_support(self, trees, method=method, attr=attr, unrooted=unrooted,
+                                 n_jobs=n_jobs)
+
     # def get_partitions(self):
     #     """
     #     .. versionadded: 2.1
@@ -2462,6 +2856,150 @@ class TreeNode(object):
         _ph.call()
 
 
+class _NodeContent(object):
+    """ Leaf content cache stored in the _content slot of a node, with the
+    children it was computed from. """
+    __slots__ = ["children", "leaves"]
+
+    def __init__(self, children, leaves):
+        self.children = children
+        self.leaves = leaves
+
+class _LeafRanges(object):
+    """ Leaf range cache stored in the _content slot of a node, with the
+    preorder of the nodes it was computed from. """
+    __slots__ = ["leaves", "ranges", "preorder", "sizes"]
+
+    def __init__(self, leaves, ranges, preorder):
+        self.leaves = leaves
+        self.ranges = ranges
+        self.preorder = preorder
+        self.sizes = [len(node._children) for node in preorder]
+
+    def matches(self, root):
+        """ Returns True if the subtree under root has the same nodes in
+        the same preorder, with the same number of children, as the tree
+        the cache was computed from. Such trees have the same topology. """
+        preorder, sizes = self.preorder, self.sizes
+        to_visit = [root]
+        pos = 0
+        while to_visit:
+            node = to_visit.pop()
+            if (pos == len(preorder) or node is not preorder[pos]
+                or len(node._children) != sizes[pos]):
+                return False
+            pos += 1
+            to_visit.extend(reversed(node._children))
+        return pos == len(preorder)
+
+def _get_node_state(node):
+    """ Returns the attributes of a node as a tuple containing its instance
+    dictionary (or None) and a dictionary of slot values. """
+    if _object_getstate is not None:
+        state = _object_getstate(node)
+        if isinstance(state, tuple):
+            return state
+        return state, {}
+    # Old python versions can't tell whether the instance dictionary exists
+    # without creating it.
+    slots_state = {}
+    for cls in type(node).__mro__:
+        for name in getattr(cls, "__slots__", ()):
+            if name not in ("__dict__", "__weakref__") and hasattr(node, name):
+                slots_state[name] = getattr(node, name)
+    return node.__dict__ or None, slots_state
+
+_object_getstate = getattr(object, "__getstate__", None)
+# attribute values shared by _fast_copy() even if copy_values is True
+_IMMUTABLE_TYPES = six.string_types + six.integer_types + (float, bool, type(None), frozenset)
+_NODE_SLOTS = [name for name in TreeNode.__slots__ if name not in ("__dict__", "__weakref__")]
+
+def _get_valid_splits(splits):
+    """ Returns the split keys of a TreeSplits instance, excluding the empty
+    split (rooted mode) or the split with no leaves at any side (unrooted
+    mode). """
+    keys = set(splits.keys)
+    if not splits.unrooted or not splits.all_bits:
+        keys.discard(EMPTY_SPLIT)
+    return keys
+
+def rf_matrix(trees, attr="name", unrooted=False, n_jobs=1):
+    """
+    .. versionadded:: 3.1.2
+
+    Returns the all-against-all matrix of Robinson-Foulds distances among a
+    list of trees containing the same leaves (i.e. a set of bootstrap
+    trees). Each tree is parsed and split only once, so this is much faster
+    than calling :func:`TreeNode.robinson_foulds` for every pair of trees.
+
+    :argument trees: a list of TreeNode instances or newick strings.
+
+    :argument name attr: leaf attribute used as leaf name.
+
+    :argument False unrooted: If True, trees are compared as unrooted.
+      Otherwise, as in :func:`TreeNode.robinson_foulds`, trees with more
+      than two children at the root raise TreeError.
+
+    :argument 1 n_jobs: number of processes used to fill the matrix. If
+      None, all available CPUs are used.
+
+    :returns: a symmetric NxN numpy array of integers (or a list of lists if
+      numpy is not available) in which cell i,j is the RF distance between
+      trees i and j.
+    """
+    trees = [TreeNode(t) if isinstance(t, six.string_types) else t for t in trees]
+    if not trees:
+        return numpy.zeros((0, 0), dtype=int) if numpy is not None else []
+
+    leaf_names = [getattr(n, attr, None) for n in trees[0].iter_leaves()]
+    leaf_index = get_leaf_index(leaf_names)
+    if len(leaf_index) != len(leaf_names):
+        raise TreeError("Duplicated items found in tree")
+
+    tree_splits = []
+    for t in trees:
+        if not unrooted and len(t.children) > 2:
+            raise TreeError("Unrooted tree found! You may want to activate the unrooted flag.")
+        splits = TreeSplits(t, leaf_index, attr=attr, unrooted=unrooted)
+        if (splits.ignored_leaves or len(splits.leaves) != len(leaf_index)
+            or len(set(splits.leaves)) != len(leaf_index)):
+            raise TreeError("All trees must contain the same leaves")
+        tree_splits.append(_get_valid_splits(splits))
+
+    # split keys are replaced by integer ids, which are faster to compare
+    # and to send to other processes
+    split_ids = {}
+    tree_splits = [frozenset([split_ids.setdefault(key, len(split_ids)) for key in keys])
+                   for keys in tree_splits]
+    split_ids = None
+
+    if n_jobs == 1 or len(trees) < 3:
+        rows = [_rf_matrix_row(tree_splits, i) for i in range(len(trees))]
+    else:
+        # rows get shorter as i grows, so they are sent one by one to
+        # balance the load among processes
+        rows = [row for chunk_rows in utils.imap_chunks(_rf_matrix_rows, tree_splits,
+                                                        range(len(trees)), n_jobs)
+                for row in chunk_rows]
+
+    matrix = [[0] * len(trees) for _ in range(len(trees))]
+    for i, row in enumerate(rows):
+        for j, rf in enumerate(row, i + 1):
+            matrix[i][j] = matrix[j][i] = rf
+
+    if numpy is not None:
+        return numpy.array(matrix, dtype=int)
+    return matrix
+
+def _rf_matrix_row(tree_splits, i):
+    """ Returns the RF distances from tree i to all the trees after it. """
+    splits1 = tree_splits[i]
+    return [len(splits1) + len(splits2) - 2 * len(splits1 & splits2)
+            for splits2 in tree_splits[i+1:]]
+
+def _rf_matrix_rows(tree_splits, rows):
+    return [_rf_matrix_row(tree_splits, i) for i in rows]
+
 def _translate_nodes(root, *nodes):
     name2node = dict([ [n, None] for n in nodes if type(n) is str])
     for n in root.traverse():
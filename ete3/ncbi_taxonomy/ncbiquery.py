@@ -51,19 +51,46 @@ except ImportError:
     # python 3 support
     import pickle
 
-from collections import defaultdict, Counter
+from collections import defaultdict, Counter, OrderedDict, namedtuple
 
 import sqlite3
 import math
+import mmap
+import array
+import struct
 import tarfile
+import threading
+import operator
+import zlib
 import six
 from six.moves import map
+from six.moves.urllib.request import pathname2url
 import warnings
 
+from .. import numpy
+from ..utils import imap_chunks
+
+try:
+    from itertools import accumulate
+except ImportError:
+    # python 2
+    def accumulate(values):
+        total = 0
+        for v in values:
+            total += v
+            yield total
+
 
 __all__ = ["NCBITaxa", "is_taxadb_up_to_date"]
 
 DB_VERSION = 2
+# max number of bound parameters per query (SQLite builds before 3.32
+# do not allow more than 999)
+SQL_CHUNK_SIZE = 900
+# default max number of entries in each NCBITaxa lookup cache
+DEFAULT_CACHE_SIZE = 100000
+# max number of compressed trigram postings kept during fuzzy name searches
+FUZZY_POSTINGS_CACHE_SIZE = 2000
 DEFAULT_TAXADB = os.path.join(os.environ.get('HOME', '/'), '.etetoolkit', 'taxa.sqlite')
 
 
@@ -88,14 +115,631 @@ def is_taxadb_up_to_date(dbfile=DEFAULT_TAXADB):
     return True
 
 
+TRAVERSE_INDEX_VERSION = 2
+
+def build_traverse_index(prepostorder, index_file, nspecies=0):
+    """Writes a binary index of the NCBI taxonomy tree, which can be memory
+    mapped by NCBITaxa to get the descendants of any taxid.
+
+    The file contains a header with the index version, the number of rows
+    of the species table it was built from, the length of the traversal
+    and the size of the offset table, followed by the pre and
+    postorder traversal of the tree (internal nodes are found twice and
+    leaves once) and, for each taxid, the position of its first and last
+    occurrence in the traversal (-1 if not present). All values are
+    native 32 bit integers.
+
+    The index is written to a temporary file that then replaces
+    index_file, so processes that have the previous index memory mapped
+    never read a partially written file.
+
+    :param prepostorder: list of taxids in pre and postorder.
+
+    :param index_file: path of the output file.
+
+    :param 0 nspecies: number of rows of the species table (see
+        _count_species_rows()), used to detect indexes left by databases
+        updated by other versions.
+    """
+    tmp_file = "%s.%d.%d.tmp" %(index_file, os.getpid(), threading.current_thread().ident)
+    try:
+        with open(tmp_file, "wb") as OUT:
+            for values in _get_traverse_index_arrays(prepostorder, nspecies):
+                values.tofile(OUT)
+        _replace_file(tmp_file, index_file)
+    except:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+def _get_traverse_index_arrays(prepostorder, nspecies):
+    """ Returns the header, traversal and offset table arrays of the index
+    written by build_traverse_index(). """
+    traverse = array.array('i', prepostorder)
+    max_taxid = max(traverse) if traverse else 0
+    offsets = array.array('i', [-1]) * (2 * (max_taxid + 1))
+    for pos, taxid in enumerate(traverse):
+        if offsets[2 * taxid] == -1:
+            offsets[2 * taxid] = pos
+        offsets[2 * taxid + 1] = pos
+    header = array.array('i', [TRAVERSE_INDEX_VERSION, nspecies, len(traverse), max_taxid + 1])
+    return header, traverse, offsets
+
+def _count_species_rows(db):
+    """ Returns the number of rows inserted in the species table. """
+    return db.execute("SELECT MAX(rowid) FROM species").fetchone()[0] or 0
+
+try:
+    _replace_file = os.replace
+except AttributeError:
+    # python 2 (rename replaces existing files in POSIX systems)
+    _replace_file = os.rename
+
+
+class _TraverseIndex(object):
+    """
+    Read only access to a memory mapped index created with
+    build_traverse_index(), or to the same index built in memory from a
+    traversal (prepostorder) if index_file is None.
+    """
+    _HEADER = struct.Struct('4i')
+
+    def __init__(self, index_file, prepostorder=None, nspecies=0):
+        if index_file is None:
+            if six.PY2:
+                self._mm = b''.join(values.tostring() for values in
+                                    _get_traverse_index_arrays(prepostorder, nspecies))
+            else:
+                self._mm = b''.join(values.tobytes() for values in
+                                    _get_traverse_index_arrays(prepostorder, nspecies))
+        else:
+            with open(index_file, "rb") as INDEX:
+                self._mm = mmap.mmap(INDEX.fileno(), 0, access=mmap.ACCESS_READ)
+        version = struct.unpack_from('i', self._mm, 0)[0]
+        if version != TRAVERSE_INDEX_VERSION:
+            self.close()
+            raise ValueError("Unsupported taxonomy index version: %s" %index_file)
+        _, self.nspecies, self._size, self._table_size = self._HEADER.unpack_from(self._mm, 0)
+        self._itemsize = array.array('i').itemsize
+        self._traverse_pos = self._HEADER.size
+        self._offsets_pos = self._traverse_pos + self._size * self._itemsize
+        self._pair = struct.Struct('2i')
+
+    def get_range(self, taxid):
+        """ Returns the positions of the first and last occurrence of taxid
+        in the traversal, or None if taxid is not in the tree. """
+        if not 0 <= taxid < self._table_size:
+            return None
+        start, end = self._pair.unpack_from(self._mm, self._offsets_pos + 2 * taxid * self._itemsize)
+        if start == -1:
+            return None
+        return start, end
+
+    def get_traverse(self, start, end):
+        """ Returns the traversal slice from start to end (both included). """
+        values = array.array('i')
+        data = self._mm[self._traverse_pos + start * self._itemsize:
+                        self._traverse_pos + (end + 1) * self._itemsize]
+        if six.PY2:
+            values.fromstring(data)
+        else:
+            values.frombytes(data)
+        return values
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+
+
+_TRIGRAM_SLICES = {}
+
+def _name_trigrams(name):
+    """ Returns the set of character trigrams of a lowercase name, padded
+    with two spaces at the beginning and one at the end. """
+    padded = "  " + name + " "
+    slices = _TRIGRAM_SLICES.get(len(padded))
+    if slices is None:
+        slices = [slice(i, i + 3) for i in range(len(padded) - 2)]
+        _TRIGRAM_SLICES[len(padded)] = slices
+    return set(map(padded.__getitem__, slices))
+
+def _encode_postings(ids):
+    """ Compresses a sorted array of name ids as zlib compressed deltas. """
+    deltas = array.array('i', ids[:1])
+    deltas.extend(map(operator.sub, ids[1:], ids[:-1]))
+    if six.PY2:
+        data = deltas.tostring()
+    else:
+        data = deltas.tobytes()
+    return sqlite3.Binary(zlib.compress(data, 1))
+
+def _decode_postings(blob):
+    """ Returns an iterator over the name ids encoded by _encode_postings(). """
+    deltas = array.array('i')
+    if six.PY2:
+        deltas.fromstring(zlib.decompress(blob))
+    else:
+        deltas.frombytes(zlib.decompress(blob))
+    return accumulate(deltas)
+
+def _levenshtein(a, b, max_dist):
+    """ Returns the edit distance between a and b, or max_dist + 1 if it
+    is larger than max_dist. Only the diagonal band of max_dist cells at
+    each side of the dynamic programming matrix is computed. """
+    too_far = max_dist + 1
+    if abs(len(a) - len(b)) > max_dist:
+        return too_far
+    size = len(b)
+    previous = [j if j <= max_dist else too_far for j in range(size + 1)]
+    for i, char_a in enumerate(a, 1):
+        current = [too_far] * (size + 1)
+        if i <= max_dist:
+            current[0] = i
+        row_min = current[0]
+        for j in range(max(1, i - max_dist), min(size, i + max_dist) + 1):
+            dist = min(previous[j] + 1, current[j - 1] + 1,
+                       previous[j - 1] + (char_a != b[j - 1]))
+            current[j] = dist
+            if dist < row_min:
+                row_min = dist
+        if row_min > max_dist:
+            return too_far
+        previous = current
+    return min(previous[size], too_far)
+
+def build_fuzzy_index(dbfile):
+    """Builds the trigram index of scientific names and synonyms used by
+    the fuzzy name search of NCBITaxa, and stores it in the name_trigram
+    table of the taxonomy database.
+
+    Each row contains a trigram of lowercase names, the number of names
+    containing it and the sorted ids of those names, compressed as zlib
+    deltas. Ids of scientific names are their taxids, and ids of synonyms
+    are their negative rowids in the synonym table.
+
+    :param dbfile: path to the taxonomy database.
+    """
+    db = sqlite3.connect(dbfile, isolation_level=None)
+    db.execute("PRAGMA synchronous = OFF")
+    db.execute("PRAGMA journal_mode = MEMORY")
+    try:
+        postings = defaultdict(lambda: array.array('i'))
+        # names are read in increasing id order, so postings are sorted
+        synonyms = db.execute("SELECT -rowid, spname FROM synonym ORDER BY rowid DESC")
+        species = db.execute("SELECT taxid, spname FROM species ORDER BY taxid")
+        for rows in [synonyms, species]:
+            for name_id, name in rows:
+                for gram in _name_trigrams(name.lower()):
+                    postings[gram].append(name_id)
+
+        db.execute("BEGIN")
+        try:
+            db.execute("DROP TABLE IF EXISTS name_trigram")
+            db.execute("CREATE TABLE name_trigram (trigram TEXT PRIMARY KEY, size INT, postings BLOB)")
+            db.executemany("INSERT INTO name_trigram (trigram, size, postings) VALUES (?, ?, ?);",
+                           ((gram, len(ids), _encode_postings(ids))
+                            for gram, ids in six.iteritems(postings)))
+            db.execute("COMMIT")
+        except:
+            db.execute("ROLLBACK")
+            raise
+    finally:
+        db.close()
+
+
+class ConnectionPool(object):
+    """
+    .. versionadded:: 3.1.2
+
+    Provides one SQLite connection per thread to a taxonomy database, so
+    a single NCBITaxa instance (or several ones using the same database)
+    can be used from many threads without re-opening the database on
+    each call. Use get_connection_pool() to get the pool shared by all
+    NCBITaxa instances.
+
+    :param dbfile: path to the taxonomy database.
+
+    :param False read_only: If True, the database is opened in read
+        only and immutable mode, which avoids file locking. The database
+        must not be modified while such connections are open (except
+        through NCBITaxa.update_taxonomy_database()).
+    """
+
+    def __init__(self, dbfile, read_only=False):
+        self.dbfile = dbfile
+        self.read_only = read_only
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._pid = os.getpid()
+
+    @property
+    def generation(self):
+        """ Number of times the pool has been reset. Data read from the
+        database before the generation changed may be outdated. """
+        return self._generation
+
+    def get(self):
+        """ Returns the connection of the current thread """
+        if self._pid != os.getpid():
+            # connections inherited from a parent process (i.e. by
+            # multiprocessing workers) must not be used nor closed
+            self._local = threading.local()
+            self._lock = threading.Lock()
+            self._pid = os.getpid()
+        local = self._local
+        generation = self._generation
+        if getattr(local, "generation", None) != generation:
+            # connections are only closed by the thread using them
+            stale = getattr(local, "connection", None)
+            if stale is not None:
+                stale.close()
+            local.connection = self._open()
+            local.generation = generation
+        return local.connection
+
+    def _open(self):
+        if self.read_only:
+            uri = "file:%s?mode=ro&immutable=1" %pathname2url(os.path.abspath(self.dbfile))
+            db = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            db.execute("PRAGMA query_only = 1")
+        else:
+            db = sqlite3.connect(self.dbfile, check_same_thread=False)
+        # memory mapped reads share the OS page cache among connections
+        db.execute("PRAGMA mmap_size = 268435456")
+        db.execute("PRAGMA temp_store = MEMORY")
+        return db
+
+    def reset(self):
+        """ Marks all connections as stale. Each thread closes its own
+        connection and opens a new one the next time it calls get(), so
+        changes in the database file become visible without closing
+        connections in use by other threads. """
+        with self._lock:
+            self._generation += 1
+
+_CONNECTION_POOLS = {}
+_CONNECTION_POOLS_LOCK = threading.Lock()
+
+def get_connection_pool(dbfile, read_only=False):
+    """
+    .. versionadded:: 3.1.2
+
+    Returns the ConnectionPool shared by all NCBITaxa instances using
+    the same database file and access mode.
+    """
+    key = (os.path.abspath(dbfile), read_only)
+    with _CONNECTION_POOLS_LOCK:
+        if key not in _CONNECTION_POOLS:
+            _CONNECTION_POOLS[key] = ConnectionPool(dbfile, read_only=read_only)
+        return _CONNECTION_POOLS[key]
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+class _LRUCache(object):
+    """
+    A thread safe, size bounded mapping discarding the least recently used
+    entries first, with hit and miss counters. A maxsize of 0 disables
+    the cache.
+    """
+    _MISSING = object()
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.pop(key, self._MISSING)
+            if value is self._MISSING:
+                self.misses += 1
+                return default
+            # re-inserted as the most recently used entry
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._data))
+
+
+class _TaxaArrays(object):
+    """
+    In memory copy of the parent, rank and name columns of the species
+    table, stored as numpy arrays indexed by taxid. Used by NCBITaxa when
+    created with preload=True.
+    """
+
+    def __init__(self, db):
+        if numpy is None:
+            raise RuntimeError("numpy is required to preload the NCBI taxonomy. Please install it and try again")
+
+        max_taxid = db.execute('SELECT MAX(taxid) FROM species').fetchone()[0] or 0
+        size = max_taxid + 1
+        self.parent = numpy.zeros(size, dtype=numpy.int32)
+        # rank code of each taxid, or -1 if the taxid does not exist
+        self.rank = numpy.full(size, -1, dtype=numpy.int16)
+        self.rank_names = []
+        name_len = numpy.zeros(size, dtype=numpy.int64)
+        rank2code = {}
+        names = []
+        self.common = {}
+
+        result = db.execute('SELECT taxid, parent, rank, spname, common FROM species ORDER BY taxid')
+        for taxid, parent, rank, spname, common in result:
+            if rank not in rank2code:
+                rank2code[rank] = len(self.rank_names)
+                self.rank_names.append(rank)
+            self.rank[taxid] = rank2code[rank]
+            # the root node has no parent (or is its own parent)
+            if parent != '' and parent is not None and parent != taxid:
+                self.parent[taxid] = parent
+            name = spname.encode("utf-8")
+            name_len[taxid] = len(name)
+            names.append(name)
+            if common:
+                self.common[taxid] = common
+
+        # all scientific names are concatenated in taxid order
+        self.names = b''.join(names)
+        self.name_offset = numpy.zeros(size + 1, dtype=numpy.int64)
+        numpy.cumsum(name_len, out=self.name_offset[1:])
+
+        # number of taxa in the lineage of each taxid
+        self.lineage_size = numpy.zeros(size, dtype=numpy.int16)
+        taxids = numpy.nonzero(self.rank >= 0)[0].astype(numpy.int32)
+        current = taxids
+        while len(current):
+            self.lineage_size[taxids] += 1
+            current = self.parent[current]
+            taxids = taxids[current > 0]
+            current = current[current > 0]
+
+        self.merged = dict(db.execute('SELECT taxid_old, taxid_new FROM merged').fetchall())
+
+    def get_valid_ids(self, taxids):
+        """ Returns a numpy array with all the taxids found in the taxonomy """
+        valid = []
+        size = len(self.rank)
+        for taxid in taxids:
+            try:
+                taxid = int(taxid)
+            except (ValueError, TypeError):
+                continue
+            if 0 < taxid < size:
+                valid.append(taxid)
+        valid = numpy.array(valid, dtype=numpy.int32)
+        return valid[self.rank[valid] >= 0]
+
+    def get_name(self, taxid):
+        return self.names[self.name_offset[taxid]:self.name_offset[taxid+1]].decode("utf-8")
+
+    def get_rank(self, taxid):
+        return self.rank_names[self.rank[taxid]]
+
+    def get_lineage(self, taxid):
+        """ Returns the lineage of a single taxid, or None if not found """
+        if not 0 < taxid < len(self.rank) or self.rank[taxid] < 0:
+            return None
+        lineage = []
+        parent = self.parent
+        while taxid:
+            lineage.append(taxid)
+            taxid = int(parent[taxid])
+        lineage.reverse()
+        return lineage
+
+    def get_lineages(self, taxids):
+        """ Returns the lineage of each taxid in the taxids array, from the
+        root to the taxid itself. """
+        if not len(taxids):
+            return []
+        sizes = self.lineage_size[taxids]
+        track = [taxids]
+        current = taxids
+        for _ in range(int(sizes.max()) - 1):
+            current = self.parent[current]
+            track.append(current)
+        lineages = []
+        for size, lineage in zip(sizes.tolist(), numpy.vstack(track).T.tolist()):
+            lineage = lineage[:size]
+            lineage.reverse()
+            lineages.append(lineage)
+        return lineages
+
+    def get_common_ancestor(self, taxids):
+        """ Returns the last common ancestor of all the taxids in the taxids
+        array. """
+        current = numpy.unique(taxids)
+        sizes = self.lineage_size[current]
+        min_size = sizes.min()
+        while sizes.max() > min_size:
+            deeper = sizes > min_size
+            current[deeper] = self.parent[current[deeper]]
+            sizes[deeper] -= 1
+        while (current != current[0]).any():
+            current = self.parent[current]
+        return int(current[0])
+
+
+def _track_to_lineage(track):
+    """ Converts a track (as stored in the species table) into a tuple
+    of taxids sorted from the root. """
+    return tuple(map(int, reversed(track.split(","))))
+
+def _levelorder(root, children):
+    """ Returns the nodes of a tree, given as a dictionary with the list of
+    children of each node, in level order. """
+    nodes = [root]
+    for node in nodes:
+        nodes.extend(children[node])
+    return nodes
+
+def _parent_array(root, children):
+    """ Returns the nodes of a tree, given as a dictionary with the list of
+    children of each node, in preorder, and the position of the parent of
+    each node in that list (-1 for the root). """
+    nodes = []
+    parents = []
+    pending = [(root, -1)]
+    while pending:
+        node, parent = pending.pop()
+        parents.append(parent)
+        nodes.append(node)
+        pos = len(nodes) - 1
+        for ch in reversed(children[node]):
+            pending.append((ch, pos))
+    return nodes, parents
+
+def _lineage_positions(lineage):
+    """ Returns a dictionary with the first position of each taxid in a
+    lineage. """
+    positions = {}
+    for i, taxid in enumerate(lineage):
+        positions.setdefault(taxid, i)
+    return positions
+
+def _intersect_lineages(a, b):
+    """ Returns the taxids found in two dictionaries created by
+    _lineage_positions() (or by this function), with their first position
+    in any of them. """
+    if a is b:
+        return a
+    if len(a) > len(b):
+        a, b = b, a
+    return dict((taxid, min(pos, b[taxid])) for taxid, pos in six.iteritems(a) if taxid in b)
+
+BrokenClades = namedtuple("BrokenClades", ["ntaxa", "broken_clades", "broken_clade_sizes"])
+
+def _find_broken_clades(t, leaf2lineage):
+    """ Returns the taxa in the lineages of the leaves of a tree that are not
+    monophyletic, as a dictionary with the broken taxa under the common
+    ancestor of each of them, and a Counter with the number of leaves of
+    every taxon. Leaves not in leaf2lineage are ignored.
+
+    All taxa are resolved in a single postorder traversal: each node counts
+    the leaves of the taxa that are still incomplete under it (merging the
+    counters of its children from small to large), and a taxon is resolved
+    at the first node containing all its leaves. """
+    tax2size = Counter()
+    for lineage in six.itervalues(leaf2lineage):
+        tax2size.update(lineage)
+
+    broken_branches = defaultdict(set)
+    node2known = {}
+    node2open = {}
+    for node in t.traverse("postorder"):
+        if not node.children:
+            lineage = leaf2lineage.get(node)
+            if lineage is None:
+                node2known[node] = 0
+                node2open[node] = {}
+            else:
+                # single leaf taxa are resolved (and monophyletic) here
+                node2known[node] = 1
+                node2open[node] = dict((tax, 1) for tax in lineage if tax2size[tax] > 1)
+            continue
+
+        known = 0
+        for ch in node.children:
+            known += node2known.pop(ch)
+        node2known[node] = known
+
+        open_taxa = node2open.pop(node.children[0])
+        for ch in node.children[1:]:
+            ch_taxa = node2open.pop(ch)
+            if len(ch_taxa) > len(open_taxa):
+                open_taxa, ch_taxa = ch_taxa, open_taxa
+            for tax, count in six.iteritems(ch_taxa):
+                count += open_taxa.get(tax, 0)
+                if count == tax2size[tax]:
+                    open_taxa.pop(tax, None)
+                    if count != known:
+                        broken_branches[node].add(tax)
+                else:
+                    open_taxa[tax] = count
+        node2open[node] = open_taxa
+    return broken_branches, tax2size
+
+def _setup_broken_clades_worker(settings):
+    dbfile, taxid_attr, newick_format = settings
+    return NCBITaxa(dbfile, read_only=True), taxid_attr, newick_format
+
+def _broken_clades_worker(settings, trees):
+    ncbi, taxid_attr, newick_format = settings
+    return [ncbi._score_broken_clades(tree, taxid_attr, newick_format) for tree in trees]
+
 class NCBITaxa(object):
     """
     versionadded: 2.3
 
     Provides a local transparent connector to the NCBI taxonomy database.
+
+    :param None dbfile: path to the taxonomy database. If None, the
+        default database is used (and downloaded if necessary).
+
+    :param None taxdump_file: an alternative location of the
+        taxdump.tar.gz file used to (re)build the database.
+
+    :param False preload: If True, the parent, rank and name of all
+        taxa are loaded in memory as numpy arrays, so lineage, rank,
+        name and common ancestor queries do not need to access the
+        database. It takes several seconds and about 150MB of memory for
+        the full NCBI taxonomy.
+
+    :param False read_only: If True, the database is opened in read
+        only and immutable mode (no file locking). The database file must
+        not be modified by other processes while in use.
+
+    :param DEFAULT_CACHE_SIZE cache_size: max number of entries kept
+        in each of the lineage, rank, scientific name and name to taxid
+        lookup caches (least recently used entries are discarded first).
+        Use 0 to disable caching. Caches are cleared when the database is
+        updated by any instance using the same database file and access
+        mode. See cache_info().
+
+    Database connections are thread local and shared among all NCBITaxa
+    instances using the same database file (see ConnectionPool), so
+    instances can be safely used from several threads.
+
+    .. versionadded:: 3.1.2
+       the preload, read_only and cache_size arguments.
     """
 
-    def __init__(self, dbfile=None, taxdump_file=None):
+    def __init__(self, dbfile=None, taxdump_file=None, preload=False, read_only=False,
+                 cache_size=DEFAULT_CACHE_SIZE):
+        self._caches = OrderedDict((name, _LRUCache(cache_size)) for name in
+                                   ["lineage", "rank", "taxid2name", "name2taxid"])
+        self._taxa = None
+        self._traverse_index = None
+        self._index_lock = threading.Lock()
+        # whether the database contains the fuzzy name index (None until
+        # checked)
+        self._fuzzy_index_found = None
+        self._pool = None
+        # pool generation of the data in the lookup caches
+        self._cache_generation = None
+        self.read_only = read_only
 
         if not dbfile:
             self.dbfile = DEFAULT_TAXADB
@@ -112,40 +756,352 @@ class NCBITaxa(object):
         if not os.path.exists(self.dbfile):
             raise ValueError("Cannot open taxonomy database: %s" % self.dbfile)
 
-        self.db = None
         self._connect()
 
         if not is_taxadb_up_to_date(self.dbfile):
             print('NCBI database format is outdated. Upgrading', file=sys.stderr)
             self.update_taxonomy_database(taxdump_file)
 
+        if preload:
+            self._taxa = _TaxaArrays(self.db)
+
     def update_taxonomy_database(self, taxdump_file=None):
         """Updates the ncbi taxonomy database by downloading and parsing the latest
         taxdump.tar.gz file from the NCBI FTP site (via HTTP).
 
         :param None taxdump_file: an alternative location of the taxdump.tax.gz file.
         """
+        if self._traverse_index is not None:
+            self._traverse_index.close()
+            self._traverse_index = None
+
+        self._fuzzy_index_found = None
+
         if not taxdump_file:
             update_db(self.dbfile)
         else:
             update_db(self.dbfile, taxdump_file)
 
+        if self._pool is not None:
+            self._pool.reset()
+            self._cache_generation = self._pool.generation
+
+        self.clear_cache()
+
+        if self._taxa is not None:
+            self._taxa = _TaxaArrays(self.db)
+
     def _connect(self):
-        self.db = sqlite3.connect(self.dbfile)
+        self._pool = get_connection_pool(self.dbfile, read_only=self.read_only)
+        self._cache_generation = self._pool.generation
+
+    @property
+    def db(self):
+        """ The database connection of the current thread """
+        return self._pool.get()
+
+    def cache_info(self):
+        """
+        .. versionadded:: 3.1.2
+
+        Returns a dictionary with the hits, misses, max size and current
+        size (as a CacheInfo named tuple) of each lookup cache: lineage,
+        rank, taxid2name and name2taxid. Lookups in preload mode do not use
+        the lineage, rank and taxid2name caches.
+        """
+        self._check_cache_generation()
+        return dict((name, cache.info()) for name, cache in six.iteritems(self._caches))
+
+    def clear_cache(self):
+        """
+        .. versionadded:: 3.1.2
+
+        Empties all lookup caches and resets their counters.
+        """
+        for cache in self._caches.values():
+            cache.clear()
+
+    def _check_cache_generation(self):
+        """ Empties the lookup caches if the database was updated (by this
+        or any other instance sharing the connection pool) since they were
+        filled. """
+        generation = self._pool.generation
+        if generation != self._cache_generation:
+            self.clear_cache()
+            self._cache_generation = generation
+
+    def _get_cache(self, name):
+        """ Returns the name lookup cache, emptied if outdated. """
+        self._check_cache_generation()
+        return self._caches[name]
+
+    def _get_traverse_index(self):
+        """ Returns the memory mapped traversal index of the taxonomy tree.
+        Missing or outdated indexes (i.e. if the database was updated by
+        a previous version) are rebuilt from the pickled traversal of the
+        database. In read only mode, they are kept in memory instead of
+        being written next to the database. """
+        with self._index_lock:
+            if self._traverse_index is None:
+                index_file = self.dbfile + ".traverse.bin"
+                nspecies = _count_species_rows(self.db)
+                index = None
+                if os.path.exists(index_file):
+                    try:
+                        index = _TraverseIndex(index_file)
+                    except (ValueError, struct.error):
+                        # empty file or older index format
+                        pass
+                    if index is not None and index.nspecies != nspecies:
+                        index.close()
+                        index = None
+                if index is None:
+                    with open(self.dbfile + ".traverse.pkl", "rb") as CACHED_TRAVERSE:
+                        prepostorder = pickle.load(CACHED_TRAVERSE)
+                    if self.read_only:
+                        index = _TraverseIndex(None, prepostorder, nspecies)
+                    else:
+                        build_traverse_index(prepostorder, index_file, nspecies)
+                        index = _TraverseIndex(index_file)
+                self._traverse_index = index
+            return self._traverse_index
+
+    def _query_in(self, cmd, values):
+        """Yields the rows returned by cmd, an SQL query with a %s
+        placeholder for the values of an IN clause. Values are bound as
+        parameters in chunks of SQL_CHUNK_SIZE. If more than one chunk is
+        needed, the last one is padded with repeated values, so all queries
+        use the same (cached) prepared statement.
+        """
+        params = []
+        for v in values:
+            if not isinstance(v, six.string_types):
+                try:
+                    v = int(v)
+                except (TypeError, ValueError):
+                    v = str(v)
+            params.append(v)
+        values = params
+        if not values:
+            return
+        try:
+            # sorted values are looked up faster in the database indexes
+            values.sort()
+        except TypeError:
+            pass
+        chunk_size = min(len(values), SQL_CHUNK_SIZE)
+        sql = cmd %','.join(['?'] * chunk_size)
+        for start in range(0, len(values), chunk_size):
+            chunk = values[start:start+chunk_size]
+            if len(chunk) < chunk_size:
+                chunk.extend([chunk[-1]] * (chunk_size - len(chunk)))
+            for row in self.db.execute(sql, chunk):
+                yield row
+
+    def _cached_query_in(self, cache_name, cmd, taxids, convert=None):
+        """Returns a dictionary with the values returned by cmd (see
+        _query_in(), which must select a taxid and a value) for a list of
+        taxids, reading them from the cache_name cache when possible and
+        caching the values queried from the database.
+        """
+        cache = self._get_cache(cache_name)
+        result = {}
+        missing = []
+        if cache.maxsize > 0:
+            for v in taxids:
+                try:
+                    taxid = int(v)
+                except (TypeError, ValueError):
+                    missing.append(v)
+                    continue
+                value = cache.get(taxid, _LRUCache._MISSING)
+                if value is _LRUCache._MISSING:
+                    missing.append(v)
+                else:
+                    result[taxid] = value
+        else:
+            missing = taxids
+
+        for taxid, value in self._query_in(cmd, missing):
+            if convert is not None:
+                value = convert(value)
+            cache.put(taxid, value)
+            result[taxid] = value
+        return result
 
     def _translate_merged(self, all_taxids):
         conv_all_taxids = set((list(map(int, all_taxids))))
-        cmd = 'select taxid_old, taxid_new FROM merged WHERE taxid_old IN (%s)' %','.join(map(str, all_taxids))
-
-        result = self.db.execute(cmd)
+        if self._taxa is not None:
+            conversion = {}
+            for old in list(conv_all_taxids):
+                if old in self._taxa.merged:
+                    conv_all_taxids.discard(old)
+                    conv_all_taxids.add(self._taxa.merged[old])
+                    conversion[old] = self._taxa.merged[old]
+            return conv_all_taxids, conversion
+
+        cmd = 'select taxid_old, taxid_new FROM merged WHERE taxid_old IN (%s)'
         conversion = {}
-        for old, new in result.fetchall():
+        for old, new in self._query_in(cmd, conv_all_taxids):
             conv_all_taxids.discard(int(old))
             conv_all_taxids.add(int(new))
             conversion[int(old)] = int(new)
         return conv_all_taxids, conversion
 
 
+    def _check_fuzzy_index(self):
+        """ Returns True if the database contains the fuzzy name index,
+        which is missing in databases created by older versions. The
+        index is only built by update_db() and build_fuzzy_index(). """
+        with self._index_lock:
+            if self._fuzzy_index_found is None:
+                self._fuzzy_index_found = self.db.execute(
+                    "SELECT name FROM sqlite_master WHERE type='table' AND name='name_trigram'"
+                ).fetchone() is not None
+            return self._fuzzy_index_found
+
+    def _scan_fuzzy_search(self, name, sim, limit):
+        """Returns the best matches of a name comparing it with all the
+        names of similar length in the database. Used by databases with no
+        fuzzy name index. """
+        query = name.strip().lower()
+        if not query:
+            return []
+        max_dist = int(math.ceil(len(query) * (1 - sim)))
+        matches = set()
+        for table, is_synonym in [("species", 0), ("synonym", 1)]:
+            cmd = "SELECT taxid, spname FROM %s WHERE length(spname) BETWEEN ? AND ?" %table
+            for taxid, spname in self.db.execute(cmd, (len(query) - max_dist, len(query) + max_dist)):
+                dist = _levenshtein(query, spname.lower(), max_dist)
+                if dist <= max_dist:
+                    matches.add((dist, is_synonym, spname, taxid))
+        return [(taxid, spname, 1 - float(dist) / len(query))
+                for dist, is_synonym, spname, taxid in sorted(matches)[:limit]]
+
+    def _fuzzy_search(self, name, sim, limit, gram_sizes, postings_cache):
+        """Returns the best matches of a name in the fuzzy name index.
+
+        Any name within max_dist edits of the query shares at least
+        len(grams) - 3 * max_dist of its trigrams, so it must contain one
+        of its 3 * max_dist + 1 rarest trigrams. Postings of those are
+        always counted, and more trigrams are counted while their size
+        does not exceed that of the rarest ones, so only names sharing
+        enough counted trigrams need to be compared with the query.
+        """
+        query = name.strip().lower()
+        if not query:
+            return []
+        max_dist = int(math.ceil(len(query) * (1 - sim)))
+        query_grams = _name_trigrams(query)
+        min_shared = len(query_grams) - 3 * max_dist
+
+        unknown = [g for g in query_grams if g not in gram_sizes]
+        for g in unknown:
+            gram_sizes[g] = 0
+        cmd = "SELECT trigram, size FROM name_trigram WHERE trigram IN (%s)"
+        for gram, size in self._query_in(cmd, unknown):
+            gram_sizes[gram] = size
+
+        grams = sorted(query_grams, key=lambda g: (gram_sizes[g], g))
+        nprefix = 3 * max_dist + 1
+        budget = sum(gram_sizes[g] for g in grams[:nprefix])
+        for gram in grams[nprefix:]:
+            if gram_sizes[gram] > budget:
+                break
+            budget -= gram_sizes[gram]
+            nprefix += 1
+        counted = grams[:nprefix]
+
+        blobs = {}
+        missing = []
+        for gram in counted:
+            if gram_sizes[gram]:
+                blob = postings_cache.get(gram)
+                if blob is None:
+                    missing.append(gram)
+                else:
+                    blobs[gram] = blob
+        cmd = "SELECT trigram, postings FROM name_trigram WHERE trigram IN (%s)"
+        for gram, blob in self._query_in(cmd, missing):
+            postings_cache.put(gram, blob)
+            blobs[gram] = blob
+        counts = Counter()
+        for blob in blobs.values():
+            counts.update(_decode_postings(blob))
+
+        min_counted = max(1, len(counted) - 3 * max_dist)
+        candidates = [name_id for name_id, n in six.iteritems(counts) if n >= min_counted]
+        rows = list(self._query_in("SELECT taxid, spname, 0 FROM species WHERE taxid IN (%s)",
+                                   [name_id for name_id in candidates if name_id > 0]))
+        rows.extend(self._query_in("SELECT taxid, spname, 1 FROM synonym WHERE rowid IN (%s)",
+                                   [-name_id for name_id in candidates if name_id < 0]))
+        matches = set()
+        for taxid, spname, is_synonym in rows:
+            spname_lower = spname.lower()
+            if len(query_grams & _name_trigrams(spname_lower)) < min_shared:
+                continue
+            dist = _levenshtein(query, spname_lower, max_dist)
+            if dist <= max_dist:
+                matches.add((dist, is_synonym, spname, taxid))
+        return [(taxid, spname, 1 - float(dist) / len(query))
+                for dist, is_synonym, spname, taxid in sorted(matches)[:limit]]
+
+    def get_fuzzy_name_matches(self, name, sim=0.9, limit=5):
+        """
+        .. versionadded:: 3.1.2
+
+        Returns the scientific names and synonyms most similar to an
+        inexact species name, using the trigram index built with the
+        taxonomy database. Matches are exact: all names within
+        ceil(len(name) * (1 - sim)) edits (case insensitive Levenshtein
+        distance) are considered, as long as they share a trigram with
+        the query. Databases created by previous versions have no such
+        index (see build_fuzzy_index()), so a much slower search comparing
+        the query with all names is used instead, with a warning.
+
+        :param name: the name to search for.
+
+        :param 0.9 sim: Min word similarity to report a match (from 0 to 1).
+            Lower values allow more edits, and are slower.
+
+        :param 5 limit: max number of matches returned.
+
+        :return: a list of (taxid, name, score) tuples sorted by
+            decreasing score, where score is 1 - edits / len(name).
+            Scientific names are reported before synonyms with the same
+            score.
+        """
+        return self.get_fuzzy_name_translator([name], sim=sim, limit=limit).get(name, [])
+
+    def get_fuzzy_name_translator(self, names, sim=0.9, limit=1):
+        """
+        .. versionadded:: 3.1.2
+
+        Batch version of get_fuzzy_name_matches(). Trigram postings are
+        shared among all the queries, and repeated names are only searched
+        once.
+
+        :return: a dictionary translating each name with any match into
+            its list of (taxid, name, score) matches.
+        """
+        indexed = self._check_fuzzy_index()
+        if not indexed:
+            warnings.warn("Fuzzy name index not found in %s. All names are compared with"
+                          " the query, which is slow. Update the taxonomy database or use"
+                          " ete3.ncbi_taxonomy.ncbiquery.build_fuzzy_index() to build it."
+                          %self.dbfile)
+        gram_sizes = {}
+        postings_cache = _LRUCache(FUZZY_POSTINGS_CACHE_SIZE)
+        name2matches = {}
+        for name in set(names):
+            if indexed:
+                matches = self._fuzzy_search(name, sim, limit, gram_sizes, postings_cache)
+            else:
+                matches = self._scan_fuzzy_search(name, sim, limit)
+            if matches:
+                name2matches[name] = matches
+        return name2matches
+
     def get_fuzzy_name_translation(self, name, sim=0.9):
         '''
         Given an inexact species name, returns the best match in the NCBI database of taxa names.
@@ -153,39 +1109,18 @@ class NCBITaxa(object):
         :argument 0.9 sim: Min word similarity to report a match (from 0 to 1).
 
         :return: taxid, species-name-match, match-score
-        '''
-
-
-        import sqlite3.dbapi2 as dbapi2
-        _db = dbapi2.connect(self.dbfile)
-        _db.enable_load_extension(True)
-        module_path = os.path.split(os.path.realpath(__file__))[0]
-        _db.execute("select load_extension('%s')" % os.path.join(module_path,
-                                                                 "SQLite-Levenshtein/levenshtein.sqlext"))
 
+        .. versionchanged:: 3.1.2
+           uses the fuzzy name index (see get_fuzzy_name_matches()) instead
+           of the SQLite Levenshtein extension.
+        '''
         print("Trying fuzzy search for %s" % name)
-        maxdiffs = math.ceil(len(name) * (1-sim))
-        cmd = 'SELECT taxid, spname, LEVENSHTEIN(spname, "%s") AS sim  FROM species WHERE sim<=%s ORDER BY sim LIMIT 1;' % (name, maxdiffs)
-        taxid, spname, score = None, None, len(name)
-        result = _db.execute(cmd)
-        try:
-            taxid, spname, score = result.fetchone()
-        except TypeError:
-            cmd = 'SELECT taxid, spname, LEVENSHTEIN(spname, "%s") AS sim  FROM synonym WHERE sim<=%s ORDER BY sim LIMIT 1;' % (name, maxdiffs)
-            result = _db.execute(cmd)
-            try:
-                taxid, spname, score = result.fetchone()
-            except:
-                pass
-            else:
-                taxid = int(taxid)
-        else:
-            taxid = int(taxid)
-
-        norm_score = 1 - (float(score)/len(name))
-        if taxid:
-            print("FOUND!    %s taxid:%s score:%s (%s)" %(spname, taxid, score, norm_score))
+        matches = self.get_fuzzy_name_matches(name, sim=sim, limit=1)
+        if not matches:
+            return None, None, 0.0
 
+        taxid, spname, norm_score = matches[0]
+        print("FOUND!    %s taxid:%s score:%s" %(spname, taxid, norm_score))
         return taxid, spname, norm_score
 
     def get_rank(self, taxids):
@@ -194,13 +1129,12 @@ class NCBITaxa(object):
         all_ids = set(taxids)
         all_ids.discard(None)
         all_ids.discard("")
-        query = ','.join(['"%s"' %v for v in all_ids])
-        cmd = "select taxid, rank FROM species WHERE taxid IN (%s);" %query
-        result = self.db.execute(cmd)
-        id2rank = {}
-        for tax, spname in result.fetchall():
-            id2rank[tax] = spname
-        return id2rank
+        if self._taxa is not None:
+            return dict((taxid, self._taxa.get_rank(taxid))
+                        for taxid in self._taxa.get_valid_ids(all_ids).tolist())
+
+        cmd = "select taxid, rank FROM species WHERE taxid IN (%s);"
+        return self._cached_query_in("rank", cmd, all_ids)
 
     def get_lineage_translator(self, taxids):
         """Given a valid taxid number, return its corresponding lineage track as a
@@ -209,13 +1143,14 @@ class NCBITaxa(object):
         all_ids = set(taxids)
         all_ids.discard(None)
         all_ids.discard("")
-        query = ','.join(['"%s"' %v for v in all_ids])
-        result = self.db.execute('SELECT taxid, track FROM species WHERE taxid IN (%s);' %query)
-        id2lineages = {}
-        for tax, track in result.fetchall():
-            id2lineages[tax] = list(map(int, reversed(track.split(","))))
+        if self._taxa is not None:
+            valid_ids = self._taxa.get_valid_ids(all_ids)
+            return dict(zip(valid_ids.tolist(), self._taxa.get_lineages(valid_ids)))
 
-        return id2lineages
+        cmd = 'SELECT taxid, track FROM species WHERE taxid IN (%s);'
+        # lineages are cached as tuples, so callers get their own lists
+        id2lineages = self._cached_query_in("lineage", cmd, all_ids, convert=_track_to_lineage)
+        return dict((tax, list(lineage)) for tax, lineage in six.iteritems(id2lineages))
 
     
     def get_lineage(self, taxid):
@@ -224,9 +1159,32 @@ class NCBITaxa(object):
         """
         if not taxid:
             return None
+        if self._taxa is not None:
+            taxid = int(taxid)
+            lineage = self._taxa.get_lineage(taxid)
+            if not lineage and taxid in self._taxa.merged:
+                lineage = self._taxa.get_lineage(self._taxa.merged[taxid])
+                if lineage:
+                    warnings.warn("taxid %s was translated into %s" %(taxid, self._taxa.merged[taxid]))
+            if not lineage:
+                raise ValueError("%s taxid not found" %taxid)
+            return lineage
+
+        cache = self._get_cache("lineage")
+        try:
+            lineage = cache.get(int(taxid))
+        except (TypeError, ValueError):
+            lineage = None
+        if lineage is not None:
+            return list(lineage)
+
         result = self.db.execute('SELECT track FROM species WHERE taxid=%s' %taxid)
         raw_track = result.fetchone()
-        if not raw_track:
+        if raw_track:
+            lineage = _track_to_lineage(raw_track[0])
+            cache.put(int(taxid), lineage)
+            return list(lineage)
+        else:
             #perhaps is an obsolete taxid
             _, merged_conversion = self._translate_merged([taxid])
             if taxid in merged_conversion:
@@ -238,16 +1196,18 @@ class NCBITaxa(object):
                 raise ValueError("%s taxid not found" %taxid)
             else:
                 warnings.warn("taxid %s was translated into %s" %(taxid, merged_conversion[taxid]))
-                
-        track = list(map(int, raw_track[0].split(",")))
-        return list(reversed(track))
+
+        return list(_track_to_lineage(raw_track[0]))
 
     def get_common_names(self, taxids):
-        query = ','.join(['"%s"' %v for v in taxids])
-        cmd = "select taxid, common FROM species WHERE taxid IN (%s);" %query
-        result = self.db.execute(cmd)
+        if self._taxa is not None:
+            return dict((taxid, self._taxa.common[taxid])
+                        for taxid in self._taxa.get_valid_ids(taxids).tolist()
+                        if taxid in self._taxa.common)
+
+        cmd = "select taxid, common FROM species WHERE taxid IN (%s);"
         id2name = {}
-        for tax, common_name in result.fetchall():
+        for tax, common_name in self._query_in(cmd, set(taxids)):
             if common_name:
                 id2name[tax] = common_name
         return id2name
@@ -260,12 +1220,13 @@ class NCBITaxa(object):
         all_ids = set(map(int, taxids))
         all_ids.discard(None)
         all_ids.discard("")
-        query = ','.join(['"%s"' %v for v in all_ids])
-        cmd = "select taxid, spname FROM species WHERE taxid IN (%s);" %query
-        result = self.db.execute(cmd)
         id2name = {}
-        for tax, spname in result.fetchall():
-            id2name[tax] = spname
+        if self._taxa is not None:
+            for tax in self._taxa.get_valid_ids(all_ids).tolist():
+                id2name[tax] = self._taxa.get_name(tax)
+        else:
+            cmd = "select taxid, spname FROM species WHERE taxid IN (%s);"
+            id2name = self._cached_query_in("taxid2name", cmd, all_ids)
 
         # any taxid without translation? lets tray in the merged table
         if len(all_ids) != len(id2name) and try_synonyms:
@@ -273,15 +1234,46 @@ class NCBITaxa(object):
             taxids, old2new = self._translate_merged(not_found_taxids)
             new2old = {v: k for k,v in six.iteritems(old2new)}
 
-            if old2new:
-                query = ','.join(['"%s"' %v for v in new2old])
-                cmd = "select taxid, spname FROM species WHERE taxid IN (%s);" %query
-                result = self.db.execute(cmd)
-                for tax, spname in result.fetchall():
+            if old2new and self._taxa is not None:
+                for tax in self._taxa.get_valid_ids(new2old).tolist():
+                    id2name[new2old[tax]] = self._taxa.get_name(tax)
+            elif old2new:
+                cmd = "select taxid, spname FROM species WHERE taxid IN (%s);"
+                for tax, spname in self._query_in(cmd, new2old):
                     id2name[new2old[tax]] = spname
 
         return id2name
 
+    def get_common_ancestor(self, taxids):
+        """
+        .. versionadded:: 3.1.2
+
+        Returns the taxid of the last common ancestor of a list of taxids.
+        Merged (obsolete) taxids are translated into their current taxid.
+        """
+        taxids, merged_conversion = self._translate_merged(taxids)
+        if not taxids:
+            raise ValueError("No taxids provided")
+
+        if self._taxa is not None:
+            valid_ids = self._taxa.get_valid_ids(taxids)
+            missing = taxids - set(valid_ids.tolist())
+            if missing:
+                raise ValueError("taxids not found: %s" %', '.join(map(str, sorted(missing))))
+            return self._taxa.get_common_ancestor(valid_ids)
+
+        id2lineage = self.get_lineage_translator(taxids)
+        missing = taxids - set(id2lineage)
+        if missing:
+            raise ValueError("taxids not found: %s" %', '.join(map(str, sorted(missing))))
+        lineages = list(id2lineage.values())
+        ancestor = None
+        for i, taxid in enumerate(min(lineages, key=len)):
+            if any(lin[i] != taxid for lin in lineages):
+                break
+            ancestor = taxid
+        return ancestor
+
     def get_name_translator(self, names):
         """
         Given a list of taxid scientific names, returns a dictionary translating them into their corresponding taxids.
@@ -295,23 +1287,33 @@ class NCBITaxa(object):
         for n in names:
             name2origname[n.lower()] = n
 
-        names = set(name2origname.keys())
+        names = set()
+        cache = self._get_cache("name2taxid")
+        for name, oname in six.iteritems(name2origname):
+            taxids = cache.get(name) if cache.maxsize > 0 else None
+            if taxids is None:
+                names.add(name)
+            else:
+                name2id[oname] = list(taxids)
 
-        query = ','.join(['"%s"' %n for n in six.iterkeys(name2origname)])
-        cmd = 'select spname, taxid from species where spname IN (%s)' %query
-        result = self.db.execute('select spname, taxid from species where spname IN (%s)' %query)
-        for sp, taxid in result.fetchall():
+        found = set()
+        cmd = 'select spname, taxid from species where spname IN (%s)'
+        for sp, taxid in self._query_in(cmd, names):
             oname = name2origname[sp.lower()]
             name2id.setdefault(oname, []).append(taxid)
+            found.add(sp.lower())
             #name2realname[oname] = sp
-        missing =  names - set([n.lower() for n in name2id.keys()])
+        missing = names - found
         if missing:
-            query = ','.join(['"%s"' %n for n in missing])
-            result = self.db.execute('select spname, taxid from synonym where spname IN (%s)' %query)
-            for sp, taxid in result.fetchall():
+            cmd = 'select spname, taxid from synonym where spname IN (%s)'
+            for sp, taxid in self._query_in(cmd, missing):
                 oname = name2origname[sp.lower()]
                 name2id.setdefault(oname, []).append(taxid)
+                found.add(sp.lower())
                 #name2realname[oname] = sp
+
+        for name in found:
+            cache.put(name, tuple(name2id[name2origname[name]]))
         return name2id
 
     def translate_to_names(self, taxids):
@@ -339,37 +1341,134 @@ class NCBITaxa(object):
             except KeyError:
                 raise ValueError('%s not found!' %parent)
 
-        with open(self.dbfile+".traverse.pkl", "rb") as CACHED_TRAVERSE:
-            prepostorder = pickle.load(CACHED_TRAVERSE)
-        descendants = {}
-        found = 0
-        for tid in prepostorder:
-            if tid == taxid:
-                found += 1
-            elif found == 1:
-                descendants[tid] = descendants.get(tid, 0) + 1
-            elif found == 2:
-                break
-            
-        if not found:
+        index = self._get_traverse_index()
+        taxid_range = index.get_range(taxid)
+        if taxid_range is None:
             raise ValueError("taxid not found:%s" %taxid)
-        elif found == 1:
-            return [taxid]        
+        start, end = taxid_range
+        if start == end:
+            return [taxid]
+
+        descendants = {}
+        for tid in index.get_traverse(start + 1, end - 1):
+            descendants[tid] = descendants.get(tid, 0) + 1
             
-        if rank_limit or collapse_subspecies or return_tree:
-            tree = self.get_topology(list(descendants.keys()), intermediate_nodes=intermediate_nodes, collapse_subspecies=collapse_subspecies, rank_limit=rank_limit)
-            if return_tree:
-                return tree
-            elif intermediate_nodes:
-                return list(map(int, [n.name for n in tree.get_descendants()]))
+        if return_tree:
+            return self.get_topology(list(descendants.keys()), intermediate_nodes=intermediate_nodes, collapse_subspecies=collapse_subspecies, rank_limit=rank_limit)
+        elif rank_limit or collapse_subspecies:
+            root_taxid, children, _ = self._get_topology_children(
+                list(descendants.keys()), intermediate_nodes=intermediate_nodes,
+                collapse_subspecies=collapse_subspecies, rank_limit=rank_limit,
+                with_ranks=False)
+            if intermediate_nodes:
+                return _levelorder(root_taxid, children)[1:]
             else:
-                return map(int, [n.name for n in tree])
+                nodes, parents = _parent_array(root_taxid, children)
+                return [tid for tid in nodes if not children[tid]]
                 
         elif intermediate_nodes:
             return [tid for tid, count in six.iteritems(descendants)]
         else:
             return [tid for tid, count in six.iteritems(descendants) if count == 1]
 
+    def _get_topology_children(self, taxids, intermediate_nodes=False, rank_limit=None, collapse_subspecies=False,
+                               with_ranks=True):
+        """Returns the structure of the minimal NCBI taxonomy tree containing
+        a list of taxids (see get_topology()) as the taxid of its root, a
+        dictionary with the list of children of each node, and a
+        dictionary with their ranks (None if a single taxid is given, as
+        nodes are not annotated with their rank in that case, and empty if
+        with_ranks is False and no rank_limit is used).
+        """
+        taxids, merged_conversion = self._translate_merged(taxids)
+        children = {}
+        id2rank = None
+        if len(taxids) == 1:
+            root_taxid = int(list(taxids)[0])
+            index = self._get_traverse_index()
+            taxid_range = index.get_range(root_taxid)
+            if taxid_range is None:
+                raise ValueError("taxid not found:%s" %root_taxid)
+            start, end = taxid_range
+            # tip nodes are found only once in the traversal, and internal
+            # nodes twice (in pre and postorder)
+            subtree = index.get_traverse(start, end)
+            leaves = set([v for v, count in Counter(subtree).items() if count == 1])
+            path = []
+            for tid in subtree:
+                if path and path[-1] == tid:
+                    path.pop()
+                    continue
+                if path:
+                    children[path[-1]].append(tid)
+                children[tid] = []
+                if tid not in leaves:
+                    path.append(tid)
+        else:
+            taxids = set(map(int, taxids))
+            id2lineage = self.get_lineage_translator(taxids)
+            all_taxids = set()
+            for lineage in id2lineage.values():
+                all_taxids.update(lineage)
+            id2rank = self.get_rank(all_taxids) if (with_ranks or rank_limit) else {}
+            for sp in taxids:
+                lineage = id2lineage[sp]
+                if not rank_limit:
+                    # walk up to the first node already in the tree, so
+                    # shared lineage prefixes are visited only once
+                    start = len(lineage)
+                    while start and lineage[start - 1] not in children:
+                        start -= 1
+                    parent = lineage[start - 1] if start else None
+                    for elem in lineage[start:]:
+                        children[elem] = []
+                        if parent is not None:
+                            children[parent].append(elem)
+                        parent = elem
+                    continue
+                parent = None
+                for elem in lineage:
+                    if elem not in children:
+                        children[elem] = []
+                        if parent is not None:
+                            children[parent].append(elem)
+                    if rank_limit and str(id2rank.get(elem, "no rank")) == rank_limit:
+                        break
+                    parent = elem
+            root_taxid = 1
+            if root_taxid not in children:
+                raise KeyError(root_taxid)
+
+        # one-child nodes are removed in level order, and the child of each
+        # removed node is moved to the end of the children of its parent
+        if not intermediate_nodes:
+            nodes = _levelorder(root_taxid, children)
+            parents = {}
+            for node in nodes:
+                for ch in children[node]:
+                    parents[ch] = node
+            removed = set()
+            for node in nodes[1:]:
+                if len(children[node]) == 1 and node not in taxids:
+                    child = children[node][0]
+                    children[parents[node]].append(child)
+                    parents[child] = parents[node]
+                    removed.add(node)
+            for node in nodes:
+                if node not in removed:
+                    children[node] = [ch for ch in children[node] if ch not in removed]
+
+        if len(children[root_taxid]) == 1:
+            root_taxid = children[root_taxid][0]
+
+        if collapse_subspecies:
+            node2rank = id2rank or self.get_rank(list(children.keys()))
+            for node in _levelorder(root_taxid, children):
+                if str(node2rank.get(node, "no rank")) == "species":
+                    children[node] = []
+
+        return root_taxid, children, id2rank
+
     def get_topology(self, taxids, intermediate_nodes=False, rank_limit=None, collapse_subspecies=False, annotate=True):
         """Given a list of taxid numbers, return the minimal pruned NCBI taxonomy tree
         containing all of them.
@@ -390,94 +1489,44 @@ class NCBITaxa(object):
 
         """
         from .. import PhyloTree
-        taxids, merged_conversion = self._translate_merged(taxids)        
-        if len(taxids) == 1:
-            root_taxid = int(list(taxids)[0])
-            with open(self.dbfile+".traverse.pkl", "rb") as CACHED_TRAVERSE:
-                prepostorder = pickle.load(CACHED_TRAVERSE)
-            descendants = {}
-            found = 0
-            nodes = {}
-            hit = 0
-            visited = set()            
-            start = prepostorder.index(root_taxid)
-            try:
-            	end = prepostorder.index(root_taxid, start+1)
-            	subtree = prepostorder[start:end+1]
-            except ValueError:
-                # If root taxid is not found in postorder, must be a tip node
-            	subtree = [root_taxid]
-            leaves = set([v for v, count in Counter(subtree).items() if count == 1])
-            nodes[root_taxid] = PhyloTree(name=str(root_taxid))
-            current_parent = nodes[root_taxid]
-            for tid in subtree:
-                if tid in visited:
-                    current_parent = nodes[tid].up
-                else:
-                    visited.add(tid)
-                    nodes[tid] = PhyloTree(name=str(tid))
-                    current_parent.add_child(nodes[tid])
-                    if tid not in leaves:
-                        current_parent = nodes[tid]
-            root = nodes[root_taxid]
-        else:
-            taxids = set(map(int, taxids))
-            sp2track = {}
-            elem2node = {}
-            id2lineage = self.get_lineage_translator(taxids)
-            all_taxids = set()
-            for lineage in id2lineage.values():
-                all_taxids.update(lineage)                
-            id2rank = self.get_rank(all_taxids)
-            for sp in taxids:
-                track = []
-                lineage = id2lineage[sp]
-
-                for elem in lineage:
-                    if elem not in elem2node:
-                        node = elem2node.setdefault(elem, PhyloTree())
-                        node.name = str(elem)
-                        node.taxid = elem
-                        node.add_feature("rank", str(id2rank.get(int(elem), "no rank")))
-                    else:
-                        node = elem2node[elem]
-                    track.append(node)
-                sp2track[sp] = track
-            # generate parent child relationships
-            for sp, track in six.iteritems(sp2track):
-                parent = None
-                for elem in track:
-                    if parent and elem not in parent.children:
-                        parent.add_child(elem)
-                    if rank_limit and elem.rank == rank_limit:
-                        break
-                    parent = elem
-            root = elem2node[1]
-
-        #remove onechild-nodes
-        if not intermediate_nodes:
-            for n in root.get_descendants():
-                if len(n.children) == 1 and int(n.name) not in taxids:
-                    n.delete(prevent_nondicotomic=False)
-
-        if len(root.children) == 1:
-            tree = root.children[0].detach()
-        else:
-            tree = root
-
-        if collapse_subspecies:
-            to_detach = []
-            for node in tree.traverse():
-                if node.rank == "species":
-                    to_detach.extend(node.children)
-            for n in to_detach:
-                n.detach()
+        root_taxid, children, id2rank = self._get_topology_children(
+            taxids, intermediate_nodes=intermediate_nodes, rank_limit=rank_limit,
+            collapse_subspecies=collapse_subspecies)
+
+        def new_node(taxid):
+            if id2rank is None:
+                return PhyloTree(name=str(taxid))
+            node = PhyloTree()
+            node.name = str(taxid)
+            node.taxid = taxid
+            node.add_feature("rank", str(id2rank.get(taxid, "no rank")))
+            return node
+
+        tree = new_node(root_taxid)
+        pending = [(tree, root_taxid)]
+        while pending:
+            node, taxid = pending.pop()
+            for ch in children[taxid]:
+                pending.append((node.add_child(new_node(ch)), ch))
 
         if annotate:
             self.annotate_tree(tree)
 
         return tree
 
+    def get_topology_parents(self, taxids, intermediate_nodes=False, rank_limit=None, collapse_subspecies=False):
+        """
+        .. versionadded:: 3.1.2
+
+        Same as get_topology(), but returns the tree as two lists instead
+        of PhyloTree nodes: the taxids of all nodes in preorder, and the
+        position of the parent of each node in the first list (-1 for the
+        root).
+        """
+        root_taxid, children, _ = self._get_topology_children(
+            taxids, intermediate_nodes=intermediate_nodes, rank_limit=rank_limit,
+            collapse_subspecies=collapse_subspecies, with_ranks=False)
+        return _parent_array(root_taxid, children)
 
     def annotate_tree(self, t, taxid_attr="name", tax2name=None, tax2track=None, tax2rank=None):
         """Annotate a tree containing taxids as leaf names by adding the  'taxid',
@@ -520,8 +1569,12 @@ class NCBITaxa(object):
         if not tax2rank:
             tax2rank = self.get_rank(list(tax2name.keys()))
 
-        n2leaves = t.get_cached_content()
-
+        # common lineages of internal nodes are computed in a single
+        # postorder pass, as dictionaries of the taxids shared by all the
+        # leaf lineages under each node and their first position in them
+        n2common = {}
+        tax2common = {}
+        tax2named_lineage = {}
         for n in t.traverse('postorder'):
             try:
                 node_taxid = int(getattr(n, taxid_attr))
@@ -532,19 +1585,32 @@ class NCBITaxa(object):
             if node_taxid:
                 if node_taxid in merged_conversion:
                     node_taxid = merged_conversion[node_taxid]
+                if node_taxid not in tax2named_lineage:
+                    tax2named_lineage[node_taxid] = [tax2name.get(tax, str(tax)) for tax in tax2track[node_taxid]]
                 n.add_features(sci_name = tax2name.get(node_taxid, getattr(n, taxid_attr, '')),
                                common_name = tax2common_name.get(node_taxid, ''),
                                lineage = tax2track[node_taxid],
-                               rank = tax2rank.get(node_taxid, 'Unknown'),                               
-                               named_lineage = [tax2name.get(tax, str(tax)) for tax in tax2track[node_taxid]])
+                               rank = tax2rank.get(node_taxid, 'Unknown'),
+                               named_lineage = list(tax2named_lineage[node_taxid]))
             elif n.is_leaf():
                 n.add_features(sci_name = getattr(n, taxid_attr, 'NA'),
                                common_name = '',
                                lineage = [],
                                rank = 'Unknown',
                                named_lineage = [])
+
+            if n.is_leaf():
+                if node_taxid not in tax2common:
+                    tax2common[node_taxid] = _lineage_positions(n.lineage)
+                common = tax2common[node_taxid]
             else:
-                lineage = self._common_lineage([lf.lineage for lf in n2leaves[n]])
+                common = n2common.pop(n.children[0])
+                for ch in n.children[1:]:
+                    common = _intersect_lineages(common, n2common.pop(ch))
+            n2common[n] = common
+
+            if not node_taxid and not n.is_leaf():
+                lineage = sorted(common, key=common.get) or [""]
                 ancestor = lineage[-1]
                 n.add_features(sci_name = tax2name.get(ancestor, str(ancestor)),
                                common_name = tax2common_name.get(ancestor, ''),
@@ -607,35 +1673,95 @@ class NCBITaxa(object):
 
         CURRENTLY EXPERIMENTAL
 
+        Leaves are expected to be annotated with their 'taxid' and 'sci_name'
+        (see annotate_tree()), and taxa_lineages must provide the lineage of
+        each of their taxids. Leaves with no taxid or with an unknown
+        scientific name are ignored. The n2content argument is no longer
+        needed, and it is kept for backwards compatibility.
         """
-        if not n2content:
-            n2content = t.get_cached_content()
-
-        tax2node = defaultdict(set)
-
-        unknown = set()
+        leaf2lineage = {}
         for leaf in t.iter_leaves():
-            if leaf.sci_name.lower() != "unknown":
-                lineage = taxa_lineages[leaf.taxid]
-                for index, tax in enumerate(lineage):
-                    tax2node[tax].add(leaf)
-            else:
-                unknown.add(leaf)
+            if leaf.taxid and leaf.sci_name.lower() != "unknown":
+                leaf2lineage[leaf] = taxa_lineages[leaf.taxid]
 
-        broken_branches = defaultdict(set)
+        broken_branches, tax2size = _find_broken_clades(t, leaf2lineage)
         broken_clades = set()
-        for tax, leaves in six.iteritems(tax2node):
-            if len(leaves) > 1:
-                common = t.get_common_ancestor(leaves)
-            else:
-                common = list(leaves)[0]
-            if (leaves ^ set(n2content[common])) - unknown:
-                broken_branches[common].add(tax)
-                broken_clades.add(tax)
-
-        broken_clade_sizes = [len(tax2node[tax]) for tax in broken_clades]
+        for taxa in six.itervalues(broken_branches):
+            broken_clades.update(taxa)
+        broken_clade_sizes = [tax2size[tax] for tax in broken_clades]
         return broken_branches, broken_clades, broken_clade_sizes
 
+    def iter_broken_clades(self, trees, taxid_attr="name", newick_format=0, n_jobs=1, chunksize=20):
+        """
+        .. versionadded:: 3.1.2
+
+        Scores the taxonomic congruence of many trees, yielding for each of
+        them the number of NCBI taxa found in the lineages of its leaves,
+        and the taxa that are not monophyletic and their size (as in
+        get_broken_branches()). Trees are read lazily, so large collections
+        of trees can be processed as a stream.
+
+        :param trees: an iterable of trees, given as TreeNode instances,
+            newick strings or paths to newick files containing one tree.
+
+        :param name taxid_attr: leaf attribute containing the taxid of
+            each leaf. Leaves with invalid or unknown taxids are ignored.
+
+        :param 0 newick_format: subnewick format of newick trees.
+
+        :param 1 n_jobs: number of processes used to score the trees. If
+            None, all available CPUs are used. Each process opens the
+            database in read only mode.
+
+        :param 20 chunksize: number of trees sent at once to each process.
+
+        :returns: an iterator of BrokenClades(ntaxa, broken_clades,
+            broken_clade_sizes) named tuples, in the same order as the
+            input trees.
+        """
+        if n_jobs == 1:
+            for tree in trees:
+                yield self._score_broken_clades(tree, taxid_attr, newick_format)
+            return
+
+        settings = (self.dbfile, taxid_attr, newick_format)
+        for results in imap_chunks(_broken_clades_worker, settings, trees, n_jobs, chunksize,
+                                   setup=_setup_broken_clades_worker):
+            for result in results:
+                yield result
+
+    def _score_broken_clades(self, tree, taxid_attr, newick_format):
+        if isinstance(tree, six.string_types):
+            from .. import Tree
+            tree = Tree(tree, format=newick_format)
+
+        leaf2taxid = {}
+        for leaf in tree.iter_leaves():
+            try:
+                leaf2taxid[leaf] = int(getattr(leaf, taxid_attr))
+            except (ValueError, TypeError, AttributeError):
+                pass
+
+        # lineages are retrieved once per taxid, and merged taxids share
+        # the lineage of their new taxid
+        taxids, merged_conversion = self._translate_merged(set(leaf2taxid.values()))
+        tax2lineage = self.get_lineage_translator(taxids)
+        for old, new in six.iteritems(merged_conversion):
+            if new in tax2lineage:
+                tax2lineage[old] = tax2lineage[new]
+
+        leaf2lineage = {}
+        for leaf, taxid in six.iteritems(leaf2taxid):
+            if taxid in tax2lineage:
+                leaf2lineage[leaf] = tax2lineage[taxid]
+
+        broken_branches, tax2size = _find_broken_clades(tree, leaf2lineage)
+        broken_clades = set()
+        for taxa in six.itervalues(broken_branches):
+            broken_clades.update(taxa)
+        return BrokenClades(len(tax2size), broken_clades,
+                            [tax2size[tax] for tax in broken_clades])
+
 
     # def annotate_tree_with_taxa(self, t, name2taxa_file, tax2name=None, tax2track=None, attr_name="name"):
     #     if name2taxa_file:
@@ -709,27 +1835,132 @@ def load_ncbi_tree_from_dump(tar):
     print("Tree is loaded.")
     return t, synonyms
 
-def generate_table(t):
-    OUT = open("taxa.tab", "w")
-    for j, n in enumerate(t.traverse()):
-        if j%1000 == 0:
-            print("\r",j,"generating entries...", end=' ')
-        temp_node = n
-        track = []
-        while temp_node:
-            track.append(temp_node.name)
-            temp_node = temp_node.up
-        if n.up:
-            print('\t'.join([n.name, n.up.name, n.taxname, getattr(n, "common_name", ""), n.rank, ','.join(track)]), file=OUT)
+SYNONYM_NAME_TYPES = set(["synonym", "equivalent name", "genbank equivalent name",
+                          "anamorph", "genbank synonym", "genbank anamorph", "teleomorph"])
+
+def parse_taxdump_names(lines):
+    """Parses the names.dmp file of a NCBI taxdump.
+
+    :returns: a dictionary with the scientific name of each taxid, another
+        one with their genbank common names, and the set of (taxid, name)
+        synonyms.
+    """
+    taxid2name = {}
+    taxid2common = {}
+    synonyms = set()
+    for line in lines:
+        fields = line.decode().split("|")
+        taxid = int(fields[0])
+        taxname = fields[1].strip()
+        name_type = fields[3].strip().lower()
+        if name_type == "scientific name":
+            taxid2name[taxid] = taxname
+        elif name_type == "genbank common name":
+            taxid2common[taxid] = taxname
+        elif name_type in SYNONYM_NAME_TYPES:
+            synonyms.add((taxid, taxname))
+    return taxid2name, taxid2common, synonyms
+
+def parse_taxdump_nodes(lines):
+    """Parses the nodes.dmp file of a NCBI taxdump.
+
+    :returns: the list of taxids (in file order), an array with the parent
+        of each taxid (indexed by taxid), an array with the rank of each
+        taxid (as indexes in the returned list of rank names) and the list
+        of rank names.
+    """
+    taxids = array.array('i')
+    parents = array.array('i')
+    rank_codes = array.array('H')
+    rank2code = {}
+    for line in lines:
+        fields = line.decode().split("|", 3)
+        rank = fields[2].strip()
+        if rank not in rank2code:
+            rank2code[rank] = len(rank2code)
+        taxids.append(int(fields[0]))
+        parents.append(int(fields[1]))
+        rank_codes.append(rank2code[rank])
+
+    size = max(taxids) + 1 if taxids else 1
+    parent = array.array('i', [0]) * size
+    rank = array.array('H', [0]) * size
+    for taxid, parent_taxid, code in zip(taxids, parents, rank_codes):
+        parent[taxid] = parent_taxid
+        rank[taxid] = code
+    rank_names = sorted(rank2code, key=rank2code.get)
+    return taxids, parent, rank, rank_names
+
+def iter_taxonomy_rows(taxids, parent, rank, rank_names, taxid2name, taxid2common, prepostorder):
+    """Yields the rows of the species table, computing the track of each
+    taxid (its comma separated lineage, starting from itself) in a single
+    iterative preorder traversal from the root (taxid 1). Children are
+    visited in the same order as in nodes.dmp.
+
+    :param prepostorder: an array to which the pre and postorder traversal
+        of the tree is appended, as expected by build_traverse_index().
+    """
+    # children of each taxid, grouped by parent using a counting sort
+    first_child = array.array('i', [0]) * (len(parent) + 1)
+    for taxid in taxids:
+        if taxid != 1:
+            first_child[parent[taxid] + 1] += 1
+    for i in range(1, len(first_child)):
+        first_child[i] += first_child[i - 1]
+    children = array.array('i', [0]) * len(taxids)
+    next_pos = first_child[:-1]
+    for taxid in taxids:
+        if taxid != 1:
+            children[next_pos[parent[taxid]]] = taxid
+            next_pos[parent[taxid]] += 1
+    del next_pos
+
+    # the track of all nodes in the current path. Negative values in
+    # to_visit correspond to postorder visits.
+    tracks = {}
+    to_visit = [1]
+    while to_visit:
+        taxid = to_visit.pop(-1)
+        if taxid < 0:
+            prepostorder.append(-taxid)
+            del tracks[-taxid]
+            continue
+
+        prepostorder.append(taxid)
+        if taxid == 1:
+            parent_taxid = ""
+            track = "1"
         else:
-            print('\t'.join([n.name, "", n.taxname, getattr(n, "common_name", ""), n.rank, ','.join(track)]), file=OUT)
-    OUT.close()
+            parent_taxid = parent[taxid]
+            track = "%d,%s" %(taxid, tracks[parent_taxid])
+        yield (taxid, parent_taxid, taxid2name[taxid], taxid2common.get(taxid, ""),
+               rank_names[rank[taxid]], track)
+
+        start, end = first_child[taxid], first_child[taxid + 1]
+        if start < end:
+            tracks[taxid] = track
+            to_visit.append(-taxid)
+            to_visit.extend(reversed(children[start:end]))
+
+def iter_taxdump_merged(lines):
+    """ Yields the (taxid_old, taxid_new) pairs in the merged.dmp file """
+    for line in lines:
+        fields = line.decode().split("|")
+        yield int(fields[0]), int(fields[1])
 
 def update_db(dbfile, targz_file=None):
+    """Builds the taxonomy database, the traversal index and the fuzzy
+    name index from a NCBI taxdump.tar.gz file, which is downloaded if
+    targz_file is not provided.
+
+    Dump files are streamed and kept as plain arrays and dictionaries, and
+    all rows are inserted in a single transaction.
+    """
     basepath = os.path.split(dbfile)[0]
     if basepath and not os.path.exists(basepath):
         os.mkdir(basepath)
 
+    downloaded = False
     if not targz_file:
         try:
             from urllib import urlretrieve
@@ -740,84 +1971,74 @@ def update_db(dbfile, targz_file=None):
         urlretrieve("http://ftp.ncbi.nih.gov/pub/taxonomy/taxdump.tar.gz", "taxdump.tar.gz")
         print('Done. Parsing...', file=sys.stderr)
         targz_file = "taxdump.tar.gz"
+        downloaded = True
 
     tar = tarfile.open(targz_file, 'r')
-    t, synonyms = load_ncbi_tree_from_dump(tar)
-    prepostorder = [int(node.name) for post, node in t.iter_prepostorder()]
-    pickle.dump(prepostorder, open(dbfile+'.traverse.pkl', "wb"), 2)
+    print("Loading node names...", file=sys.stderr)
+    taxid2name, taxid2common, synonyms = parse_taxdump_names(tar.extractfile("names.dmp"))
+    print(len(taxid2name), "names loaded.", file=sys.stderr)
+    print(len(synonyms), "synonyms loaded.", file=sys.stderr)
 
-    print("Updating database: %s ..." %dbfile)
-    generate_table(t)
+    print("Loading nodes...", file=sys.stderr)
+    taxids, parent, rank, rank_names = parse_taxdump_nodes(tar.extractfile("nodes.dmp"))
+    print(len(taxids), "nodes loaded.", file=sys.stderr)
 
-    open("syn.tab", "w").write('\n'.join(["%s\t%s" %(v[0],v[1]) for v in synonyms]))
-
-    with open("merged.tab", "w") as merged:
-        for line in tar.extractfile("merged.dmp"):
-            line = str(line.decode())
-            out_line = '\t'.join([_f.strip() for _f in line.split('|')[:2]])
-            merged.write(out_line+'\n')
-    try:
-        upload_data(dbfile)
-    except:
-        raise
-    else:
-        os.system("rm syn.tab merged.tab taxa.tab")
-        # remove only downloaded taxdump file 
-        if not targz_file:
-            os.system("rm taxdump.tar.gz")
-
-def upload_data(dbfile):
-    print()
-    print('Uploading to', dbfile)
-    basepath = os.path.split(dbfile)[0]
-    if basepath and not os.path.exists(basepath):
-        os.mkdir(basepath)
-
-    db = sqlite3.connect(dbfile)
+    print("Updating database: %s ..." %dbfile, file=sys.stderr)
+    db = sqlite3.connect(dbfile, isolation_level=None)
+    db.execute("PRAGMA synchronous = OFF")
+    db.execute("PRAGMA journal_mode = MEMORY")
 
     create_cmd = """
     DROP TABLE IF EXISTS stats;
     DROP TABLE IF EXISTS species;
     DROP TABLE IF EXISTS synonym;
     DROP TABLE IF EXISTS merged;
+    DROP TABLE IF EXISTS name_trigram;
     CREATE TABLE stats (version INT PRIMARY KEY);
     CREATE TABLE species (taxid INT PRIMARY KEY, parent INT, spname VARCHAR(50) COLLATE NOCASE, common VARCHAR(50) COLLATE NOCASE, rank VARCHAR(50), track TEXT);
     CREATE TABLE synonym (taxid INT,spname VARCHAR(50) COLLATE NOCASE, PRIMARY KEY (spname, taxid));
     CREATE TABLE merged (taxid_old INT, taxid_new INT);
-    CREATE INDEX spname1 ON species (spname COLLATE NOCASE);
-    CREATE INDEX spname2 ON synonym (spname COLLATE NOCASE);
     """
-    for cmd in create_cmd.split(';'):
-        db.execute(cmd)
-    print()
-
-    db.execute("INSERT INTO stats (version) VALUES (%d);" %DB_VERSION)
-    db.commit()
-
-    for i, line in enumerate(open("syn.tab")):
-        if i%5000 == 0 :
-            print('\rInserting synonyms:     % 6d' %i, end=' ', file=sys.stderr)
-            sys.stderr.flush()
-        taxid, spname = line.strip('\n').split('\t')
-        db.execute("INSERT INTO synonym (taxid, spname) VALUES (?, ?);", (taxid, spname))
-    print()
-    db.commit()
-    for i, line in enumerate(open("merged.tab")):
-        if i%5000 == 0 :
-            print('\rInserting taxid merges: % 6d' %i, end=' ', file=sys.stderr)
-            sys.stderr.flush()
-        taxid_old, taxid_new = line.strip('\n').split('\t')
-        db.execute("INSERT INTO merged (taxid_old, taxid_new) VALUES (?, ?);", (taxid_old, taxid_new))
-    print()
-    db.commit()
-    for i, line in enumerate(open("taxa.tab")):
-        if i%5000 == 0 :
-            print('\rInserting taxids:      % 6d' %i, end=' ', file=sys.stderr)
-            sys.stderr.flush()
-        taxid, parentid, spname, common, rank, lineage = line.strip('\n').split('\t')
-        db.execute("INSERT INTO species (taxid, parent, spname, common, rank, track) VALUES (?, ?, ?, ?, ?, ?);", (taxid, parentid, spname, common, rank, lineage))
-    print()
-    db.commit()
+    prepostorder = array.array('i')
+    db.execute("BEGIN")
+    try:
+        for cmd in create_cmd.split(';'):
+            db.execute(cmd)
+        db.execute("INSERT INTO stats (version) VALUES (%d);" %DB_VERSION)
+        print("Inserting synonyms...", file=sys.stderr)
+        db.executemany("INSERT INTO synonym (taxid, spname) VALUES (?, ?);", synonyms)
+        print("Inserting taxid merges...", file=sys.stderr)
+        db.executemany("INSERT INTO merged (taxid_old, taxid_new) VALUES (?, ?);",
+                       iter_taxdump_merged(tar.extractfile("merged.dmp")))
+        print("Inserting taxids...", file=sys.stderr)
+        db.executemany("INSERT INTO species (taxid, parent, spname, common, rank, track) VALUES (?, ?, ?, ?, ?, ?);",
+                       iter_taxonomy_rows(taxids, parent, rank, rank_names,
+                                          taxid2name, taxid2common, prepostorder))
+        db.execute("CREATE INDEX spname1 ON species (spname COLLATE NOCASE);")
+        db.execute("CREATE INDEX spname2 ON synonym (spname COLLATE NOCASE);")
+        db.execute("COMMIT")
+        nspecies = _count_species_rows(db)
+    except:
+        db.execute("ROLLBACK")
+        raise
+    finally:
+        db.close()
+        tar.close()
+
+    build_traverse_index(prepostorder, dbfile+'.traverse.bin', nspecies)
+    # pickled traversal, read by previous versions sharing the database and
+    # used to rebuild the index if they update it
+    with open(dbfile+'.traverse.pkl', "wb") as CACHED_TRAVERSE:
+        pickle.dump(prepostorder.tolist(), CACHED_TRAVERSE, 2)
+
+    # release the parsed dump before building the name index
+    del taxid2name, taxid2common, synonyms, taxids, parent, rank, prepostorder
+    print("Building fuzzy name index...", file=sys.stderr)
+    build_fuzzy_index(dbfile)
+
+    # remove only downloaded taxdump file
+    if downloaded:
+        os.remove(targz_file)
 
 if __name__ == "__main__":
     ncbi = NCBITaxa()
@@ -43,7 +43,7 @@ import os
 import six
 from six.moves import map
 
-__all__ = ["read_newick", "write_newick", "print_supported_formats"]
+__all__ = ["read_newick", "iter_newick", "write_newick", "print_supported_formats"]
 
 ITERABLE_TYPES = set([list, set, tuple, frozenset])
 
@@ -64,6 +64,12 @@ _QUOTED_TEXT_RE = r"""((?=["'])(?:"[^"\\]*(?:\\[\s\S][^"\\]*)*"|'[^'\\]*(?:\\[\s
 
 _QUOTED_TEXT_PREFIX='ete3_quotref_'
 
+# Structural characters delimiting node data in a newick string
+_NEWICK_TOKEN_RE = re.compile("[(),;]")
+
+# Number of characters read at once when streaming newick files
+NEWICK_BUFFER_SIZE = 1024 ** 2
+
 DEFAULT_DIST = 1.0
 DEFAULT_NAME = ''
 DEFAULT_SUPPORT = 1.0
@@ -241,12 +247,8 @@ def read_newick(newick, root_node=None, format=0, quoted_names=False):
         # windows string.
         if len(newick)<220:     # then it could be either a path or a tree
             if os.path.exists(newick):
-                if newick.endswith('.gz'):
-                    import gzip
-                    nw = gzip.open(newick).read()
-                else:
-                    # note: this raises a deprecated error on  Win 7 with python 3.5.2
-                    nw = open(newick, 'rU').read()
+                with _open_newick_file(newick) as NW:
+                    nw = NW.read()
             else:
                 nw = newick
         else:
@@ -266,87 +268,205 @@ def read_newick(newick, root_node=None, format=0, quoted_names=False):
         raise NewickError("'newick' argument must be either a filename or a newick string.")
 
 
+def iter_newick(source, format=0, quoted_names=False, tree_class=None,
+                buffer_size=None):
+    """ Iterates over the trees contained in a newick file, yielding them one
+    by one as soon as they are read. Trees must be terminated by a semicolon,
+    and they can span several lines or share the same one.
+
+    The file is read in chunks of fixed size, so memory usage does not depend
+    on the number of trees in the file. This is the recommended way to process
+    large collections of trees (i.e. bootstrap replicates or posterior tree
+    samples).
+
+    :argument source: path to a newick file (gzipped files are automatically
+      detected by their .gz extension) or an open file handle.
+
+    :argument 0 format: subnewick format used to read each tree.
+
+    :argument False quoted_names: set to True if node names are quoted.
+
+    :argument None tree_class: class used to create the trees. TreeNode by
+      default.
+
+    :argument None buffer_size: number of characters read at once from the
+      file (NEWICK_BUFFER_SIZE by default).
+
+    **Example:**
+
+    ::
+
+      for tree in iter_newick("bootstrap_trees.nw.gz", format=1):
+          print(tree.get_topology_id())
+
+    """
+    if tree_class is None:
+        from ..coretype.tree import TreeNode
+        tree_class = TreeNode
+
+    if isinstance(source, six.string_types):
+        handle = _open_newick_file(source)
+    else:
+        handle = source
+
+    try:
+        for nw in _iter_newick_strings(handle, quoted_names=quoted_names,
+                                       buffer_size=buffer_size):
+            yield tree_class(nw, format=format, quoted_node_names=quoted_names)
+    finally:
+        if handle is not source:
+            handle.close()
+
+def _open_newick_file(fname):
+    """ Opens a plain or gzipped newick file in text mode. """
+    if fname.endswith('.gz'):
+        import gzip
+        return gzip.open(fname, 'rb' if six.PY2 else 'rt')
+    else:
+        # universal newlines are the default in python3, and "rU" mode is no
+        # longer accepted since python 3.11
+        return open(fname, 'rU' if six.PY2 else 'r')
+
+def _iter_newick_strings(handle, quoted_names=False, buffer_size=None):
+    """ Reads a file handle in chunks and yields the text of every newick tree
+    found, including its ending semicolon. """
+    if buffer_size is None:
+        buffer_size = NEWICK_BUFFER_SIZE
+
+    decoder = None
+    pending = []
+    while True:
+        chunk = handle.read(buffer_size)
+        if not chunk:
+            break
+        if not isinstance(chunk, six.string_types):
+            # binary handles are decoded incrementally, so multibyte
+            # characters split between two chunks are correctly read
+            if decoder is None:
+                import codecs
+                decoder = codecs.getincrementaldecoder('utf-8')()
+            chunk = decoder.decode(chunk)
+
+        start = 0
+        end = chunk.find(';')
+        while end != -1:
+            pending.append(chunk[start:end+1])
+            nw = ''.join(pending)
+            if quoted_names and not _quotes_closed(nw):
+                # the semicolon is part of a quoted name
+                pending = [nw]
+            else:
+                pending = []
+                nw = nw.strip()
+                if nw != ';':
+                    yield nw
+            start = end + 1
+            end = chunk.find(';', start)
+        pending.append(chunk[start:])
+
+    if ''.join(pending).strip():
+        raise NewickError('Unexpected end of newick stream. Last tree is not terminated by ";"')
+
+def _quotes_closed(nw):
+    """ Returns True if all quoted text in the newick string is closed. """
+    unquoted = re.sub(_QUOTED_TEXT_RE, '', nw)
+    return '"' not in unquoted and "'" not in unquoted
+
 def _read_newick_from_string(nw, root_node, matcher, formatcode, quoted_names):
-    """ Reads a newick string in the New Hampshire format. """
-
-    if quoted_names: 
-        # Quoted text is mapped to references
-        quoted_map = {}
-        unquoted_nw = ''
-        counter = 0
-        for token in re.split(_QUOTED_TEXT_RE, nw):
-            counter += 1
-            if counter % 2 == 1 : # normal newick tree structure data
-                unquoted_nw += token
-            else: # quoted text, add to dictionary and replace with reference
-                quoted_ref_id= _QUOTED_TEXT_PREFIX + str(int(counter/2))
-                unquoted_nw += quoted_ref_id
-                quoted_map[quoted_ref_id]=token[1:-1]  # without the quotes
-        nw = unquoted_nw
+    """ Reads a newick string in the New Hampshire format.
+
+    The string is scanned only once. Node data found between two structural
+    characters is sliced out and parsed as soon as its closing character is
+    found, so no intermediate copies of the tree text are created.
+    """
+    quoted_map = None
+    if quoted_names:
+        nw, quoted_map = _replace_quoted_text(nw)
 
     if not nw.startswith('(') and nw.endswith(';'):
-        _read_node_data(nw[:-1], root_node, "single", matcher, format)
-        if quoted_names:
-            if root_node.name.startswith(_QUOTED_TEXT_PREFIX):
-                root_node.name = quoted_map[root_node.name]
+        node = _read_node_data(nw[:-1], root_node, "single", matcher, formatcode)
+        if quoted_map:
+            _restore_quoted_name(node, quoted_map)
         return root_node
 
-    if nw.count('(') != nw.count(')'):
-        raise NewickError('Parentheses do not match. Broken tree structure?')
-
-    # white spaces and separators are removed
-    nw = re.sub("[\n\r\t]+", "", nw)
+    # tabs and new lines are not part of the newick data. They are only
+    # removed (with a full copy of the string) if actually present.
+    if "\n" in nw or "\r" in nw or "\t" in nw:
+        nw = re.sub("[\n\r\t]+", "", nw)
 
     current_parent = None
-    # Each chunk represents the content of a parent node, and it could contain
-    # leaves and closing parentheses.
-    # We may find:
-    # leaf, ..., leaf,
-    # leaf, ..., leaf))),
-    # leaf)), leaf, leaf))
-    # leaf))
-    # ) only if formatcode == 100
-
-    for chunk in nw.split("(")[1:]:
-        # If no node has been created so far, this is the root, so use the node.
-        current_parent = root_node if current_parent is None else current_parent.add_child()
-
-        subchunks = [ch.strip() for ch in chunk.split(",")]
-        # We should expect that the chunk finished with a comma (if next chunk
-        # is an internal sister node) or a subchunk containing closing parenthesis until the end of the tree.
-        #[leaf, leaf, '']
-        #[leaf, leaf, ')))', leaf, leaf, '']
-        #[leaf, leaf, ')))', leaf, leaf, '']
-        #[leaf, leaf, ')))', leaf), leaf, 'leaf);']
-        if subchunks[-1] != '' and not subchunks[-1].endswith(';'):
-            raise NewickError('Broken newick structure at: %s' %chunk)
-
-        # lets process the subchunks. Every closing parenthesis will close a
-        # node and go up one level.
-        for i, leaf in enumerate(subchunks):
-            if leaf.strip() == '' and i == len(subchunks) - 1:
-                continue # "blah blah ,( blah blah"
-            closing_nodes = leaf.split(")")
-
-            # first part after splitting by ) always contain leaf info
-            _read_node_data(closing_nodes[0], current_parent, "leaf", matcher, formatcode)
-
-            # next contain closing nodes and data about the internal nodes.
-            if len(closing_nodes)>1:
-                for closing_internal in closing_nodes[1:]:
-                    closing_internal =  closing_internal.rstrip(";")
-                    # read internal node data and go up one level
-                    _read_node_data(closing_internal, current_parent, "internal", matcher, formatcode)
-                    current_parent = current_parent.up
-
-    # references in node names are replaced with quoted text before returning
-    if quoted_names:
-        for node in root_node.traverse():
-            if node.name.startswith(_QUOTED_TEXT_PREFIX):
-                node.name = quoted_map[node.name]
+    # internal node whose closing parenthesis has just been found, and whose
+    # data (if any) is waiting to be read
+    closed_node = None
+    depth = 0
+    pos = 0
+    finished = False
+    for token in _NEWICK_TOKEN_RE.finditer(nw):
+        char = token.group()
+        start = token.start()
+
+        if char == "(":
+            if closed_node is not None or nw[pos:start].strip():
+                raise NewickError('Broken newick structure at: %s' %nw[max(0, start-49):start+1])
+            # If no node has been created so far, this is the root, so use the node.
+            current_parent = root_node if current_parent is None else current_parent.add_child()
+            depth += 1
+
+        else:
+            if closed_node is not None:
+                node = _read_node_data(nw[pos:start], closed_node, "internal", matcher, formatcode)
+                closed_node = None
+            elif depth and char != ";":
+                node = _read_node_data(nw[pos:start], current_parent, "leaf", matcher, formatcode)
+            else:
+                raise NewickError('Broken newick structure at: %s' %nw[max(0, start-49):start+1])
+
+            if quoted_map:
+                _restore_quoted_name(node, quoted_map)
+
+            if char == ")":
+                if not depth:
+                    raise NewickError('Parentheses do not match. Broken tree structure?')
+                closed_node = current_parent
+                current_parent = current_parent.up
+                depth -= 1
+            elif char == ";":
+                if depth:
+                    raise NewickError('Parentheses do not match. Broken tree structure?')
+                finished = True
+                pos = token.end()
+                break
+            elif not depth:
+                raise NewickError('Broken newick structure at: %s' %nw[max(0, start-49):start+1])
+
+        pos = token.end()
+
+    if not finished or nw[pos:].strip():
+        raise NewickError('Unexpected data after the end of the tree: %s' %nw[pos:pos+50])
 
     return root_node
 
+def _replace_quoted_text(nw):
+    """ Maps quoted text in a newick string to reference names. Returns the
+    newick string with the quoted text replaced and the dictionary to
+    recover it. """
+    quoted_map = {}
+    unquoted_nw = []
+    counter = 0
+    for token in re.split(_QUOTED_TEXT_RE, nw):
+        counter += 1
+        if counter % 2 == 1 : # normal newick tree structure data
+            unquoted_nw.append(token)
+        else: # quoted text, add to dictionary and replace with reference
+            quoted_ref_id= _QUOTED_TEXT_PREFIX + str(int(counter/2))
+            unquoted_nw.append(quoted_ref_id)
+            quoted_map[quoted_ref_id]=token[1:-1]  # without the quotes
+    return ''.join(unquoted_nw), quoted_map
+
+def _restore_quoted_name(node, quoted_map):
+    if node is not None and node.name.startswith(_QUOTED_TEXT_PREFIX):
+        node.name = quoted_map[node.name]
+
 def _parse_extra_features(node, NHX_string):
     """ Reads node's extra data form its NHX string. NHX uses this
     format:  [&&NHX:prop1=value1:prop2=value2] """
@@ -405,43 +525,39 @@ def compile_matchers(formatcode):
 
 def _read_node_data(subnw, current_node, node_type, matcher, formatcode):
     """ Reads a leaf node from a subpart of the original newick
-    tree """
+    tree, and returns the node holding the data. """
 
-    if node_type == "leaf" or node_type == "single":
-        if node_type == "leaf":
-            node = current_node.add_child()
-        else:
-            node = current_node
+    if node_type == "leaf":
+        node = current_node.add_child()
     else:
         node = current_node
 
     subnw = subnw.strip()
-    
+
     if not subnw and node_type == 'leaf' and formatcode != 100:
         raise NewickError('Empty leaf node found')
     elif not subnw:
-        return
+        return node
 
     container1, container2, converterFn1, converterFn2, compiled_matcher = matcher[node_type]
-    data = re.match(compiled_matcher, subnw)
+    data = compiled_matcher.match(subnw)
     if data:
-        data = data.groups()
+        first, second, extra = data.groups()
         # This prevents ignoring errors even in flexible nodes:
-        if subnw and data[0] is None and data[1] is None and data[2] is None:
+        if first is None and second is None and extra is None:
             raise NewickError("Unexpected newick format '%s'" %subnw)
 
-        if data[0] is not None and data[0] != '':
-            node.add_feature(container1, converterFn1(data[0].strip()))
+        if first:
+            node.add_feature(container1, converterFn1(first.strip()))
 
-        if data[1] is not None and data[1] != '':
-            node.add_feature(container2, converterFn2(data[1][1:].strip()))
+        if second:
+            node.add_feature(container2, converterFn2(second[1:].strip()))
 
-        if data[2] is not None \
-                and data[2].startswith("[&&NHX"):
-            _parse_extra_features(node, data[2])
+        if extra is not None and extra.startswith("[&&NHX"):
+            _parse_extra_features(node, extra)
     else:
         raise NewickError("Unexpected newick format '%s' " %subnw[0:50])
-    return
+    return node
 
 def write_newick(rootnode, features=None, format=1, format_root_node=True,
                  is_leaf_fn=None, dist_formatter=None, support_formatter=None,
@@ -200,12 +200,35 @@ def iter_sptrees(sptrees, nid2node, features=None, newick_only=False):
                     leaf.add_feature(f, getattr(nid2node[_nid], f))
             yield t
 
+_CALL, _RETURN = 0, 1
+
 def _get_subtrees_recursive(node, full_copy=True):
+    """ Returns all species trees under node. The recursive algorithm in
+    _subtrees_steps() is run using an explicit stack of generators, so it
+    does not hit the recursion limit on very deep trees. """
+    stack = [_subtrees_steps(node, full_copy)]
+    result = None
+    while stack:
+        action, value = stack[-1].send(result)
+        result = None
+        if action == _CALL:
+            stack.append(_subtrees_steps(value, full_copy))
+        else:
+            stack.pop(-1)
+            result = value
+    return result
+
+def _subtrees_steps(node, full_copy):
+    """ Generator version of the recursive species trees algorithm. It
+    yields (_CALL, child) to request the species trees of child, which are
+    sent back by _get_subtrees_recursive(), and (_RETURN, sp_trees) when
+    done. """
     if is_dup(node):
         sp_trees = []
         for ch in node.children:
-            sp_trees.extend(_get_subtrees_recursive(ch, full_copy=full_copy))
-        return sp_trees
+            sp_trees.extend((yield (_CALL, ch)))
+        yield (_RETURN, sp_trees)
+        return
 
     # saves a list of duplication nodes under current node
     dups = []
@@ -225,7 +248,7 @@ def _get_subtrees_recursive(node, full_copy=True):
             #get all sibling sptrees in each side of the
             #duplication. Each subtree is pointed to its anchor
             for ch in dp.children:
-                for subt in _get_subtrees_recursive(ch, full_copy=full_copy):
+                for subt in (yield (_CALL, ch)):
                     if not full_copy:
                         subt = node.__class__(subt)
                     subt.up = anchor
@@ -247,10 +270,9 @@ def _get_subtrees_recursive(node, full_copy=True):
                 else:
                     sp_trees.append(subt)
             if full_copy:
-                 back_up = node.up
-                 node.up = None
-                 _node = node.copy()
-                 node.up = back_up
+                # species trees are returned to the user, so they must not
+                # share mutable feature values with the source tree
+                _node = node._fast_copy(copy_values=True)
             else:
                 _node = node.write(format=9, features=["name", "evoltype"])
             sp_trees.append(_node)
@@ -259,27 +281,31 @@ def _get_subtrees_recursive(node, full_copy=True):
                 subt.up.children.pop(-1)
     else:
         if full_copy:
-            back_up = node.up
-            node.up = None
-            _node = node.copy()
-            node.up = back_up
+            _node = node._fast_copy(copy_values=True)
         else:
             _node = node.write(format=9, features=["name", "evoltype"])
         #node.detach()
         sp_trees = [_node]
 
-    return sp_trees
+    yield (_RETURN, sp_trees)
 
 def get_subparts(n):
     def is_dup(n):
         return getattr(n, "evoltype", None) == "D"
 
     subtrees = []
-    if is_dup(n):
-        for ch in n.get_children():
-            ch.detach()
-            subtrees.extend(get_subparts(ch))
-    else:
+    # pending nodes are processed in the same order as the original
+    # recursive algorithm, using an explicit stack
+    pending = [n]
+    while pending:
+        n = pending.pop(-1)
+        if is_dup(n):
+            children = n.get_children()
+            for ch in children:
+                ch.detach()
+            pending.extend(reversed(children))
+            continue
+
         to_visit = []
         for _n in n.iter_leaves(is_leaf_fn=is_dup):
             if is_dup(_n):
@@ -303,8 +329,7 @@ def get_subparts(n):
         else:
             subtrees.append(n)
 
-        for _n in to_visit:
-            subtrees.extend(get_subparts(_n))
+        pending.extend(reversed(to_visit))
 
     return subtrees
 
@@ -647,9 +672,10 @@ class PhyloNode(TreeNode):
 
         return sp_trees
 
-    def __get_speciation_trees_recursive(self):
+    def __get_speciation_trees_recursive(self, autodetect_duplications=True):
         """ experimental and testing """
-        t = self.copy()
+        # scratch copy: returned species trees are copied again
+        t = self.copy("fast")
         if autodetect_duplications:
             dups = 0
             #n2content, n2species = t.get_node2species()
@@ -686,10 +712,9 @@ class PhyloNode(TreeNode):
 
         :returns: species_trees
         """
-        try:
-            t = self.copy()
-        except Exception:
-            t = self.copy("deepcopy")
+        # subtrees are parts of this copy returned to the user, so they
+        # must not share mutable feature values with the original tree
+        t = self._fast_copy(copy_values=True)
 
         if autodetect_duplications:
             dups = 0
@@ -799,20 +824,31 @@ class PhyloNode(TreeNode):
 
 
     def ncbi_compare(self, autodetect_duplications=True, cached_content=None):
+        """Returns the NCBI taxa that are not monophyletic in this tree, which
+        must be annotated with annotate_ncbi_taxa(). If duplicated species
+        are found, each speciation tree (see get_speciation_trees()) is
+        evaluated independently.
+
+        :returns: a list with the (broken_branches, broken_clades,
+            broken_clade_sizes) tuple returned by
+            NCBITaxa.get_broken_branches() for each evaluated tree.
+        """
         if not cached_content:
             cached_content = self.get_cached_content()
         cached_species = set([n.species for n in cached_content[self]])
 
         if len(cached_species) != len(cached_content[self]):
-            print(cached_species)
-            ntrees, ndups, target_trees = self.get_speciation_trees(autodetect_duplications=autodetect_duplications, map_features=["taxid"])
+            ntrees, ndups, target_trees = self.get_speciation_trees(autodetect_duplications=autodetect_duplications,
+                                                                    map_features=["taxid", "sci_name", "lineage"])
         else:
             target_trees = [self]
 
-
         ncbi = NCBITaxa()
+        results = []
         for t in target_trees:
-            ncbi.get_broken_branches(t, cached_content)
+            taxa_lineages = dict((leaf.taxid, leaf.lineage) for leaf in t.iter_leaves())
+            results.append(ncbi.get_broken_branches(t, taxa_lineages))
+        return results
 
 
 
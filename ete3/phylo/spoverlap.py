@@ -37,10 +37,228 @@ from __future__ import absolute_import
 #
 #
 # #END_LICENSE#############################################################
+"""
+Species overlap detection of duplication and speciation events.
+
+All the information needed by the species overlap algorithm is computed in
+a single postorder traversal of the gene tree (see :class:`SpeciesOverlap`).
+Species under every node are encoded as bits of an integer mask, so the
+overlap between the two sides of any node is computed with a couple of
+binary operations, and the leaves under every node are a range of the
+leaves in preorder, so sequence names at both sides of an event are only
+listed when its EvolEvent is created.
+"""
+import six
 
 from .evolevents import EvolEvent
+from ..utils import count_bits, imap_chunks
+
+__all__ = ["get_evol_events_from_leaf", "get_evol_events_from_root",
+           "SpeciesOverlap", "iter_evol_events"]
+
+def _get_overlap(mask1, mask2):
+    """ Returns the fraction of species in two species masks found in both
+    of them. """
+    return float(count_bits(mask1 & mask2)) / count_bits(mask1 | mask2)
+
+
+class SpeciesOverlap(object):
+    """
+    .. versionadded:: 3.1.2
+
+    Species masks and leaf ranges of all the nodes in a gene tree, computed
+    in a single postorder traversal, and used to detect duplication and
+    speciation events with the species overlap algorithm described in:
+
+    "The Human Phylome." Huerta-Cepas J, Dopazo H, Dopazo J, Gabaldon
+    T. Genome Biol. 2007;8(6):R109.
+
+    Events are labeled (``evoltype`` feature) as soon as they are detected,
+    but EvolEvent instances are only created while iterating over them.
+
+    :argument tree: any node of a rooted PhyloTree. The whole tree
+      containing it is analyzed.
+    """
+
+    def __init__(self, tree):
+        self.root = tree.get_tree_root()
+        # leaf names and species, in preorder
+        self.leaf_names = []
+        self.leaf_species = []
+        # species -> bit
+        self._species_bits = {}
+        # node -> species mask of its leaves
+        self._masks = {}
+        # node -> (start, end) range of its leaves in leaf_names
+        self._ranges = {}
+
+        leaf_names = self.leaf_names
+        leaf_species = self.leaf_species
+        masks = self._masks
+        ranges = self._ranges
+        # pending internal nodes: [species mask, start position]
+        stack = []
+        for post, node in self.root.iter_prepostorder():
+            if post:
+                mask, start = stack.pop()
+            elif node.children:
+                stack.append([0, len(leaf_names)])
+                continue
+            else:
+                start = len(leaf_names)
+                mask = self._get_species_bit(node.species)
+                leaf_names.append(node.name)
+                leaf_species.append(node.species)
+            masks[node] = mask
+            ranges[node] = (start, len(leaf_names))
+            if stack:
+                stack[-1][0] |= mask
+
+    def _get_species_bit(self, species):
+        bit = self._species_bits.get(species)
+        if bit is None:
+            bit = self._species_bits[species] = 1 << len(self._species_bits)
+        return bit
+
+    def _get_outgroup(self):
+        """ Returns the child of the root with fewer leaves. """
+        outgroups = self.root.children
+        if len(outgroups) != 2:
+            raise TypeError("Tree is not rooted")
+        sizes = [self._ranges[n][1] - self._ranges[n][0] for n in outgroups]
+        return outgroups[1] if sizes[1] < sizes[0] else outgroups[0]
 
-__all__ = ["get_evol_events_from_leaf", "get_evol_events_from_root"]
+    def _clear_labels(self):
+        for node in self._ranges:
+            node.del_feature("evoltype")
+
+    def get_names(self, node):
+        """ Returns the set of leaf names under a node. """
+        start, end = self._ranges[node]
+        return set(self.leaf_names[start:end])
+
+    def get_species(self, node):
+        """ Returns the set of species under a node. """
+        start, end = self._ranges[node]
+        return set(self.leaf_species[start:end])
+
+    def get_overlap(self, node):
+        """ Returns the species overlap score between the two children of a
+        node. """
+        if len(node.children) != 2:
+            raise TypeError("nodes are expected to have two childs.")
+        return _get_overlap(self._masks[node.children[0]], self._masks[node.children[1]])
+
+    def iter_events_from_root(self, sos_thr=0.0):
+        """ Labels all the internal nodes of the tree as duplications
+        (``evoltype="D"``) if their species overlap score is higher than
+        sos_thr, or as speciations (``evoltype="S"``) otherwise, and returns
+        an iterator over the EvolEvent of every node, in level order (see
+        :func:`PhyloNode.get_descendant_evol_events`).
+        """
+        outgroup = self._get_outgroup()
+        self._clear_labels()
+        detected = []
+        for node in self.root.traverse("levelorder"):
+            if node.children:
+                score = self.get_overlap(node)
+                etype = "D" if score > sos_thr else "S"
+                node.add_feature("evoltype", etype)
+                detected.append((node, etype, score))
+        return self._iter_root_events(detected, outgroup)
+
+    def _iter_root_events(self, detected, outgroup):
+        fam_size = len(self.leaf_names)
+        outgroup_spcs = self.get_species(outgroup)
+        for node, etype, score in detected:
+            side_a, side_b = node.children
+            event = EvolEvent()
+            event.fam_size = fam_size
+            event.branch_supports = [node.support, side_a.support, side_b.support]
+            event.sos = score
+            event.outgroup_spcs = outgroup_spcs
+            event.in_seqs = self.get_names(side_a)
+            event.out_seqs = self.get_names(side_b)
+            event.inparalogs = set(event.in_seqs)
+            event.node = node
+            event.etype = etype
+            if etype == "D":
+                event.outparalogs = set(event.out_seqs)
+                event.orthologs = set([])
+            else:
+                event.orthologs = set(event.out_seqs)
+                event.outparalogs = set([])
+            yield event
+
+    def iter_events_from_leaf(self, seed, sos_thr=0.0):
+        """ Labels the nodes from seed to the root as duplications
+        (``evoltype="D"``) if the species overlap between the sequences
+        already browsed and their sister sequences is higher than sos_thr,
+        or as speciations (``evoltype="S"``) if it is equal to sos_thr, and
+        returns an iterator over the EvolEvent of every labeled node, from
+        seed to the root (see :func:`PhyloNode.get_my_evol_events`).
+        """
+        outgroup = self._get_outgroup()
+        self._clear_labels()
+        ranges = self._ranges
+        masks = self._masks
+        browsed = self._get_species_bit(seed.species)
+        detected = []
+        current = seed
+        while current.up:
+            parent = current.up
+            if len(parent.children) == 1:
+                # no sister sequences
+                current = parent
+                continue
+            sisters = 0
+            for sister in parent.children:
+                if sister is not current:
+                    sisters |= masks[sister]
+            score = _get_overlap(browsed, sisters)
+            if score > sos_thr:
+                etype = "D"
+            elif score == sos_thr:
+                etype = "S"
+            else:
+                etype = None
+            if etype:
+                parent.add_feature("evoltype", etype)
+                detected.append((parent, etype, score, ranges[current], ranges[parent]))
+            browsed |= sisters
+            current = parent
+        return self._iter_leaf_events(seed, detected, outgroup)
+
+    def _iter_leaf_events(self, seed, detected, outgroup):
+        names = self.leaf_names
+        species = self.leaf_species
+        ref_spcs = seed.species
+        fam_size = species.count(ref_spcs)
+        seed_start, seed_end = self._ranges[seed]
+        for node, etype, score, (start, end), (p_start, p_end) in detected:
+            # browsed leaves are those under the current node but the
+            # seed itself, which may be an internal node
+            inside = list(range(start, seed_start)) + list(range(seed_end, end))
+            outside = list(range(p_start, start)) + list(range(end, p_end))
+            event = EvolEvent()
+            event.fam_size = fam_size
+            event.seed = seed.name
+            event.sos = score
+            event.outgroup = outgroup.name
+            event.in_seqs = set([names[i] for i in inside])
+            event.in_seqs.add(seed.name)
+            event.out_seqs = set([names[i] for i in outside])
+            event.inparalogs = set([names[i] for i in inside if species[i] == ref_spcs])
+            event.inparalogs.add(seed.name)
+            event.node = node
+            event.etype = etype
+            if etype == "D":
+                event.outparalogs = set([names[i] for i in outside if species[i] == ref_spcs])
+                event.orthologs = set([])
+            else:
+                event.orthologs = set([names[i] for i in outside if species[i] != ref_spcs])
+                event.outparalogs = set([])
+            yield event
 
 def get_evol_events_from_leaf(node, sos_thr=0.0):
     """ Returns a list of duplication and speciation events in
@@ -56,96 +274,7 @@ def get_evol_events_from_leaf(node, sos_thr=0.0):
     "The Human Phylome." Huerta-Cepas J, Dopazo H, Dopazo J, Gabaldon
     T. Genome Biol. 2007;8(6):R109.
     """
-    # Get the tree's root
-    root = node.get_tree_root()
-
-    # Checks that is actually rooted
-    outgroups = root.get_children()
-    if len(outgroups) != 2:
-        raise TypeError("Tree is not rooted")
-
-    # Cautch the smaller outgroup (will be stored as the tree
-    # outgroup)
-    o1 = set([n.name for n in outgroups[0].get_leaves()])
-    o2 = set([n.name for n in outgroups[1].get_leaves()])
-
-    if len(o2)<len(o1):
-        smaller_outg = outgroups[1]
-    else:
-        smaller_outg = outgroups[0]
-
-
-    # Prepare to browse tree from leaf to root
-    all_events = []
-    current  = node
-    ref_spcs = node.species
-    sister_leaves  = set([])
-    browsed_spcs   = set([current.species])
-    browsed_leaves = set([current])
-    # get family Size
-    fSize =  len([n for n in root.get_leaves() if n.species == ref_spcs])
-
-    # Clean previous analysis
-    for n in root.get_descendants()+[root]:
-        n.del_feature("evoltype")
-
-    while current.up:
-        # distances control (0.0 distance check)
-        d = 0
-        for s in current.get_sisters():
-            for leaf in s.get_leaves():
-                d += current.get_distance(leaf)
-                sister_leaves.add(leaf)
-        # Process sister node only if there is any new sequence.
-        # (previene dupliaciones por nombres repetidos)
-        sister_leaves = sister_leaves.difference(browsed_leaves)
-        if len(sister_leaves)==0:
-            current = current.up
-            continue
-        # Gets species at both sides of event
-        sister_spcs     = set([n.species for n in sister_leaves])
-        overlaped_spces = browsed_spcs & sister_spcs
-        all_spcs        = browsed_spcs | sister_spcs
-        score = float(len(overlaped_spces))/len(all_spcs)
-        # Creates a new evolEvent
-        event = EvolEvent()
-        event.fam_size   = fSize
-        event.seed      = node.name
-        # event.e_newick  = current.up.get_newick()  # high mem usage!!
-        event.sos = score
-        event.outgroup  = smaller_outg.name
-        # event.allseqs   = set(current.up.get_leaf_names())
-        event.in_seqs = set([n.name for n in browsed_leaves])
-        event.out_seqs = set([n.name for n in sister_leaves])
-        event.inparalogs  = set([n.name for n in browsed_leaves if n.species == ref_spcs])
-
-        # If species overlap: duplication
-        if score > sos_thr:# and d > 0.0: Removed branch control.
-            event.node = current.up
-            event.etype = "D"
-            event.outparalogs = set([n.name for n in sister_leaves  if n.species == ref_spcs])
-            event.orthologs   = set([])
-            current.up.add_feature("evoltype","D")
-            all_events.append(event)
-
-        # If NO species overlap: speciation
-        elif score == sos_thr:
-            event.node = current.up
-            event.etype = "S"
-            event.orthologs = set([n.name for n in sister_leaves if n.species != ref_spcs])
-            event.outparalogs = set([])
-            current.up.add_feature("evoltype","S")
-            all_events.append(event)
-        else:
-            pass # do not add event if distances == 0
-
-        # Updates browsed species
-        browsed_spcs   |= sister_spcs
-        browsed_leaves |= sister_leaves
-        sister_leaves  = set([])
-        # And keep ascending
-        current = current.up
-    return all_events
+    return list(SpeciesOverlap(node).iter_events_from_leaf(node, sos_thr=sos_thr))
 
 def get_evol_events_from_root(node, sos_thr):
     """ Returns a list of **all** duplication and speciation
@@ -156,85 +285,66 @@ def get_evol_events_from_root(node, sos_thr):
     "The Human Phylome." Huerta-Cepas J, Dopazo H, Dopazo J, Gabaldon
     T. Genome Biol. 2007;8(6):R109.
     """
+    return list(SpeciesOverlap(node).iter_events_from_root(sos_thr=sos_thr))
 
-    # Get the tree's root
-    root = node.get_tree_root()
+def iter_evol_events(trees, sos_thr=0.0, sp_naming_function=None, newick_format=0,
+                     n_jobs=1, chunksize=100):
+    """
+    .. versionadded:: 3.1.2
 
-    # Checks that is actually rooted
-    outgroups = root.get_children()
-    if len(outgroups) != 2:
-        raise TypeError("Tree is not rooted")
+    Detects the duplication and speciation events of a collection of gene
+    trees (i.e. a whole phylome) with the species overlap algorithm, and
+    yields the list of events of every tree (see
+    :func:`PhyloNode.get_descendant_evol_events`), in the same order as
+    the trees.
 
-    # Cautch the smaller outgroup (will be stored as the tree outgroup)
-    o1 = set([n.name for n in outgroups[0].get_leaves()])
-    o2 = set([n.name for n in outgroups[1].get_leaves()])
+    :argument trees: an iterable of rooted PhyloTree instances or newick
+      strings.
 
+    :argument 0.0 sos_thr: species overlap score threshold used to detect
+      duplications.
 
-    if len(o2)<len(o1):
-        smaller_outg = outgroups[1]
-    else:
-        smaller_outg = outgroups[0]
+    :argument None sp_naming_function: function used to get the species of
+      the leaves of trees given as newick strings. If None, PhyloTree's
+      default is used. It must be a module level function if n_jobs is not
+      1.
 
-    # Get family size
-    fSize = len( [n for n in root.get_leaves()] )
+    :argument 0 newick_format: subnewick format used to read trees given as
+      newick strings.
 
-    # Clean data from previous analyses
-    for n in root.get_descendants()+[root]:
-        n.del_feature("evoltype")
+    :argument 1 n_jobs: number of processes used to analyze the trees. If
+      None, all available CPUs are used. Trees are sent to the processes
+      in chunks, so newick strings are faster than PhyloTree instances,
+      and the node attribute of the events they return is None, as tree
+      nodes are not sent back.
 
-    # Gets Prepared to browse the tree from root to leaves
-    to_visit = []
-    current = root
-    all_events = []
-    while current:
-        # Gets childs and appends them to the To_visit list
-        childs = current.get_children()
-        to_visit += childs
-        if len(childs)>2:
-            raise TypeError("nodes are expected to have two childs.")
-        elif len(childs)==0:
-            pass # leaf
+    :argument 100 chunksize: number of trees sent at once to each process.
+    """
+    settings = (sos_thr, sp_naming_function, newick_format)
+    if n_jobs == 1:
+        for tree in trees:
+            yield _get_tree_events(settings, tree)
+        return
+
+    for chunk_events in imap_chunks(_evol_events_worker, settings, trees, n_jobs, chunksize):
+        for events in chunk_events:
+            yield events
+
+def _get_tree_events(settings, tree):
+    sos_thr, sp_naming_function, newick_format = settings
+    if isinstance(tree, six.string_types):
+        from .phylotree import PhyloTree
+        if sp_naming_function is None:
+            tree = PhyloTree(tree, format=newick_format)
         else:
-            # Get leaves and species at both sides of event
-            sideA_leaves= set([n for n in childs[0].get_leaves()])
-            sideB_leaves= set([n for n in childs[1].get_leaves()])
-            sideA_spcs  = set([n.species for n in childs[0].get_leaves()])
-            sideB_spcs  = set([n.species for n in childs[1].get_leaves()])
-            # Calculates species overlap
-            overlaped_spcs = sideA_spcs & sideB_spcs
-            all_spcs       = sideA_spcs | sideB_spcs
-            score = float(len(overlaped_spcs))/len(all_spcs)
-
-            # Creates a new evolEvent
-            event = EvolEvent()
-            event.fam_size   = fSize
-            event.branch_supports = [current.support, current.children[0].support, current.children[1].support]
-            # event.seed      = leafName
-            # event.e_newick  = current.up.get_newick()  # high mem usage!!
-            event.sos = score
-            event.outgroup_spcs  = smaller_outg.get_species()
-            event.in_seqs = set([n.name for n in sideA_leaves])
-            event.out_seqs = set([n.name for n in sideB_leaves])
-            event.inparalogs  = set([n.name for n in sideA_leaves])
-            # If species overlap: duplication
-            if score >sos_thr:
-                event.node = current
-                event.etype = "D"
-                event.outparalogs = set([n.name for n in sideB_leaves])
-                event.orthologs   = set([])
-                current.add_feature("evoltype","D")
-            # If NO species overlap: speciation
-            else:
-                event.node = current
-                event.etype = "S"
-                event.orthologs = set([n.name for n in sideB_leaves])
-                event.outparalogs = set([])
-                current.add_feature("evoltype","S")
-
-            all_events.append(event)
-        # Keep visiting nodes
-        try:
-            current = to_visit.pop(0)
-        except IndexError:
-            current = None
-    return all_events
+            tree = PhyloTree(tree, format=newick_format, sp_naming_function=sp_naming_function)
+    return list(SpeciesOverlap(tree).iter_events_from_root(sos_thr=sos_thr))
+
+def _evol_events_worker(settings, trees):
+    chunk_events = []
+    for tree in trees:
+        events = _get_tree_events(settings, tree)
+        for event in events:
+            event.node = None
+        chunk_events.append(events)
+    return chunk_events
@@ -0,0 +1,502 @@
+"""Performance benchmarks for the ETE core operations.
+
+These are not unit tests and they are not run as part of the test suite. They
+are intended to compare optimized code paths against their previous
+implementations on large inputs. Usage:
+
+  python -m ete3.test.benchmarks [benchmark_name ...]
+
+Run with no arguments to execute all available benchmarks.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import sys
+import time
+
+from .. import Tree
+
+
+def _best_time(fn, repeat=3):
+    """ Returns the best elapsed time (in seconds) of running fn() several
+    times, and the value returned by the last call. """
+    best = None
+    result = None
+    for _ in range(repeat):
+        t1 = time.time()
+        result = fn()
+        elapsed = time.time() - t1
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+def _random_tree(size):
+    t = Tree()
+    t.populate(size, random_branches=True)
+    return t
+
+def bench_newick_parser(sizes=(10000, 100000), repeat=3):
+    """ Newick parsing throughput (MB/s) of the single pass tokenizer
+    compared to the legacy split based parser. """
+    from ..parser import newick
+    from . import legacy_newick
+
+    print("# Newick parser throughput")
+    print("\t".join(["leaves", "format", "MB", "legacy MB/s", "current MB/s", "speedup"]))
+    for size in sizes:
+        t = _random_tree(size)
+        for formatcode in [0, 1, 9]:
+            nw = t.write(format=formatcode)
+            mb = len(nw) / float(1024 ** 2)
+            matcher = newick.compile_matchers(formatcode=formatcode)
+
+            legacy, _ = _best_time(lambda: legacy_newick.read_newick_from_string(
+                nw, Tree(), matcher, formatcode, False), repeat)
+            current, _ = _best_time(lambda: newick._read_newick_from_string(
+                nw, Tree(), matcher, formatcode, False), repeat)
+            print("%d\t%d\t%0.2f\t%0.2f\t%0.2f\t%0.2fx" %(
+                size, formatcode, mb, mb / legacy, mb / current, legacy / current))
+
+def bench_node_memory(size=1000000):
+    """ Memory used by a populated tree, before and after adding a custom
+    feature to all its leaves. """
+    import tracemalloc
+
+    print("# Tree memory usage")
+    tracemalloc.start()
+    t1 = time.time()
+    t = _random_tree(size)
+    elapsed = time.time() - t1
+    nnodes = size * 2 - 1
+    used = tracemalloc.get_traced_memory()[0]
+    print("populated tree with %d leaves: %0.1f MB (%d bytes/node) in %0.2f secs" %(
+        size, used / float(1024 ** 2), used / nnodes, elapsed))
+
+    for leaf in t.iter_leaves():
+        leaf.add_feature("color", "red")
+    used = tracemalloc.get_traced_memory()[0]
+    print("after adding one feature to every leaf: %0.1f MB (%d bytes/node)" %(
+        used / float(1024 ** 2), used / nnodes))
+    tracemalloc.stop()
+
+def bench_robinson_foulds(sizes=(1000, 10000, 50000), repeat=3):
+    """ Robinson-Foulds distance between two random trees sharing the same
+    leaves, in rooted and unrooted mode. The bitset split engine is timed
+    separately, as robinson_foulds() also returns all the splits as tuples
+    of leaf names, which needs quadratic memory for unrooted trees (so it is
+    only timed for small unrooted trees). """
+    from ..coretype.splits import TreeSplits, get_leaf_index
+
+    def split_rf(t1, t2, unrooted):
+        leaf_index = get_leaf_index(t1.get_leaf_names())
+        splits1 = TreeSplits(t1, leaf_index, unrooted=unrooted)
+        splits2 = TreeSplits(t2, leaf_index, unrooted=unrooted)
+        return len(splits1.keys ^ splits2.keys)
+
+    print("# Robinson-Foulds distance")
+    print("\t".join(["leaves", "unrooted", "splits secs", "robinson_foulds secs", "rf"]))
+    for size in sizes:
+        t1 = _random_tree(size)
+        t2 = Tree()
+        t2.populate(size, names_library=t1.get_leaf_names())
+        for unrooted in [False, True]:
+            engine, rf = _best_time(lambda: split_rf(t1, t2, unrooted), repeat)
+            if unrooted and size > 5000:
+                full = "NA"
+            else:
+                full, _ = _best_time(lambda: t1.robinson_foulds(
+                    t2, unrooted_trees=unrooted), repeat)
+                full = "%0.3f" % full
+            print("%d\t%s\t%0.3f\t%s\t%d" %(size, unrooted, engine, full, rf))
+
+def bench_rf_matrix(ntrees=2000, size=100, n_jobs=(1, 4)):
+    """ All-against-all RF distance matrix of a set of random trees sharing
+    the same leaves (similar to a set of bootstrap trees). """
+    from ..coretype.tree import rf_matrix
+
+    print("# RF matrix")
+    names = _random_tree(size).get_leaf_names()
+    trees = []
+    for _ in range(ntrees):
+        t = Tree()
+        t.populate(size, names_library=names)
+        trees.append(t.write())
+
+    print("\t".join(["trees", "leaves", "processes", "secs"]))
+    for jobs in n_jobs:
+        elapsed, _ = _best_time(lambda: rf_matrix(trees, n_jobs=jobs), 1)
+        print("%d\t%d\t%d\t%0.2f" %(ntrees, size, jobs, elapsed))
+
+def bench_lca_index(size=10000, nqueries=100000):
+    """ Pairwise leaf distances using TreeNode.get_distance compared to an
+    LCA index, and time to compute the full leaf distance matrix. """
+    import random
+
+    print("# LCA index")
+    t = _random_tree(size)
+    leaves = t.get_leaves()
+    pairs = [(random.choice(leaves), random.choice(leaves)) for _ in range(nqueries)]
+
+    legacy, _ = _best_time(lambda: [t.get_distance(a, b) for a, b in pairs[:nqueries // 100]], 1)
+    legacy *= 100
+    build, index = _best_time(t.build_lca_index, 1)
+    current, _ = _best_time(lambda: [index.get_distance(a, b) for a, b in pairs], 1)
+    print("%d distances among %d leaves: get_distance %0.2f secs (estimated),"
+          " index build %0.2f secs + queries %0.2f secs" %(nqueries, size, legacy, build, current))
+
+    elapsed, matrix = _best_time(index.leaf_distance_matrix, 1)
+    print("leaf distance matrix %s: %0.2f secs" %(matrix.shape, elapsed))
+
+def bench_cached_content(size=100000):
+    """ get_cached_content(container_type=frozenset) on a fresh tree, on an
+    unmodified tree and after adding a single leaf, compared to the non
+    persistent version. """
+    print("# Cached content")
+    t = _random_tree(size)
+    nocache, _ = _best_time(lambda: t.get_cached_content(container_type=list), 1)
+    persistent = lambda: t.get_cached_content(container_type=frozenset)
+    first, _ = _best_time(persistent, 1)
+    cached, _ = _best_time(persistent, 1)
+    t.get_leaves()[0].add_child(name="new")
+    modified, _ = _best_time(persistent, 1)
+    ranges, _ = _best_time(t.get_cached_leaf_ranges, 1)
+    print("%d leaves: non persistent %0.2f secs, first call %0.2f secs, cached %0.2f secs,"
+          " after adding a leaf %0.2f secs, leaf ranges %0.2f secs" %(
+              size, nocache, first, cached, modified, ranges))
+
+def bench_copy(sizes=(10000, 100000), repeat=3):
+    """ Tree copy using the "fast" structural clone compared to cPickle
+    serialisation. """
+    print("# Tree copy")
+    print("\t".join(["leaves", "cpickle secs", "fast secs", "speedup"]))
+    for size in sizes:
+        t = _random_tree(size)
+        for leaf in t.iter_leaves():
+            leaf.add_feature("color", "red")
+        pickled, _ = _best_time(lambda: t.copy("cpickle"), repeat)
+        fast, _ = _best_time(lambda: t.copy("fast"), repeat)
+        print("%d\t%0.3f\t%0.3f\t%0.2fx" %(size, pickled, fast, pickled / fast))
+
+def bench_deep_trees(depth=10000, ascii_depth=2000):
+    """ Stress test of recursion-free algorithms on caterpillar trees, much
+    deeper than the default recursion limit. """
+    from .. import PhyloTree
+    from ..phylo.phylotree import _get_subtrees_recursive
+
+    def caterpillar(depth):
+        t = PhyloTree()
+        node = t
+        for i in range(depth):
+            node.add_features(evoltype="D")
+            node.add_child(name="l%d" %i)
+            node = node.add_child(name="n%d" %i)
+        return t
+
+    print("# Deep trees")
+    t = caterpillar(depth)
+    elapsed, _ = _best_time(lambda: t.get_cached_content(store_attr="name"), 1)
+    print("depth %d: get_cached_content(store_attr='name') %0.2f secs" %(depth, elapsed))
+    elapsed, _ = _best_time(lambda: _get_subtrees_recursive(t.copy("fast")), 1)
+    print("depth %d: species trees %0.2f secs" %(depth, elapsed))
+    elapsed, _ = _best_time(lambda: t.split_by_dups(autodetect_duplications=False), 1)
+    print("depth %d: split_by_dups %0.2f secs" %(depth, elapsed))
+    t = caterpillar(ascii_depth)
+    elapsed, _ = _best_time(t.get_ascii, 1)
+    print("depth %d: get_ascii %0.2f secs" %(ascii_depth, elapsed))
+
+def bench_ncbi_lookups(dbfile=None, sizes=(10000, 100000, 1000000)):
+    """ Multi taxid NCBITaxa lookups using bound parameters in fixed size
+    chunks, compared to a single query with all taxids formatted into the
+    SQL string (the previous implementation). Uses the default taxonomy
+    database, or the one in the ETE_TAXADB environment variable. """
+    import os
+    import random
+    from ..ncbi_taxonomy.ncbiquery import NCBITaxa, DEFAULT_TAXADB
+
+    print("# NCBI taxonomy lookups")
+    dbfile = dbfile or os.environ.get("ETE_TAXADB", DEFAULT_TAXADB)
+    if not os.path.exists(dbfile):
+        print("taxonomy database not found: %s" %dbfile)
+        return
+
+    class LegacyNCBITaxa(NCBITaxa):
+        def _query_in(self, cmd, values):
+            query = ','.join(['"%s"' %v for v in values])
+            return self.db.execute(cmd %query).fetchall()
+
+    ncbi = NCBITaxa(dbfile)
+    legacy_ncbi = LegacyNCBITaxa(dbfile)
+    all_taxids = [taxid for (taxid,) in ncbi.db.execute("SELECT taxid FROM species")]
+
+    print("\t".join(["taxids", "method", "legacy secs", "chunked secs"]))
+    for size in sizes:
+        taxids = random.sample(all_taxids, min(size, len(all_taxids)))
+        for name in ["get_rank", "get_taxid_translator", "get_lineage_translator"]:
+            try:
+                legacy, _ = _best_time(lambda: getattr(legacy_ncbi, name)(taxids), 1)
+                legacy = "%0.2f" %legacy
+            except Exception as e:
+                legacy = "error (%s)" %e
+            current, _ = _best_time(lambda: getattr(ncbi, name)(taxids), 1)
+            print("%d\t%s\t%s\t%0.2f" %(len(taxids), name, legacy, current))
+
+def bench_ncbi_fuzzy(dbfile=None, nqueries=1000):
+    """ Fuzzy species name search using the trigram name index, for names
+    with one random typo. Uses the default taxonomy database, or the one
+    in the ETE_TAXADB environment variable. """
+    import os
+    import random
+    from ..ncbi_taxonomy.ncbiquery import NCBITaxa, DEFAULT_TAXADB
+
+    print("# NCBI fuzzy name search")
+    dbfile = dbfile or os.environ.get("ETE_TAXADB", DEFAULT_TAXADB)
+    if not os.path.exists(dbfile):
+        print("taxonomy database not found: %s" %dbfile)
+        return
+
+    ncbi = NCBITaxa(dbfile)
+    elapsed, _ = _best_time(lambda: ncbi.get_fuzzy_name_matches("Homo sapiens"), 1)
+    print("first query (checks the name index): %0.2f secs" %elapsed)
+    names = [name for (name,) in ncbi.db.execute("SELECT spname FROM species")]
+    queries = []
+    for name in random.sample(names, min(nqueries, len(names))):
+        pos = random.randrange(len(name))
+        queries.append(name[:pos] + "x" + name[pos+1:])
+
+    single, _ = _best_time(lambda: [ncbi.get_fuzzy_name_matches(q) for q in queries], 1)
+    batch, found = _best_time(lambda: ncbi.get_fuzzy_name_translator(queries), 1)
+    print("%d names: %0.2f ms/name, batch %0.2f ms/name, %d names matched" %(
+        len(queries), single * 1000 / len(queries), batch * 1000 / len(queries), len(found)))
+
+def bench_ncbi_annotate(dbfile=None, sizes=(10000, 200000), nspecies=2000):
+    """ NCBITaxa.annotate_tree() on random gene trees and on caterpillar
+    trees, with leaves named after species taxids. Uses the default
+    taxonomy database, or the one in the ETE_TAXADB environment variable. """
+    import os
+    import random
+    from ..ncbi_taxonomy.ncbiquery import NCBITaxa, DEFAULT_TAXADB
+
+    print("# NCBI tree annotation")
+    dbfile = dbfile or os.environ.get("ETE_TAXADB", DEFAULT_TAXADB)
+    if not os.path.exists(dbfile):
+        print("taxonomy database not found: %s" %dbfile)
+        return
+
+    ncbi = NCBITaxa(dbfile)
+    species = [str(taxid) for (taxid,) in ncbi.db.execute(
+        "SELECT taxid FROM species WHERE rank = 'species' LIMIT ?", (nspecies,))]
+    print("\t".join(["leaves", "shape", "secs"]))
+    for size in sizes:
+        t = _random_tree(size)
+        caterpillar = Tree()
+        node = caterpillar
+        for _ in range(size - 1):
+            node.add_child()
+            node = node.add_child()
+        for shape, tree in [("random", t), ("caterpillar", caterpillar)]:
+            for leaf in tree.iter_leaves():
+                leaf.name = random.choice(species)
+            elapsed, _ = _best_time(lambda: ncbi.annotate_tree(tree), 1)
+            print("%d\t%s\t%0.2f" %(size, shape, elapsed))
+
+def bench_ncbi_topology(dbfile=None, sizes=(1000, 10000, 50000)):
+    """ NCBITaxa.get_topology() and get_topology_parents() for random sets
+    of species taxids. Uses the default taxonomy database, or the one in
+    the ETE_TAXADB environment variable. """
+    import os
+    import random
+    from ..ncbi_taxonomy.ncbiquery import NCBITaxa, DEFAULT_TAXADB
+
+    print("# NCBI topologies")
+    dbfile = dbfile or os.environ.get("ETE_TAXADB", DEFAULT_TAXADB)
+    if not os.path.exists(dbfile):
+        print("taxonomy database not found: %s" %dbfile)
+        return
+
+    ncbi = NCBITaxa(dbfile)
+    species = [taxid for (taxid,) in ncbi.db.execute(
+        "SELECT taxid FROM species WHERE rank = 'species'")]
+    print("\t".join(["taxids", "tree_secs", "parents_secs"]))
+    for size in sizes:
+        taxids = random.sample(species, min(size, len(species)))
+        tree_time, _ = _best_time(lambda: ncbi.get_topology(taxids, annotate=False), 1)
+        parents_time, _ = _best_time(lambda: ncbi.get_topology_parents(taxids), 1)
+        print("%d\t%0.2f\t%0.2f" %(len(taxids), tree_time, parents_time))
+
+def bench_broken_branches(sizes=(1000, 10000, 100000), ntaxa=5000):
+    """ Non monophyletic taxa search (as in NCBITaxa.get_broken_branches())
+    on random trees whose leaves are assigned to the taxa of a random
+    taxonomy (no database needed). """
+    import random
+    from ..ncbi_taxonomy.ncbiquery import _find_broken_clades
+
+    print("# Broken taxonomic clades")
+    parents = [None] + [random.randint(0, i - 1) for i in range(1, ntaxa)]
+    lineages = {}
+    for taxid in range(ntaxa):
+        lineage = []
+        current = taxid
+        while current is not None:
+            lineage.append(current)
+            current = parents[current]
+        lineages[taxid] = lineage[::-1]
+
+    print("\t".join(["leaves", "broken", "secs"]))
+    for size in sizes:
+        t = _random_tree(size)
+        leaf2lineage = dict((leaf, lineages[random.randint(0, ntaxa - 1)])
+                            for leaf in t.iter_leaves())
+        elapsed, (broken_branches, _) = _best_time(lambda: _find_broken_clades(t, leaf2lineage), 1)
+        nbroken = sum(len(taxa) for taxa in broken_branches.values())
+        print("%d\t%d\t%0.2f" %(size, nbroken, elapsed))
+
+def bench_prune(sizes=((10000, 2000), (100000, 20000))):
+    """ TreeNode.prune() and get_pruned_copy() keeping a random sample of
+    the leaves of random trees. """
+    import random
+
+    print("# Tree pruning")
+    print("\t".join(["leaves", "kept", "prune_secs", "pruned_copy_secs"]))
+    for size, nkept in sizes:
+        t = _random_tree(size)
+        to_keep = random.sample(t.get_leaf_names(), nkept)
+        copy_time, _ = _best_time(lambda: t.get_pruned_copy(to_keep, preserve_branch_length=True), 1)
+        t2 = t.copy("fast")
+        prune_time, _ = _best_time(lambda: t2.prune(to_keep, preserve_branch_length=True), 1)
+        print("%d\t%d\t%0.2f\t%0.2f" %(size, nkept, prune_time, copy_time))
+
+def bench_topology_hash(ntrees=2000, size=100, ntopologies=50):
+    """ Unique topology counting over a collection of random trees, using
+    get_topology_id() and TopologyCounter. """
+    import random
+    from .. import TopologyCounter
+
+    print("# Topology counting")
+    names = ["sp%d" %i for i in range(size)]
+    topologies = []
+    for _ in range(ntopologies):
+        t = Tree()
+        t.populate(size, names_library=list(names))
+        topologies.append(t)
+    trees = [random.choice(topologies).copy("fast") for _ in range(ntrees)]
+    for t in trees:
+        for node in t.traverse():
+            random.shuffle(node.children)
+
+    print("\t".join(["trees", "leaves", "method", "unique", "trees/s"]))
+    elapsed, unique = _best_time(lambda: len(set(t.get_topology_id() for t in trees[:ntrees // 10])), 1)
+    print("%d\t%d\t%s\t%d\t%0.1f" %(ntrees // 10, size, "topology_id", unique, (ntrees // 10) / elapsed))
+    for unrooted in [False, True]:
+        def count():
+            counter = TopologyCounter(unrooted=unrooted)
+            counter.update(trees)
+            return len(counter)
+        elapsed, unique = _best_time(count, 1)
+        method = "counter_unrooted" if unrooted else "counter_rooted"
+        print("%d\t%d\t%s\t%d\t%0.1f" %(ntrees, size, method, unique, ntrees / elapsed))
+
+def bench_consensus(ntrees=2000, size=100, n_jobs=(1, 4)):
+    """ Split counting and majority-rule consensus of a collection of
+    random newick trees, using one or several processes. """
+    from .. import SplitCounter
+
+    print("# Consensus trees")
+    names = ["sp%d" %i for i in range(size)]
+    trees = []
+    for _ in range(ntrees):
+        t = Tree()
+        t.populate(size, names_library=list(names), random_branches=True)
+        trees.append(t.write())
+
+    print("\t".join(["trees", "leaves", "processes", "splits", "trees/s", "consensus_secs"]))
+    for jobs in n_jobs:
+        counter = SplitCounter()
+        start = time.time()
+        counter.update(trees, n_jobs=jobs, chunksize=100)
+        elapsed = time.time() - start
+        consensus_time, _ = _best_time(lambda: counter.get_consensus("extended"), 1)
+        print("%d\t%d\t%d\t%d\t%0.1f\t%0.2f" %(ntrees, size, jobs, len(counter),
+                                                ntrees / elapsed, consensus_time))
+
+def bench_split_support(ntrees=200, size=200):
+    """ Support mapping of random replicate trees onto a reference tree,
+    calling robinson_foulds() per replicate or using map_split_support().
+    """
+    print("# Split support mapping")
+    names = ["sp%d" %i for i in range(size)]
+    ref = Tree()
+    ref.populate(size, names_library=list(names))
+    trees = []
+    for _ in range(ntrees):
+        t = Tree()
+        t.populate(size, names_library=list(names))
+        trees.append(t.write(format=9))
+
+    print("\t".join(["trees", "leaves", "method", "trees/s"]))
+    def rf_counts():
+        for nw in trees[:ntrees // 10]:
+            ref.robinson_foulds(Tree(nw), unrooted_trees=True)
+    elapsed, _ = _best_time(rf_counts, 1)
+    print("%d\t%d\t%s\t%0.1f" %(ntrees // 10, size, "robinson_foulds", (ntrees // 10) / elapsed))
+    for method in ["frequency", "transfer"]:
+        elapsed, _ = _best_time(lambda: ref.map_split_support(trees, method=method, unrooted=True), 1)
+        print("%d\t%d\t%s\t%0.1f" %(ntrees, size, method, ntrees / elapsed))
+
+def bench_species_overlap(sizes=(1000, 10000), ntrees=1000, nspecies=50, n_jobs=(1, 4)):
+    """ Species overlap detection of duplications on large gene trees
+    (all events and events of a seed leaf), and batch runs over a
+    collection of smaller gene trees. """
+    import random
+    from .. import PhyloTree
+    from ..phylo.spoverlap import iter_evol_events
+
+    def random_gene_tree(size):
+        names = ["S%03d_%d" %(random.randrange(nspecies), i) for i in range(size)]
+        t = PhyloTree()
+        t.populate(size, names_library=names, random_branches=True)
+        return t
+
+    print("# Species overlap")
+    print("\t".join(["leaves", "descendant_events_secs", "seed_events_secs"]))
+    for size in sizes:
+        t = random_gene_tree(size)
+        seed = next(t.iter_leaves())
+        all_time, _ = _best_time(lambda: t.get_descendant_evol_events(), 1)
+        seed_time, _ = _best_time(lambda: seed.get_my_evol_events(), 1)
+        print("%d\t%0.2f\t%0.2f" %(size, all_time, seed_time))
+
+    trees = [random_gene_tree(random.randint(10, 200)).write() for _ in range(ntrees)]
+    print("\t".join(["trees", "processes", "trees/s"]))
+    for jobs in n_jobs:
+        elapsed, _ = _best_time(lambda: sum(1 for _ in iter_evol_events(trees, n_jobs=jobs)), 1)
+        print("%d\t%d\t%0.1f" %(ntrees, jobs, ntrees / elapsed))
+
+BENCHMARKS = [
+    ("newick", bench_newick_parser),
+    ("memory", bench_node_memory),
+    ("rf", bench_robinson_foulds),
+    ("rfmatrix", bench_rf_matrix),
+    ("lca", bench_lca_index),
+    ("content", bench_cached_content),
+    ("copy", bench_copy),
+    ("deep", bench_deep_trees),
+    ("ncbi", bench_ncbi_lookups),
+    ("fuzzy", bench_ncbi_fuzzy),
+    ("annotate", bench_ncbi_annotate),
+    ("topology", bench_ncbi_topology),
+    ("broken", bench_broken_branches),
+    ("prune", bench_prune),
+    ("topologies", bench_topology_hash),
+    ("consensus", bench_consensus),
+    ("support", bench_split_support),
+    ("spoverlap", bench_species_overlap),
+]
+
+def run(names=None):
+    for name, bench in BENCHMARKS:
+        if not names or name in names:
+            bench()
+            print()
+
+if __name__ == '__main__':
+    run(sys.argv[1:])
@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 import os
+import sqlite3
 import unittest
 
 from .. import PhyloTree, NCBITaxa
@@ -67,6 +68,61 @@ class Test_ncbiquery(unittest.TestCase):
     #Out[11]: [9606, 1425170]
     self.assertEqual(set(out), set([9606, 1425170]))
     
+  def test_traverse_index(self):
+    import tempfile
+    # (1,(2,(3,4)5)6)7 in pre and postorder
+    prepostorder = [7, 1, 6, 2, 5, 3, 4, 5, 6, 7]
+    index_file = tempfile.NamedTemporaryFile(suffix=".bin", delete=False).name
+    try:
+      ncbiquery.build_traverse_index(prepostorder, index_file)
+      index = ncbiquery._TraverseIndex(index_file)
+      self.assertEqual(index.get_range(7), (0, 9))
+      self.assertEqual(index.get_range(5), (4, 7))
+      self.assertEqual(index.get_range(3), (5, 5))
+      self.assertEqual(index.get_range(8), None)
+      self.assertEqual(index.get_range(0), None)
+      self.assertEqual(list(index.get_traverse(2, 8)), [6, 2, 5, 3, 4, 5, 6])
+      # rebuilt indexes replace the file, so open mappings are not modified
+      ncbiquery.build_traverse_index([1, 1], index_file)
+      self.assertEqual(index.get_range(7), (0, 9))
+      self.assertEqual(ncbiquery._TraverseIndex(index_file).get_range(7), None)
+      self.assertEqual([f for f in os.listdir(os.path.dirname(index_file))
+                        if f.startswith(os.path.basename(index_file) + ".")], [])
+      index.close()
+    finally:
+      os.remove(index_file)
+
+    # indexes built in memory
+    index = ncbiquery._TraverseIndex(None, prepostorder)
+    self.assertEqual(index.get_range(5), (4, 7))
+    self.assertEqual(list(index.get_traverse(2, 8)), [6, 2, 5, 3, 4, 5, 6])
+    index.close()
+
+  def test_preload(self):
+    ncbi = NCBITaxa(dbfile=DATABASE_PATH)
+    preloaded = NCBITaxa(dbfile=DATABASE_PATH, preload=True)
+    taxids = [9606, 7507, 9604, 10090, 207598, 1, 42099]
+
+    self.assertEqual(preloaded.get_rank(taxids), ncbi.get_rank(taxids))
+    self.assertEqual(preloaded.get_taxid_translator(taxids), ncbi.get_taxid_translator(taxids))
+    self.assertEqual(preloaded.get_lineage_translator(taxids), ncbi.get_lineage_translator(taxids))
+    self.assertEqual(preloaded.get_common_names(taxids), ncbi.get_common_names(taxids))
+    self.assertEqual(preloaded.get_lineage(9606), ncbi.get_lineage(9606))
+    self.assertEqual(preloaded.get_lineage("42099"), ncbi.get_lineage("42099"))
+    self.assertRaises(ValueError, preloaded.get_lineage, 999999999)
+
+    self.assertEqual(preloaded.get_common_ancestor([9606, 9598]), 207598)
+    self.assertEqual(ncbi.get_common_ancestor([9606, 9598]), 207598)
+    self.assertEqual(preloaded.get_common_ancestor([9606, 10090, 9604]), 314146)
+    self.assertEqual(preloaded.get_common_ancestor([9606]), 9606)
+
+    t1 = PhyloTree("((9598, 9606), 10090);")
+    t2 = PhyloTree("((9598, 9606), 10090);")
+    ncbi.annotate_tree(t1)
+    preloaded.annotate_tree(t2)
+    for n1, n2 in zip(t1.traverse(), t2.traverse()):
+      self.assertEqual((n1.sci_name, n1.rank, n1.lineage), (n2.sci_name, n2.rank, n2.lineage))
+
   def test_get_topology(self):
     ncbi = NCBITaxa(dbfile=DATABASE_PATH)
     t1 = ncbi.get_topology([9606, 7507, 9604])
@@ -96,6 +152,232 @@ class Test_ncbiquery(unittest.TestCase):
       self.assertEqual(diffs3["rf"], 0.0)
 
 
+class Test_taxdump(unittest.TestCase):
+  """ Tests run on a small database built from a taxdump file. """
+
+  @classmethod
+  def setUpClass(cls):
+    import io
+    import tarfile
+    import tempfile
+    dumps = {
+      "nodes.dmp": ["1\t|\t1\t|\tno rank\t|", "2\t|\t1\t|\tsuperkingdom\t|",
+                    "5\t|\t2\t|\tspecies\t|", "4\t|\t2\t|\tspecies\t|",
+                    "3\t|\t1\t|\tspecies\t|"],
+      "names.dmp": ["1\t|\troot\t|\t\t|\tscientific name\t|",
+                    "2\t|\tBacteria\t|\t\t|\tscientific name\t|",
+                    "2\t|\tbacteria\t|\t\t|\tgenbank common name\t|",
+                    "3\t|\tHomo sapiens\t|\t\t|\tscientific name\t|",
+                    "3\t|\thuman\t|\t\t|\tgenbank common name\t|",
+                    "4\t|\tE. coli\t|\t\t|\tscientific name\t|",
+                    "4\t|\tEscherichia coli\t|\t\t|\tsynonym\t|",
+                    "5\t|\tB. subtilis\t|\t\t|\tscientific name\t|"],
+      "merged.dmp": ["6\t|\t4\t|"],
+    }
+    cls.tmpdir = tempfile.mkdtemp()
+    cls.targz_file = os.path.join(cls.tmpdir, "taxdump.tar.gz")
+    with tarfile.open(cls.targz_file, "w:gz") as tar:
+      for fname, lines in dumps.items():
+        data = ("\n".join(lines) + "\n").encode()
+        info = tarfile.TarInfo(fname)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    cls.dbfile = os.path.join(cls.tmpdir, "taxa.sqlite")
+    ncbiquery.update_db(cls.dbfile, cls.targz_file)
+
+  @classmethod
+  def tearDownClass(cls):
+    import shutil
+    for read_only in [False, True]:
+      ncbiquery.get_connection_pool(cls.dbfile, read_only).reset()
+    shutil.rmtree(cls.tmpdir)
+
+  def test_taxdump_import(self):
+    ncbi = NCBITaxa(dbfile=self.dbfile)
+    self.assertEqual(ncbi.get_lineage(5), [1, 2, 5])
+    self.assertEqual(ncbi.get_lineage(6), [1, 2, 4])
+    self.assertEqual(ncbi.get_rank([1, 2, 3]), {1: "no rank", 2: "superkingdom", 3: "species"})
+    self.assertEqual(ncbi.get_common_names([2, 3, 4]), {2: "bacteria", 3: "human"})
+    self.assertEqual(ncbi.get_name_translator(["Escherichia coli"]), {"Escherichia coli": [4]})
+    self.assertEqual(ncbi.get_descendant_taxa(1, intermediate_nodes=True), [2, 5, 4, 3])
+    self.assertEqual(ncbi.get_descendant_taxa(2), [5, 4])
+
+  def test_outdated_traverse_index(self):
+    import array
+    import pickle
+    index_file = self.dbfile + ".traverse.bin"
+    # pickled traversal read by previous versions
+    with open(self.dbfile + ".traverse.pkl", "rb") as CACHED_TRAVERSE:
+      prepostorder = pickle.load(CACHED_TRAVERSE)
+    self.assertEqual(sorted(set(prepostorder)), [1, 2, 3, 4, 5])
+    try:
+      # missing index, index of another database and older index formats
+      for content in [None, [1, 1], array.array('i', [1, 2, 1, 1, 1, 1, -1, -1, 0, 0])]:
+        if content is None:
+          os.remove(index_file)
+        elif isinstance(content, list):
+          ncbiquery.build_traverse_index(content, index_file, 1)
+        else:
+          with open(index_file, "wb") as OUT:
+            content.tofile(OUT)
+        outdated = open(index_file, "rb").read() if content else None
+        # read only instances do not write the rebuilt index
+        ncbi = NCBITaxa(dbfile=self.dbfile, read_only=True)
+        self.assertEqual(ncbi.get_descendant_taxa(2), [5, 4])
+        if content:
+          self.assertEqual(open(index_file, "rb").read(), outdated)
+        else:
+          self.assertFalse(os.path.exists(index_file))
+        ncbi = NCBITaxa(dbfile=self.dbfile)
+        self.assertEqual(ncbi.get_descendant_taxa(2), [5, 4])
+        self.assertEqual(ncbiquery._TraverseIndex(index_file).nspecies, 5)
+    finally:
+      ncbiquery.build_traverse_index(prepostorder, index_file, 5)
+
+  def test_chunked_queries(self):
+    # multi taxid queries split in several chunks
+    ncbi = NCBITaxa(dbfile=self.dbfile)
+    chunk_size = ncbiquery.SQL_CHUNK_SIZE
+    ncbiquery.SQL_CHUNK_SIZE = 2
+    try:
+      self.assertEqual(ncbi.get_rank([1, "2", 3, 4, 5, 99]),
+                       {1: "no rank", 2: "superkingdom", 3: "species", 4: "species", 5: "species"})
+      self.assertEqual(ncbi.get_taxid_translator([3, 4, 5, 6]),
+                       {3: "Homo sapiens", 4: "E. coli", 5: "B. subtilis", 6: "E. coli"})
+      self.assertEqual(ncbi.get_name_translator(["homo sapiens", "E. coli", 'Escherichia "coli"']),
+                       {"homo sapiens": [3], "E. coli": [4]})
+    finally:
+      ncbiquery.SQL_CHUNK_SIZE = chunk_size
+
+  def test_lookup_caches(self):
+    ncbi = NCBITaxa(dbfile=self.dbfile, cache_size=2)
+    self.assertEqual(ncbi.get_lineage(5), [1, 2, 5])
+    ncbi.get_lineage(5).append(99)
+    self.assertEqual(ncbi.get_lineage_translator([5, 3]), {5: [1, 2, 5], 3: [1, 3]})
+    self.assertEqual(ncbi.cache_info()["lineage"], (2, 2, 2, 2))
+    self.assertEqual(ncbi.get_rank([1, 2, 3]), {1: "no rank", 2: "superkingdom", 3: "species"})
+    self.assertEqual(ncbi.get_rank([3]), {3: "species"})
+    self.assertEqual(ncbi.cache_info()["rank"], (1, 3, 2, 2))
+    self.assertEqual(ncbi.get_taxid_translator([4, 6]), {4: "E. coli", 6: "E. coli"})
+    self.assertEqual(ncbi.get_taxid_translator([4]), {4: "E. coli"})
+    self.assertEqual(ncbi.cache_info()["taxid2name"], (1, 2, 2, 1))
+    self.assertEqual(ncbi.get_name_translator(["Escherichia coli", "human"]), {"Escherichia coli": [4]})
+    self.assertEqual(ncbi.get_name_translator(["escherichia COLI"]), {"escherichia COLI": [4]})
+    self.assertEqual(ncbi.cache_info()["name2taxid"], (1, 2, 2, 1))
+    # updates clear the caches of all instances sharing the database
+    other = NCBITaxa(dbfile=self.dbfile, cache_size=2)
+    self.assertEqual(other.get_rank([3]), {3: "species"})
+    ncbi.update_taxonomy_database(self.targz_file)
+    self.assertEqual(ncbi.cache_info()["lineage"], (0, 0, 2, 0))
+    self.assertEqual(other.cache_info()["rank"], (0, 0, 2, 0))
+    self.assertEqual(other.get_rank([3]), {3: "species"})
+    self.assertEqual(other.cache_info()["rank"], (0, 1, 2, 1))
+    self.assertEqual(NCBITaxa(dbfile=self.dbfile, cache_size=0).get_lineage(5), [1, 2, 5])
+
+  def test_annotate_tree(self):
+    ncbi = NCBITaxa(dbfile=self.dbfile)
+    t = PhyloTree("(((5,4),6),(3,junk));")
+    ncbi.annotate_tree(t)
+    bacteria = t.children[0]
+    self.assertEqual((bacteria.taxid, bacteria.sci_name, bacteria.rank), (2, "Bacteria", "superkingdom"))
+    self.assertEqual((bacteria.lineage, bacteria.named_lineage), ([1, 2], ["root", "Bacteria"]))
+    self.assertEqual(bacteria.children[0].lineage, [1, 2])
+    self.assertEqual(((t&"6").taxid, (t&"6").sci_name, (t&"6").lineage), (6, "E. coli", [1, 2, 4]))
+    self.assertEqual(((t&"junk").lineage, (t&"junk").rank), ([], "Unknown"))
+    self.assertEqual((t.taxid, t.lineage, t.named_lineage), ("", [""], [""]))
+    t = PhyloTree("(((5,4),6),3);")
+    ncbi.annotate_tree(t)
+    self.assertEqual((t.taxid, t.sci_name, t.rank, t.lineage), (1, "root", "no rank", [1]))
+
+  def test_topology_parents(self):
+    ncbi = NCBITaxa(dbfile=self.dbfile)
+    t = ncbi.get_topology([5, 4, 3], annotate=False)
+    nodes, parents = ncbi.get_topology_parents([5, 4, 3])
+    self.assertEqual(nodes, [int(n.name) for n in t.traverse("preorder")])
+    self.assertEqual([nodes[p] if p >= 0 else None for p in parents],
+                     [int(n.up.name) if n.up else None for n in t.traverse("preorder")])
+    self.assertEqual((t.rank, (t&"2").rank, (t&"2").taxid), ("no rank", "superkingdom", 2))
+    nodes, parents = ncbi.get_topology_parents([5, 4])
+    self.assertEqual((nodes[0], sorted(nodes[1:]), parents), (2, [4, 5], [-1, 0, 0]))
+    self.assertEqual(ncbi.get_topology_parents([2]), ([2, 5, 4], [-1, 0, 0]))
+    self.assertEqual(ncbi.get_topology([2], collapse_subspecies=True).write(format=9), "(5,4);")
+    self.assertEqual(sorted(ncbi.get_descendant_taxa(1, rank_limit="superkingdom")), [2, 3])
+    self.assertEqual(sorted(ncbi.get_descendant_taxa(1, collapse_subspecies=True)), [3, 4, 5])
+
+  def test_broken_clades(self):
+    # taxonomic congruence
+    ncbi = NCBITaxa(dbfile=self.dbfile)
+    t = PhyloTree("(((5,3),junk),4);")
+    ncbi.annotate_tree(t)
+    lineages = dict((leaf.taxid, leaf.lineage) for leaf in t if leaf.lineage)
+    broken_branches, broken_clades, broken_clade_sizes = ncbi.get_broken_branches(t, lineages)
+    self.assertEqual((dict(broken_branches), broken_clades, broken_clade_sizes), ({t: set([2])}, set([2]), [2]))
+    trees = ["(((5,3),junk),4);", "((5,4),3);", "((5,junk),6);", PhyloTree("(5,(4,3));")]
+    expected = [(5, set([2]), [2]), (5, set(), []), (4, set(), []), (5, set([2]), [2])]
+    self.assertEqual(list(ncbi.iter_broken_clades(trees)), expected)
+    self.assertEqual(list(ncbi.iter_broken_clades(iter(trees), n_jobs=2, chunksize=1)), expected)
+
+  def test_fuzzy_search(self):
+    ncbi = NCBITaxa(dbfile=self.dbfile)
+    self.assertEqual(ncbi.get_fuzzy_name_matches("homo sapiens"), [(3, "Homo sapiens", 1.0)])
+    self.assertEqual(ncbi.get_fuzzy_name_matches("Homo sapeins", sim=0.8), [(3, "Homo sapiens", 1 - 2 / 12.0)])
+    self.assertEqual(ncbi.get_fuzzy_name_matches("Hmo sapeins"), [])
+    self.assertEqual(ncbi.get_fuzzy_name_matches("E. colli", sim=0.5, limit=5), [(4, "E. coli", 1 - 1 / 8.0)])
+    self.assertEqual(ncbi.get_fuzzy_name_translator(["Escherichia colli", "Bacterya", "xyz"]),
+                     {"Escherichia colli": [(4, "Escherichia coli", 1 - 1 / 17.0)],
+                      "Bacterya": [(2, "Bacteria", 1 - 1 / 8.0)]})
+    self.assertEqual(ncbi.get_fuzzy_name_translation("Bacterya"), (2, "Bacteria", 1 - 1 / 8.0))
+    # databases built by previous versions have no index, which is not
+    # built by read methods
+    import warnings
+    ncbi.db.execute("DROP TABLE name_trigram")
+    try:
+      ncbi = NCBITaxa(dbfile=self.dbfile)
+      with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        self.assertEqual(ncbi.get_fuzzy_name_matches("Bacterya"), [(2, "Bacteria", 1 - 1 / 8.0)])
+        self.assertEqual(ncbi.get_fuzzy_name_translator(["Escherichia colli", "Homo sapeins", "xyz"], sim=0.8),
+                         {"Escherichia colli": [(4, "Escherichia coli", 1 - 1 / 17.0)],
+                          "Homo sapeins": [(3, "Homo sapiens", 1 - 2 / 12.0)]})
+      self.assertEqual(len(caught), 2)
+      self.assertFalse(ncbi._check_fuzzy_index())
+    finally:
+      ncbiquery.build_fuzzy_index(self.dbfile)
+    ncbi = NCBITaxa(dbfile=self.dbfile)
+    self.assertEqual(ncbi.get_fuzzy_name_matches("Bacterya"), [(2, "Bacteria", 1 - 1 / 8.0)])
+
+  def test_connection_pool(self):
+    # connections are thread local and shared by all instances
+    from multiprocessing.pool import ThreadPool
+    for read_only in [False, True]:
+      ncbi = NCBITaxa(dbfile=self.dbfile, read_only=read_only)
+      self.assertTrue(ncbi.db is NCBITaxa(dbfile=self.dbfile, read_only=read_only).db)
+      threads = ThreadPool(4)
+      lineages = threads.map(ncbi.get_lineage_translator, [[3, 4, 5]] * 20)
+      connections = set(threads.map(lambda _: id(ncbi.db), range(20)))
+      threads.close()
+      self.assertEqual(lineages, [{3: [1, 3], 4: [1, 2, 4], 5: [1, 2, 5]}] * 20)
+      self.assertTrue(1 <= len(connections) <= 4)
+
+    # reset() does not close connections in use by other threads
+    import threading
+    pool = ncbiquery.get_connection_pool(self.dbfile)
+    connections = []
+    thread = threading.Thread(target=lambda: connections.append(pool.get()))
+    thread.start()
+    thread.join()
+    db = pool.get()
+    generation = pool.generation
+    pool.reset()
+    self.assertEqual(pool.generation, generation + 1)
+    self.assertEqual(connections[0].execute("SELECT COUNT(*) FROM species").fetchone(), (5,))
+    self.assertEqual(db.execute("SELECT COUNT(*) FROM species").fetchone(), (5,))
+    # stale connections are closed by their own thread
+    self.assertTrue(pool.get() is not db)
+    self.assertRaises(sqlite3.ProgrammingError, db.execute, "SELECT 1")
+    self.assertTrue(pool.get() is pool.get())
+
+
 if __name__ == '__main__':
   unittest.main()
 
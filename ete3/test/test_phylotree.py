@@ -3,6 +3,7 @@ from __future__ import print_function
 import unittest
 
 from .. import PhyloTree, SeqGroup
+from ..phylo.spoverlap import SpeciesOverlap, iter_evol_events
 from .datasets import *
 
 class Test_phylo_module(unittest.TestCase):
@@ -256,6 +257,55 @@ class Test_phylo_module(unittest.TestCase):
         # Are all orthologies as expected
         self.assertEqual(expected_orthologs, orthologs)
 
+    def test_sp_overlap_engine(self):
+        """ Tests lazy event creation and batch species overlap runs"""
+        nw = '((Dme_001,Dme_002),(((Cfa_001,Mms_001),((((Hsa_001,Hsa_003),Ptr_001),Mmu_001),((Hsa_004,Ptr_004),Mmu_004))),(Ptr_002,(Hsa_002,Mmu_002))));'
+        t = PhyloTree(nw)
+        overlap = SpeciesOverlap(t)
+        dup = t.get_common_ancestor("Hsa_001", "Hsa_004")
+        self.assertEqual(overlap.get_species(dup), set(["Hsa", "Ptr", "Mmu"]))
+        self.assertEqual(overlap.get_overlap(dup), 1.0)
+        self.assertEqual(overlap.get_overlap(t), 0.0)
+
+        # nodes are labeled before any event is created
+        events = overlap.iter_events_from_root()
+        self.assertEqual(dup.evoltype, "D")
+        self.assertEqual(t.evoltype, "S")
+        events = list(events)
+        self.assertEqual(len(events), 13)
+        self.assertEqual([e.etype for e in events].count("D"), 4)
+
+        trees = [nw, '((Hsa_001,Ptr_001),(Hsa_002,Mmu_002));', '((Hsa_001,Ptr_001),(Hsa_002,(Ptr_002,Mmu_002)));']
+        for n_jobs in [1, 2]:
+            results = list(iter_evol_events(trees, n_jobs=n_jobs, chunksize=2))
+            self.assertEqual(len(results), 3)
+            for nw2, events in zip(trees, results):
+                expected = PhyloTree(nw2).get_descendant_evol_events()
+                self.assertEqual([(e.etype, e.in_seqs, e.out_seqs) for e in events],
+                                 [(e.etype, e.in_seqs, e.out_seqs) for e in expected])
+            self.assertEqual([e.etype for e in results[1]], ["D", "S", "S"])
+
+        self.assertRaises(TypeError, SpeciesOverlap(PhyloTree("(A,B,C);")).iter_events_from_root)
+
+    def test_split_copies_are_independent(self):
+        """ Subtrees returned by split_by_dups and species tree copies do not
+        share mutable features with the source tree"""
+        from ..phylo.phylotree import _get_subtrees_recursive
+        t = PhyloTree('((Hsa_001,Ptr_001),(Hsa_002,(Ptr_002,Mmu_002)));')
+        for leaf in t:
+            leaf.add_features(lineage=[1, 2], named_lineage=["root", leaf.species])
+
+        for subtree in t.split_by_dups():
+            for leaf in subtree:
+                leaf.lineage.append(3)
+                leaf.named_lineage[0] = "changed"
+        for subtree in _get_subtrees_recursive(t.copy("fast")):
+            for leaf in subtree:
+                leaf.lineage.append(4)
+        for leaf in t:
+            self.assertEqual(leaf.lineage, [1, 2])
+            self.assertEqual(leaf.named_lineage, ["root", leaf.species])
+
     def test_reconciliation(self):
         """ Tests ortholgy prediction based on the species reconciliation method"""
         gene_tree_nw = '((Dme_001,Dme_002),(((Cfa_001,Mms_001),((Hsa_001,Ptr_001),Mmu_001)),(Ptr_002,(Hsa_002,Mmu_002))));'
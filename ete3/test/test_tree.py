@@ -7,8 +7,8 @@ import itertools
 import sys
 from six.moves import range
 
-from .. import Tree, PhyloTree, TreeNode
-from ..coretype.tree import TreeError
+from .. import Tree, PhyloTree, TreeNode, TopologyCounter, SplitCounter, get_consensus_tree
+from ..coretype.tree import TreeError, rf_matrix
 from ..parser.newick import NewickError
 from .datasets import *
 
@@ -51,6 +51,17 @@ class Test_Coretype_Tree(unittest.TestCase):
         t.del_feature('testf4')
         self.assertTrue('testf4' not in t.features)
 
+        # basic features are always available, even if the feature set of
+        # a node has not been created yet
+        t = Tree("((A, B)C, D);", format=1)
+        for n in t.traverse():
+            self.assertEqual(n.features, set(["dist", "support", "name"]))
+        (t & "A").add_feature("color", "red")
+        t2 = t.copy()
+        self.assertEqual((t2 & "A").features, set(["dist", "support", "name", "color"]))
+        self.assertEqual((t2 & "A").color, "red")
+        self.assertEqual((t2 & "B").features, set(["dist", "support", "name"]))
+
     def test_tree_read_and_write(self):
         """ Tests newick support """
         # Read and write newick tree from file (and support for NHX
@@ -232,6 +243,78 @@ class Test_Coretype_Tree(unittest.TestCase):
         # unsupported newick stream
         self.assertRaises(NewickError, Tree, [1,2,3])
 
+    def test_newick_tokenizer(self):
+        """ compares the single pass tokenizer with the legacy newick parser """
+        from ..parser.newick import (NW_FORMAT, compile_matchers,
+                                     _read_newick_from_string)
+        from .legacy_newick import read_newick_from_string as _read_newick_from_string_legacy
+        t = Tree()
+        t.populate(100, random_branches=True)
+        (t & t.get_leaf_names()[0]).add_features(flag="red", mood="bad")
+        for f in NW_FORMAT:
+            nw = t.write(format=f, features=["flag", "mood"])
+            matcher = compile_matchers(formatcode=f)
+            t1 = _read_newick_from_string(nw, Tree(), matcher, f, False)
+            t2 = _read_newick_from_string_legacy(nw, Tree(), matcher, f, False)
+            self.assertEqual(t1.write(format=f, features=[]),
+                             t2.write(format=f, features=[]))
+
+        # tabs and new lines are ignored
+        t = Tree("((A,\n\tB)C,\r\nD);", format=1)
+        self.assertEqual(t.write(format=1), "((A:1,B:1)C:1,D:1);")
+
+        # broken structures
+        for nw in ["((A,B)(C,D));", "(A,B),C;", "(A,B);(C,D);",
+                   "(A,(B,C);", "((A,B)));", "(A,B(C,D));"]:
+            self.assertRaises(NewickError, Tree, nw)
+
+    def test_iter_newick(self):
+        """ tests lazy reading of files containing many trees """
+        import gzip
+        from ..parser.newick import iter_newick
+        trees = []
+        for i in range(20):
+            t = Tree()
+            t.populate(random.randint(2, 30), random_branches=True)
+            trees.append(t.write(format=1))
+        # several trees per line and trees spanning several lines
+        content = "%s\n%s\n" %(''.join(trees[:10]), '\n'.join(
+            nw.replace(',', ',\n') for nw in trees[10:]))
+        open("/tmp/etetempmulti.nw", "w").write(content)
+        with gzip.open("/tmp/etetempmulti.nw.gz", "wb") as OUT:
+            OUT.write(content.encode('utf-8'))
+
+        for fname in ["/tmp/etetempmulti.nw", "/tmp/etetempmulti.nw.gz"]:
+            for buffer_size in [7, 1024]:
+                observed = [t.write(format=1) for t in
+                            iter_newick(fname, format=1, buffer_size=buffer_size)]
+                self.assertEqual(observed, trees)
+
+        # file handles and custom tree classes
+        with open("/tmp/etetempmulti.nw") as IN:
+            observed = list(iter_newick(IN, format=1, tree_class=PhyloTree))
+        self.assertEqual(len(observed), 20)
+        self.assertTrue(all(isinstance(t, PhyloTree) for t in observed))
+
+        # semicolons in quoted names
+        open("/tmp/etetempmulti.nw", "w").write('("A;":1,"B":1);\n("C":1,"D;;":1);')
+        observed = [sorted(t.get_leaf_names()) for t in
+                    iter_newick("/tmp/etetempmulti.nw", format=1, quoted_names=True,
+                                buffer_size=3)]
+        self.assertEqual(observed, [["A;", "B"], ["C", "D;;"]])
+
+        # last tree is not terminated
+        open("/tmp/etetempmulti.nw", "w").write('(A,B);(C,D)')
+        self.assertRaises(NewickError, list, iter_newick("/tmp/etetempmulti.nw"))
+
+        # comment lines in tree files read by ete tools
+        from ..tools.common import itertrees
+        open("/tmp/etetempmulti.nw", "w").write('(A,B);\n# final comment')
+        self.assertEqual(list(itertrees(None, "/tmp/etetempmulti.nw")), ['(A,B);'])
+        open("/tmp/etetempmulti.nw", "w").write('# comment; with semicolon\n(A,B);\n#;\n(C,\n#x\nD);\n')
+        self.assertEqual(list(itertrees(["(E,F);"], "/tmp/etetempmulti.nw")),
+                         ['(E,F);', '(A,B);', '(C,\nD);'])
+
     def test_quoted_names(self):
         complex_name = "((A:0.0001[&&NHX:hello=true],B:0.011)90:0.01[&&NHX:hello=true],(C:0.01, D:0.001)hello:0.01);"
         # A quoted tree within a tree
@@ -453,6 +536,26 @@ class Test_Coretype_Tree(unittest.TestCase):
         self.assertEqual(matrix1, matrix2)
         self.assertEqual(len(t.get_descendants()), (sample_size*2)-2 )
 
+        # pruned copies leave the original tree untouched
+        t = Tree('(((((A:1,B:1)C:1)D:1,E:1)F:1,G:1)H:1,(I:1,J:1)K:1)root;', format=1)
+        orig_nw = t.write(format=1)
+        content = t.get_cached_content()
+        for to_keep in [['A', 'B', 'I'], ['A', 'C', 'I'], ['A', 'B', 'F', 'H'], ['E'], ['C']]:
+            for preserve in [False, True]:
+                pruned = t.get_pruned_copy(to_keep, preserve_branch_length=preserve)
+                t2 = t.copy()
+                t2.prune(to_keep, preserve_branch_length=preserve)
+                self.assertEqual(pruned.write(format=1), t2.write(format=1))
+                self.assertEqual(t.write(format=1), orig_nw)
+        self.assertEqual(t.get_pruned_copy(['A', 'C', 'I'], True).write(format=1),
+                         "(((A:1)C:1)D:3,I:2);")
+        self.assertEqual(t.get_cached_content(), content)
+
+        # cached content is updated by prune
+        t.prune(['A', 'B', 'I'])
+        self.assertEqual(set(t.get_cached_content()[t]), set(t.get_leaves()))
+        self.assertRaises(TreeError, t.prune, [])
+
     def test_resolve_polytomies(self):
         # resolve polytomy
         t = Tree("((a,a,a,a), (b,b,b,(c,c,c)));")
@@ -693,6 +796,88 @@ class Test_Coretype_Tree(unittest.TestCase):
 
         #self.assertEqual(cache_name_lof[t], [t.name])
 
+    def test_cached_content_invalidation(self):
+        def check_content(t):
+            content = t.get_cached_content(container_type=frozenset)
+            self.assertEqual(set(content), set(t.traverse()))
+            leaves, ranges = t.get_cached_leaf_ranges()
+            for n in t.traverse():
+                self.assertEqual(content[n], set(n.get_leaves()))
+                start, end = ranges[n]
+                self.assertEqual(set(leaves[start:end]), set(n.get_leaves()))
+
+        t = Tree()
+        t.populate(30)
+        check_content(t)
+        leaf = t.get_leaves()[0]
+        first = t.get_cached_content(container_type=frozenset)
+        # unmodified subtrees reuse their cached content
+        self.assertTrue(t.get_cached_content(container_type=frozenset)[leaf.up] is first[leaf.up])
+
+        leaf.add_child(name="new")
+        check_content(t)
+        leaf.remove_child(leaf.children[0])
+        check_content(t)
+        t.get_leaves()[3].up.delete()
+        check_content(t)
+        t.set_outgroup(t.get_leaves()[5])
+        check_content(t)
+        t.prune(t.get_leaves()[:10])
+        check_content(t)
+        t.get_leaves()[2].detach()
+        check_content(t)
+        t.children[0].children = []
+        check_content(t)
+        # children lists modified in place
+        t.children[1].children.remove(t.children[1].children[0])
+        check_content(t)
+        t.children[1].children[0].children.append(Tree("(x,y);"))
+        check_content(t)
+        t.children[1].children.reverse()
+        leaves, ranges = t.get_cached_leaf_ranges()
+        self.assertEqual(leaves, t.get_leaves())
+
+        # only frozenset containers are shared among calls
+        self.assertTrue(t.get_cached_content()[t] is not t.get_cached_content()[t])
+        for kargs in [{}, {"store_attr": "name"}, {"leaves_only": False}]:
+            self.assertEqual(set(type(c) for c in t.get_cached_content(**kargs).values()), set([set]))
+            content = t.get_cached_content(container_type=frozenset, **kargs)
+            self.assertEqual(set(type(c) for c in content.values()), set([frozenset]))
+            self.assertEqual(content, dict((n, frozenset(c)) for n, c in
+                                           t.get_cached_content(**kargs).items()))
+
+        # cache is not kept in copies
+        copy = t.copy()
+        self.assertTrue(all(n._content is None for n in copy.traverse()))
+        t.clear_cached_content()
+        self.assertTrue(all(n._content is None for n in t.traverse()))
+
+    def test_deep_trees(self):
+        t = Tree("((a,b)abc,((c)longname)x,d)root;", format=1)
+        self.assertEqual(t.get_ascii(show_internal=True, compact=True),
+                         '\n    /abc-a\n-root  \\-b\n   |-x /longname-c\n    \\-d')
+
+        # caterpillar tree deeper than the recursion limit
+        depth = sys.getrecursionlimit() + 100
+        t = PhyloTree()
+        node = t
+        for i in range(depth):
+            node.add_features(evoltype="D")
+            node.add_child(name="l%d" %i)
+            node = node.add_child(name="n%d" %i)
+
+        content = t.get_cached_content(store_attr="name", container_type=list)
+        self.assertEqual(len(content), depth * 2 + 1)
+        self.assertEqual(content[t], t.get_leaf_names())
+        content = t.get_cached_content(store_attr="name", leaves_only=False)
+        self.assertEqual(content[t], set([n.name for n in t.traverse()]))
+
+        lines = t.get_ascii(compact=True).split("\n")[1:]
+        self.assertEqual(len(lines), depth + 1)
+        self.assertTrue(lines[-1].endswith("\\-n%d" %(depth - 1)))
+
+        self.assertEqual(len(t.split_by_dups(autodetect_duplications=False)), depth + 1)
+
 
     def test_rooting(self):
         """ Check branch support and distances after rooting """
@@ -768,6 +953,40 @@ class Test_Coretype_Tree(unittest.TestCase):
                 n.swap_children()
                 self.assertEqual(t.get_topology_id(), orig_id)
 
+    def test_topology_hash(self):
+        t = Tree()
+        t.populate(50, random_branches=True)
+        orig_hash = t.get_topology_hash()
+        orig_unrooted = t.get_topology_hash(unrooted=True)
+        for n in random.sample(t.get_descendants(), 20):
+            n.swap_children()
+        self.assertEqual(t.get_topology_hash(), orig_hash)
+        t.set_outgroup(random.choice(t.get_leaves()))
+        self.assertEqual(t.get_topology_hash(unrooted=True), orig_unrooted)
+
+        t = Tree("(((C,(B,A)),(D)),'E F');", quoted_node_names=True)
+        self.assertEqual(t.get_canonical_newick(), "((((A,B),C),D),'E F');")
+        self.assertEqual(t.get_canonical_newick(unrooted=True), "(A,(B,(C,(D,'E F'))));")
+        self.assertEqual(Tree("((A,B),(C,D));").get_canonical_newick(unrooted=True),
+                         Tree("(A,B,(C,D));").get_canonical_newick(unrooted=True))
+        self.assertNotEqual(Tree("((A,B),(C,D));").get_topology_hash(),
+                            Tree("(A,B,(C,D));").get_topology_hash())
+        self.assertEqual(Tree("(A:1,B:2)x;", format=1).get_canonical_newick(), "(A,B);")
+
+        counter = TopologyCounter(unrooted=True)
+        counter.update(["((A,B),(C,D));", "(D,C,(B,A));", Tree("((A,C),(B,D));"), "((A,B),C,D);"])
+        self.assertEqual((counter.total, len(counter), counter.error), (4, 2, 0))
+        self.assertEqual(counter.get_map_topology(), ("(A,(B,(C,D)));", 0.75))
+        self.assertEqual(counter.get_count("(C,D,(A,B));"), 3)
+        self.assertEqual(counter.get_credible_set(0.7), [("(A,(B,(C,D)));", 0.75)])
+        self.assertEqual(len(counter.get_credible_set(0.95)), 2)
+
+        # bounded number of topologies
+        counter = TopologyCounter(max_topologies=2)
+        counter.update(["(A,(B,C));"] * 5 + ["((A,B),C);", "((A,C),B);", "((A,C),B);"])
+        self.assertEqual(counter.most_common(), [("(A,(B,C));", 4), ("((A,C),B);", 1)])
+        self.assertEqual((counter.total, counter.error), (8, 1))
+
 
     def test_ultrametric(self):
 
@@ -915,6 +1134,183 @@ class Test_Coretype_Tree(unittest.TestCase):
         self.assertEqual(_astuple(s3.compare(ref1)),
                          (1.0, 8, 8, 0.0, 0.0, 6, 1, "NA"))
 
+    def test_robinson_foulds_splits(self):
+        def get_edges(t, common, unrooted):
+            edges = set()
+            for n, content in t.get_cached_content(store_attr="name").items():
+                p1 = tuple(sorted(content & common))
+                if unrooted:
+                    p2 = tuple(sorted(common - content))
+                    edges.add(tuple(sorted([p1, p2])))
+                elif p1:
+                    edges.add(p1)
+            return edges
+
+        names = [str(i) for i in range(50)]
+        for _ in range(20):
+            t1 = Tree()
+            t1.populate(40, names_library=random.sample(names, 40))
+            t2 = Tree()
+            t2.populate(40, names_library=random.sample(names, 40))
+            common = set(t1.get_leaf_names()) & set(t2.get_leaf_names())
+            for unrooted in [False, True]:
+                edges1 = get_edges(t1, common, unrooted)
+                edges2 = get_edges(t2, common, unrooted)
+                rf, max_rf, names_, r1, r2, d1, d2 = t1.robinson_foulds(t2, unrooted_trees=unrooted)
+                self.assertEqual(r1, edges1)
+                self.assertEqual(r2, edges2)
+                self.assertEqual(rf, len(edges1 ^ edges2))
+                self.assertEqual(names_, common)
+
+    def test_rf_matrix(self):
+        names = [str(i) for i in range(30)]
+        trees = []
+        for _ in range(8):
+            t = Tree()
+            t.populate(30, names_library=names)
+            trees.append(t)
+
+        for unrooted in [False, True]:
+            matrix = rf_matrix(trees, unrooted=unrooted)
+            self.assertEqual(rf_matrix([t.write() for t in trees], unrooted=unrooted, n_jobs=2).tolist(),
+                             matrix.tolist())
+            for i, j in itertools.product(range(len(trees)), repeat=2):
+                rf = trees[i].robinson_foulds(trees[j], unrooted_trees=unrooted)[0]
+                self.assertEqual(matrix[i][j], rf)
+
+        self.assertRaises(TreeError, rf_matrix, [Tree("((A,B),C);"), Tree("((A,B),D);")])
+        self.assertRaises(TreeError, rf_matrix, [Tree("((A,B),C);"), Tree("((A,B),A);")])
+        self.assertRaises(TreeError, rf_matrix, [Tree("((A,A),C);"), Tree("((A,B),C);")])
+
+        # rooted comparisons require rooted trees, as in robinson_foulds
+        unrooted_trees = [Tree("((A,B),C,D);"), Tree("((A,C),B,D);")]
+        self.assertRaises(TreeError, unrooted_trees[0].robinson_foulds, unrooted_trees[1])
+        self.assertRaises(TreeError, rf_matrix, unrooted_trees)
+        self.assertRaises(TreeError, rf_matrix, [Tree("((A,B),(C,D));"), unrooted_trees[1]])
+        self.assertEqual(rf_matrix(unrooted_trees, unrooted=True).tolist(), [[0, 2], [2, 0]])
+
+    def test_consensus(self):
+        trees = ["((((A:1,B:1):1,C:2):1,D:3):1,(E:1,F:2):1);"] * 3
+        trees.append("((((A:3,C:1):1,B:2):1,D:3):1,(E:1,F:2):1);")
+
+        expected = {
+            "strict": "(((A,B,C),D),(E,F));",
+            "majority": "((((A,B),C),D),(E,F));",
+            "extended": "((((A,B),C),D),(E,F));",
+        }
+        for method, nw in expected.items():
+            consensus = get_consensus_tree(trees, method=method)
+            self.assertEqual(consensus.get_canonical_newick(), Tree(nw).get_canonical_newick())
+
+        consensus = get_consensus_tree(trees, method="majority")
+        ab = consensus.get_common_ancestor("A", "B")
+        self.assertEqual(ab.support, 0.75)
+        self.assertEqual(ab.dist, 1.0)
+        self.assertEqual(ab.up.support, 1.0)
+        self.assertEqual((consensus & "A").dist, 1.5)
+        self.assertEqual(get_consensus_tree(trees, min_freq=0.8).get_canonical_newick(),
+                         Tree("(((A,B,C),D),(E,F));").get_canonical_newick())
+
+        # unrooted trees: the two root branches are a single edge
+        consensus = get_consensus_tree(trees, method="majority", unrooted=True)
+        self.assertEqual(consensus.get_canonical_newick(unrooted=True),
+                         Tree("((((A,B),C),D),(E,F));").get_canonical_newick(unrooted=True))
+        self.assertEqual(consensus.get_common_ancestor("E", "F").dist, 2.0)
+
+        # extended majority rule adds compatible minority splits
+        trees = ["(((A,B),C),D);", "(((A,B),C),D);", "((A,B),(C,D));",
+                 "(((A,C),B),D);", "(((A,C),B),D);", "(((A,D),B),C);"]
+        self.assertEqual(get_consensus_tree(trees, method="majority").get_canonical_newick(),
+                         Tree("((A,B,C),D);").get_canonical_newick())
+        self.assertEqual(get_consensus_tree(trees, method="greedy").get_canonical_newick(),
+                         Tree("(((A,B),C),D);").get_canonical_newick())
+
+        names = [str(i) for i in range(20)]
+        trees = []
+        for _ in range(30):
+            t = Tree()
+            t.populate(20, names_library=names, random_branches=True)
+            trees.append(t.write())
+        counter = SplitCounter()
+        counter.update(trees)
+        counter2 = SplitCounter()
+        counter2.update(trees, n_jobs=2, chunksize=4)
+        self.assertEqual(counter2.total, 30)
+        splits = counter.get_split_frequencies()
+        splits2 = counter2.get_split_frequencies()
+        self.assertEqual([split[:2] for split in splits2], [split[:2] for split in splits])
+        for split, split2 in zip(splits, splits2):
+            self.assertAlmostEqual(split[2], split2[2])
+
+        clades = {}
+        for nw in trees:
+            for node in Tree(nw).iter_descendants():
+                if not node.is_leaf():
+                    key = tuple(sorted(node.get_leaf_names()))
+                    clades[key] = clades.get(key, 0) + 1
+        self.assertEqual(dict((names, freq) for names, freq, _ in counter.get_split_frequencies()),
+                         dict((names, count / 30.0) for names, count in clades.items()))
+        for node in counter.get_consensus("extended").iter_descendants():
+            if not node.is_leaf():
+                self.assertEqual(node.support, clades[tuple(sorted(node.get_leaf_names()))] / 30.0)
+
+        self.assertRaises(TreeError, get_consensus_tree, ["((A,B),C);", "((A,B),D);"])
+        self.assertRaises(TreeError, SplitCounter().get_consensus)
+        self.assertRaises(ValueError, get_consensus_tree, ["((A,B),C);"], method="mode")
+
+    def test_split_support(self):
+        ref = Tree("((((A,B),C),D),(E,F));")
+        trees = ["((((A,B),C),D),(E,F));"] * 3 + ["((((A,C),B),D),(E,F));"]
+        self.assertEqual(ref.map_split_support(trees), 4)
+        self.assertEqual(ref.get_common_ancestor("A", "B").support, 0.75)
+        self.assertEqual(ref.get_common_ancestor("A", "C").support, 1.0)
+        self.assertEqual((ref & "A").support, 1.0)
+
+        # rooted and unrooted splits
+        trees = ["(((A,B),C),(D,(E,F)));", "((A,B),(C,(D,(E,F))));"]
+        ref.map_split_support(trees)
+        self.assertEqual(ref.get_common_ancestor("A", "D").support, 0.0)
+        self.assertEqual(ref.get_common_ancestor("A", "C").support, 0.5)
+        ref.map_split_support(trees, unrooted=True)
+        self.assertEqual(ref.get_common_ancestor("A", "D").support, 1.0)
+        self.assertEqual(ref.get_common_ancestor("A", "C").support, 1.0)
+
+        # transfer distance: one of the three leaves at the smaller side of
+        # ABC|DEF is moved in the second tree (1 - 1/2 / 2)
+        ref = Tree("(((A,B),C),(D,(E,F)));")
+        ref.map_split_support(["(((A,B),C),(D,(E,F)));", "(((A,B),D),(C,(E,F)));"],
+                              method="transfer")
+        self.assertEqual(ref.get_common_ancestor("A", "C").support, 0.75)
+        self.assertEqual(ref.get_common_ancestor("A", "B").support, 1.0)
+        self.assertEqual(ref.get_common_ancestor("E", "F").support, 1.0)
+
+        # transfer support matches an exhaustive search
+        names = [str(i) for i in range(15)]
+        ref = Tree()
+        ref.populate(15, names_library=names)
+        trees = []
+        for _ in range(6):
+            t = Tree()
+            t.populate(15, names_library=names)
+            trees.append(t)
+        ref.map_split_support([t.write() for t in trees], method="transfer", n_jobs=2)
+        all_leaves = set(names)
+        for node in ref.iter_descendants():
+            side = set(node.get_leaf_names())
+            max_dist = min(len(side), len(names) - len(side)) - 1
+            if max_dist < 1:
+                self.assertEqual(node.support, 1.0)
+                continue
+            total = 0
+            for t in trees:
+                dists = [len(side ^ set(n.get_leaf_names())) for n in t.iter_descendants()]
+                total += min([max_dist] + [min(d, len(names) - d) for d in dists])
+            self.assertAlmostEqual(node.support, 1.0 - total / float(len(trees) * max_dist))
+
+        self.assertRaises(TreeError, ref.map_split_support, ["((A,B),C);"])
+        self.assertRaises(TreeError, ref.map_split_support, [])
+        self.assertRaises(ValueError, ref.map_split_support, trees, method="bootstrap")
+
 
     def test_tree_diff(self):
         # this is the result of 100 Ktreedist runs on random trees, using rooted
@@ -1267,6 +1663,98 @@ class Test_Coretype_Tree(unittest.TestCase):
         self.assertEqual(set(mono_nodes), green_yellow_nodes)
 
 
+    def test_frozen_tree(self):
+        from ..coretype.frozentree import FrozenTree
+        t = Tree("((A:1,(B:2,C:3)1:0.5)E:1,(D:1,(F:1,G:2):1):1)R;", format=1)
+        ft = FrozenTree(t)
+        self.assertEqual(ft.n_nodes, len(list(t.traverse())))
+        self.assertEqual(len(ft), 6)
+
+        nodes = list(t.traverse("preorder"))
+        for strategy in ["preorder", "postorder", "levelorder"]:
+            expected = [nodes.index(n) for n in t.traverse(strategy)]
+            self.assertEqual(list(ft.traverse(strategy)), expected)
+        # subtree traversal
+        e_node = t & "E"
+        expected = [nodes.index(n) for n in e_node.traverse("postorder")]
+        self.assertEqual(list(ft.traverse("postorder", node=nodes.index(e_node))), expected)
+
+        self.assertEqual(ft.get_leaf_names(), t.get_leaf_names())
+        self.assertEqual(ft.get_leaf_names(nodes.index(e_node)), e_node.get_leaf_names())
+        leaves, start, end = ft.get_cached_content()
+        content = t.get_cached_content(store_attr="name")
+        for i, n in enumerate(nodes):
+            self.assertEqual(set(ft.get_name(l) for l in leaves[start[i]:end[i]]),
+                             content[n])
+
+        for a, b in itertools.combinations(t.get_leaf_names(), 2):
+            self.assertAlmostEqual(ft.get_distance(a, b), t.get_distance(a, b))
+            self.assertEqual(ft.get_distance(a, b, topology_only=True),
+                             t.get_distance(a, b, topology_only=True))
+            self.assertEqual(ft.get_name(ft.get_common_ancestor(a, b)),
+                             t.get_common_ancestor(a, b).name)
+
+        # internal nodes, including ancestor/descendant pairs
+        for a, b in itertools.product(nodes, repeat=2):
+            ia, ib = nodes.index(a), nodes.index(b)
+            self.assertAlmostEqual(ft.get_distance(ia, ib), t.get_distance(a, b))
+            self.assertEqual(ft.get_distance(ia, ib, topology_only=True),
+                             t.get_distance(a, b, topology_only=True))
+        t2 = Tree("((A,B)X,C)R;", format=1)
+        ft2 = FrozenTree(t2)
+        for a, b in [("X", "A"), ("A", "X"), ("R", "A"), ("A", "R"), ("X", "C"), ("C", "X")]:
+            self.assertEqual(ft2.get_distance(a, b, topology_only=True),
+                             t2.get_distance(a, b, topology_only=True))
+        self.assertEqual(ft2.get_distance("R", "A", topology_only=True), 2.0)
+        self.assertTrue(isinstance(ft2.get_distance("R", "A", topology_only=True), float))
+        self.assertEqual(ft2.get_node_ids("X", "A"), [1, 2])
+        self.assertRaises(TreeError, FrozenTree(Tree("((A,B)X,(C,D)X);", format=1)).get_node_ids, "X")
+
+        # back to TreeNode
+        self.assertEqual(ft.to_tree().write(format=1, format_root_node=True),
+                         t.write(format=1, format_root_node=True))
+
+        # shared leaf names
+        names = []
+        ft1 = FrozenTree(Tree("((A,B),C);"), leaf_names=names)
+        ft2 = FrozenTree(Tree("((C,D),A);"), leaf_names=names)
+        self.assertEqual(names, ["A", "B", "C", "D"])
+        self.assertEqual(ft2.get_leaf_names(), ["C", "D", "A"])
+
+    def test_lca_index(self):
+        t = Tree("(((A:0.1, B:0.01):0.001, C:0.0001):1.0[&&NHX:name=I], (D:0.00001):0.000001[&&NHX:name=J]):2.0[&&NHX:name=root];")
+        index = t.build_lca_index()
+        self.assertEqual(len(index), 8)
+        self.assertEqual(index.get_common_ancestor("A", "C").name, "I")
+        self.assertEqual(index.get_common_ancestor(["A", "B", "D"]).name, "root")
+        self.assertEqual(index.get_common_ancestor(t&"A", t&"I").name, "I")
+        self.assertEqual(index.get_depth("A"), 3)
+        self.assertEqual(index.get_depth(t), 0)
+        self.assertAlmostEqual(index.get_root_distance("A"), 1.101)
+        self.assertAlmostEqual(index.get_distance("A", "B"), 0.11)
+        self.assertRaises(ValueError, index.get_distance, "A", "Z")
+        self.assertRaises(TreeError, index.get_distance, "A", Tree())
+
+        # all pairs of nodes, including ancestors, in random trees
+        for _ in range(10):
+            t = Tree()
+            t.populate(20, random_branches=True)
+            index = t.build_lca_index()
+            nodes = list(t.traverse())
+            for a, b in itertools.product(nodes, repeat=2):
+                self.assertTrue(index.get_common_ancestor(a, b) is t.get_common_ancestor(a, b))
+                self.assertAlmostEqual(index.get_distance(a, b), t.get_distance(a, b))
+                self.assertEqual(index.get_distance(a, b, topology_only=True),
+                                 t.get_distance(a, b, topology_only=True))
+
+            matrix = index.leaf_distance_matrix()
+            topo_matrix = index.leaf_distance_matrix(topology_only=True)
+            for i, j in itertools.combinations(range(len(index.leaves)), 2):
+                a, b = index.leaves[i], index.leaves[j]
+                self.assertAlmostEqual(matrix[i][j], t.get_distance(a, b))
+                self.assertAlmostEqual(matrix[j][i], t.get_distance(a, b))
+                self.assertEqual(topo_matrix[i][j], t.get_distance(a, b, topology_only=True))
+
     def test_copy(self):
         t = Tree("((A, B)Internal_1:0.7, (C, D)Internal_2:0.5)root:1.3;", format=1)
         # we add a custom annotation to the node named A
@@ -1286,6 +1774,27 @@ class Test_Coretype_Tree(unittest.TestCase):
         self.assertEqual((t_pkl & "A").complex[0], [0,1])
         self.assertEqual((t_deep & "A").testfn(), "YES")
 
+        t_fast = t.copy("fast")
+        self.assertEqual(t_fast.write(format=1, features=[]), t.write(format=1, features=[]))
+        self.assertEqual((t_fast & "A").testfn(), "YES")
+        self.assertEqual((t_fast & "A").features, (t & "A").features)
+        self.assertTrue((t_fast & "A").complex is (t & "A").complex)
+        self.assertTrue(all(a is not b for a, b in zip(t_fast.traverse(), t.traverse())))
+        (t_fast & "A").add_features(label="changed")
+        (t_fast & "A").detach()
+        self.assertEqual((t & "A").label, "custom Value")
+        self.assertEqual(len(t), 4)
+
+        # copying a subtree does not copy its parent
+        sub = (t & "Internal_1").copy("fast")
+        self.assertTrue(sub.up is None)
+        self.assertEqual(sub.get_leaf_names(), ["A", "B"])
+
+        pt = PhyloTree("((Hsa_1, Mmu_1), Ptr_1);")
+        pt_fast = pt.copy("fast")
+        self.assertTrue(isinstance(pt_fast, PhyloTree))
+        self.assertEqual([l.species for l in pt_fast], ["Hsa", "Mmu", "Ptr"])
+
       
 
     # def test_traversing_speed(self):
@@ -39,6 +39,7 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
+import os
 import sys
 import operator
 import re
@@ -85,15 +86,46 @@ log = Logger(sys.stderr)
 
 
 def itertrees(trees, treefile):
+    """ Yields the newick strings in a list of trees and then those found
+    in treefile, which is read lazily. Tree files can be gzipped, contain
+    several trees per line or trees spanning several lines, and lines
+    starting with # are ignored. """
+    from ..parser.newick import _iter_newick_strings, _open_newick_file
     if trees:
         for nw in trees:
             yield nw
     if treefile:
-        for line in open(treefile):
+        with _open_newick_file(treefile) as handle:
+            # comment lines are removed before looking for tree ends, as
+            # they may contain semicolons
+            for nw in _iter_newick_strings(_UncommentedFile(handle)):
+                if nw:
+                    yield nw
+
+class _UncommentedFile(object):
+    """ Read only wrapper of a text file handle skipping the lines starting
+    with #. """
+
+    def __init__(self, handle):
+        self._lines = (line for line in handle if not line.lstrip().startswith('#'))
+
+    def read(self, size=-1):
+        chunk = []
+        length = 0
+        for line in self._lines:
+            chunk.append(line)
+            length += len(line)
+            if 0 <= size <= length:
+                break
+        return ''.join(chunk)
+
+def _iter_list_file(fname):
+    """ Yields the non empty lines of a (possibly gzipped) list file. """
+    from ..parser.newick import _open_newick_file
+    with _open_newick_file(fname) as handle:
+        for line in handle:
             line = line.strip()
-            if not line or line.startswith('#'):
-                continue
-            else:
+            if line:
                 yield line
 
 def node_matcher(node, filters):
@@ -197,7 +229,9 @@ def populate_source_args(source_args_p):
 
     source_args.add_argument("--src_tree_list", dest="src_tree_list",
                              type=str,
-                             help=("path to a file containing many source trees, one per line"))
+                             help=("path to a (possibly gzipped) file containing many source trees or"
+                                   " tree files, one per line. Use -t to read tree files"
+                                   " with trees spanning several lines"))
 
     source_args.add_argument("--src_tree_attr", dest="src_tree_attr",
                              type=str, default="name",
@@ -219,7 +253,8 @@ def populate_ref_args(ref_args_p):
 
     ref_args.add_argument("--ref_tree_list", dest="ref_tree_list",
                              type=str,
-                             help="path to a file containing many ref trees, one per line")
+                             help=("path to a (possibly gzipped) file containing many ref trees or"
+                                   " tree files, one per line"))
 
     ref_args.add_argument("--ref_tree_attr", dest="ref_tree_attr",
                            type=str, default="name",
@@ -241,17 +276,65 @@ def src_tree_iterator(args):
         for stree in args.src_trees:
             yield stree.strip()
     elif args.src_tree_list:
-        for line in open(args.src_tree_list):
-            line = line.strip()
-            if line: 
-                yield line
+        for line in _iter_list_file(args.src_tree_list):
+            yield line
 
 def ref_tree_iterator(args):
     if args.ref_trees:
         for stree in args.ref_trees:            
             yield stree
     elif args.ref_tree_list:
-        for line in open(args.ref_tree_list):
-            line = line.strip()
-            if line: 
-                yield line
+        for line in _iter_list_file(args.ref_tree_list):
+            yield line
+
+def iter_source_trees(sources, tree_class, newick_format=0):
+    """ Yields (name, tree) tuples for all trees in a list of sources. Each
+    source can be a newick string or the path to a (possibly gzipped) file
+    containing one or more trees, which are loaded lazily one at a time. Trees
+    from a file are named after the file, adding their position in the file
+    to all but the first one (i.e. trees.nw, trees.nw:2, trees.nw:3...)"""
+    from ..parser.newick import iter_newick
+    for source in sources:
+        if len(source) < 220 and os.path.isfile(source):
+            trees = iter_newick(source, format=newick_format, tree_class=tree_class)
+            for index, tree in enumerate(trees):
+                name = source if index == 0 else "%s:%d" %(source, index + 1)
+                yield name, tree
+        else:
+            yield source, tree_class(source, format=newick_format)
+
+def iter_source_newicks(sources):
+    """ Yields (name, newick) tuples for all trees in a list of sources,
+    without parsing them. Each source can be a newick string, a (possibly
+    gzipped) file containing one or more trees, a directory, whose files are
+    read in alphabetical order, or "-" to read trees from standard input.
+    Trees are named as in iter_source_trees."""
+    from ..parser.newick import _iter_newick_strings, _open_newick_file
+    for source in sources:
+        if source == "-":
+            fnames = [None]
+        elif len(source) < 220 and os.path.isdir(source):
+            fnames = sorted(os.path.join(source, fname) for fname in os.listdir(source)
+                            if os.path.isfile(os.path.join(source, fname)))
+        elif len(source) < 220 and os.path.isfile(source):
+            fnames = [source]
+        else:
+            yield source, source
+            continue
+        for fname in fnames:
+            handle = sys.stdin if fname is None else _open_newick_file(fname)
+            name = fname or "stdin"
+            try:
+                for index, nw in enumerate(_iter_newick_strings(handle)):
+                    yield (name if index == 0 else "%s:%d" %(name, index + 1)), nw
+            finally:
+                if handle is not sys.stdin:
+                    handle.close()
+
+def src_trees(args, tree_class):
+    return iter_source_trees(src_tree_iterator(args), tree_class,
+                             newick_format=args.src_newick_format)
+
+def ref_trees(args, tree_class):
+    return iter_source_trees(ref_tree_iterator(args), tree_class,
+                             newick_format=args.ref_newick_format)
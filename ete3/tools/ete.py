@@ -54,7 +54,7 @@ TOOLSPATH = os.path.realpath(os.path.split(os.path.realpath(__file__))[0])
 import argparse
 from . import (ete_split, ete_expand, ete_annotate, ete_ncbiquery, ete_view,
                ete_generate, ete_mod, ete_extract, ete_compare, ete_evol,
-               ete_maptrees)
+               ete_maptrees, ete_consense, ete_support)
 from . import common
 from .common import log
 from .utils import colorify, which
@@ -239,6 +239,20 @@ def _main(arguments):
     maptrees_args_p.set_defaults(func=ete_maptrees.run)
     ete_maptrees.populate_args(maptrees_args_p)
 
+    # - CONSENSE -
+    consense_args_p = subparser.add_parser("consense", parents=[source_args_p, main_args_p],
+                                           description=ete_consense.DESC,
+                                           formatter_class=argparse.RawDescriptionHelpFormatter)
+    consense_args_p.set_defaults(func=ete_consense.run)
+    ete_consense.populate_args(consense_args_p)
+
+    # - SUPPORT -
+    support_args_p = subparser.add_parser("support", parents=[source_args_p, ref_args_p, main_args_p],
+                                          description=ete_support.DESC,
+                                          formatter_class=argparse.RawDescriptionHelpFormatter)
+    support_args_p.set_defaults(func=ete_support.run)
+    ete_support.populate_args(support_args_p)
+
     # - build -
     generate_args_p = subparser.add_parser("build")
 
@@ -214,7 +214,7 @@ class TreeMerger(TreeMergeTask):
             self.main_tree = ttree
             orig_target = ttree
 
-        tn = orig_target.copy()
+        tn = orig_target.copy("fast")
         self.pre_iter_task_tree = tn
         self.rf = orig_target.robinson_foulds(ttree)
         self.pre_iter_support = orig_target.support
@@ -223,7 +223,7 @@ def process_task(task, wkname, npr_conf, nodeid2info):
 
                 target_cladeids = None
                 if tobool(conf[splitterconf].get("_find_ncbi_targets", False)):
-                    tcopy = mtree.copy()
+                    tcopy = mtree.copy("fast")
                     ncbi.connect_database()
                     tax2name, tax2track = ncbi.annotate_tree_with_taxa(tcopy, None)
                     #tax2name, tax2track = ncbi.annotate_tree_with_taxa(tcopy, "fake") # for testing sptree example
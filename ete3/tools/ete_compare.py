@@ -39,7 +39,7 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
-from .common import as_str, shorten_str, src_tree_iterator, ref_tree_iterator
+from .common import as_str, shorten_str, src_trees, ref_trees
 
 import re
 from six.moves import map
@@ -91,11 +91,24 @@ def populate_args(compare_args_p):
                               action = "store_true",
                               help="activates the TreeKO duplication aware comparison method")
 
+    compare_args.add_argument("--matrix", dest="matrix",
+                              action = "store_true",
+                              help=("output the all-against-all RF distance matrix of the"
+                                    " source trees in tab delimited format. All trees must"
+                                    " contain the same leaves. Reference trees are not used."))
+
+    compare_args.add_argument("--cpus", dest="cpus",
+                              type=int, default=1,
+                              help="number of processes used to compute the RF matrix")
+
 
 def run(args):
     from .. import Tree
     from ..utils import print_table
 
+    if args.matrix:
+        return run_matrix(args)
+
     def iter_differences(set1, set2, unrooted=False):
         for s1 in set1:
             pairs = []
@@ -131,8 +144,7 @@ def run(args):
     else:
         tree_class = Tree
 
-    for stree_name in src_tree_iterator(args):
-        stree = tree_class(stree_name, format=args.src_newick_format)
+    for stree_name, stree in src_trees(args, tree_class):
 
         # Parses attrs if necessary
         src_tree_attr = args.src_tree_attr
@@ -142,8 +154,7 @@ def run(args):
                     args.src_attr_parser, getattr(leaf, args.src_tree_attr)).groups()[0])
             src_tree_attr = 'tempattr'
 
-        for rtree_name in ref_tree_iterator(args):
-            rtree = tree_class(rtree_name, format=args.ref_newick_format)
+        for rtree_name, rtree in ref_trees(args, tree_class):
 
             # Parses attrs if necessary
             ref_tree_attr = args.ref_tree_attr
@@ -203,6 +214,27 @@ def run(args):
                                 fix_col_width = col_sizes, wrap_style='cut')
 
 
+def run_matrix(args):
+    from .. import Tree, rf_matrix
+
+    src_tree_attr = 'tempattr' if args.src_attr_parser else args.src_tree_attr
+    names, trees = [], []
+    for stree_name, stree in src_trees(args, Tree):
+        # Parses attrs if necessary
+        if args.src_attr_parser:
+            for leaf in stree:
+                leaf.add_feature('tempattr', re.search(
+                    args.src_attr_parser, getattr(leaf, args.src_tree_attr)).groups()[0])
+        names.append(stree_name)
+        trees.append(stree)
+
+    matrix = rf_matrix(trees, attr=src_tree_attr, unrooted=args.unrooted,
+                       n_jobs=args.cpus)
+    print('# \t' + '\t'.join(names))
+    for name, row in zip(names, matrix):
+        print(name + '\t' + '\t'.join(map(str, row)))
+
+
 def euc_dist(v1, v2):
     if type(v1) != set: v1 = set(v1)
     if type(v2) != set: v2 = set(v2)
@@ -0,0 +1,120 @@
+# #START_LICENSE###########################################################
+#
+#
+# This file is part of the Environment for Tree Exploration program
+# (ETE).  http://etetoolkit.org
+#
+# ETE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ETE is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ETE.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#                     ABOUT THE ETE PACKAGE
+#                     =====================
+#
+# ETE is distributed under the GPL copyleft license (2008-2015).
+#
+# If you make use of ETE in published work, please cite:
+#
+# Jaime Huerta-Cepas, Joaquin Dopazo and Toni Gabaldon.
+# ETE: a python Environment for Tree Exploration. Jaime BMC
+# Bioinformatics 2010,:24doi:10.1186/1471-2105-11-24
+#
+# Note that extra references to the specific methods implemented in
+# the toolkit may be available in the documentation.
+#
+# More info at http://etetoolkit.org. Contact: huerta@embl.de
+#
+#
+# #END_LICENSE#############################################################
+from __future__ import absolute_import
+from __future__ import print_function
+
+import re
+
+from .common import dump, src_trees, src_tree_iterator, iter_source_newicks
+
+DESC = """
+ - ete consense -
+
+'consense' builds the consensus tree of a collection of trees containing
+the same leaves (i.e. bootstrap replicates or MCMC samples). Source trees
+can be newick strings or files with any number of trees, which are read
+lazily, so very large collections can be summarized with small memory
+usage. Support values in the consensus tree are the fraction of source
+trees containing each branch, and branch lengths are their mean length.
+
+Example:
+
+  ete3 consense -t bootstrap_trees.nw --method extended --unrooted --cpus 4
+
+"""
+
+def populate_args(consense_args_p):
+    consense_args = consense_args_p.add_argument_group('CONSENSE OPTIONS')
+
+    consense_args.add_argument("--method", dest="method",
+                               choices=["strict", "majority", "extended", "greedy"],
+                               default="majority",
+                               help=("strict: branches found in all trees. majority: branches"
+                                     " found in more than half of the trees (or in more than"
+                                     " --min_freq). extended (or greedy): the majority rule"
+                                     " tree plus the rest of compatible branches, added by"
+                                     " decreasing frequency."))
+
+    consense_args.add_argument("--min_freq", dest="min_freq",
+                               type=float,
+                               help=("min frequency of branches in the consensus tree"))
+
+    consense_args.add_argument("--unrooted", dest="unrooted",
+                               action="store_true",
+                               help="compare source trees as unrooted")
+
+    consense_args.add_argument("--splits", dest="splits",
+                               action="store_true",
+                               help=("report the frequency and mean length of all the"
+                                     " branches found in the source trees instead of"
+                                     " the consensus tree"))
+
+    consense_args.add_argument("--cpus", dest="cpus",
+                               type=int, default=1,
+                               help="number of processes used to read source trees")
+
+def iter_parsed_trees(args):
+    from .. import Tree
+    for _, stree in src_trees(args, Tree):
+        for leaf in stree:
+            leaf.add_feature('tempattr', re.search(
+                args.src_attr_parser, getattr(leaf, args.src_tree_attr)).groups()[0])
+        yield stree
+
+def run(args):
+    from ..coretype.consensus import SplitCounter
+
+    if args.src_attr_parser:
+        # leaf names are parsed here, so processes get already parsed trees
+        src_tree_attr = 'tempattr'
+        trees = iter_parsed_trees(args)
+    else:
+        src_tree_attr = args.src_tree_attr
+        trees = (nw for _, nw in iter_source_newicks(src_tree_iterator(args)))
+
+    counter = SplitCounter(attr=src_tree_attr, unrooted=args.unrooted,
+                           newick_format=args.src_newick_format)
+    counter.update(trees, n_jobs=args.cpus)
+
+    if args.splits:
+        print('# ' + '\t'.join(["Frequency", "Mean_length", "Leaves"]))
+        for names, freq, length in counter.get_split_frequencies(args.min_freq or 0.0):
+            print('\t'.join(["%0.4f" %freq, "%g" %length, ','.join(map(str, names))]))
+    else:
+        dump(counter.get_consensus(args.method, min_freq=args.min_freq))
@@ -39,7 +39,7 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
-from .common import dump, src_tree_iterator
+from .common import dump, src_trees
 
 DESC = ""
 
@@ -94,8 +94,7 @@ def populate_args(mod_args_p):
 def run(args):
     from .. import Tree
 
-    for nw in src_tree_iterator(args):
-        t = Tree(nw)
+    for _, t in src_trees(args, Tree):
         mod_tree(t, args)
         dump(t)
 
@@ -40,7 +40,7 @@ from __future__ import absolute_import
 from __future__ import print_function
 import sys
 
-from .common import log, dump
+from .common import log, dump, iter_source_newicks
 
 import six
 from six.moves import map
@@ -72,6 +72,17 @@ def populate_args(ncbi_args_p):
                               " indicating the minimum string similarity."
                               " Special sqlite compilation is necessary."))
 
+    ncbi_args.add_argument("--congruence", dest="congruence", nargs="+",
+                        help=("Scores the taxonomic congruence of the trees found in"
+                              " the given newick files, directories or newick strings (use"
+                              " '-' to read trees from standard input). Leaf names must be taxids."
+                              " For each tree, the number of NCBI taxa in the lineages"
+                              " of its leaves and the taxa that are not monophyletic"
+                              " are reported."))
+
+    ncbi_args.add_argument("--cpus", dest="cpus", type=int, default=1,
+                        help="number of processes used to score trees with --congruence")
+
     output_args = ncbi_args_p.add_argument_group('NCBI OUTPUT OPTIONS')
 
     output_args.add_argument("--tree", dest="tree",
@@ -120,6 +131,10 @@ def run(args):
 
     if args.create:
         sys.exit(0)
+
+    if args.congruence:
+        return run_congruence(ncbi, args)
+
     all_taxids = {}
     all_names = set()
     queries = []
@@ -143,14 +158,13 @@ def run(args):
     not_found_names = all_names - set(name2tax.keys())
     if args.fuzzy and not_found_names:
         log.warn("%s unknown names", len(not_found_names))
-        for name in not_found_names:
-            # enable extension loading
-            tax, realname, sim = ncbi.get_fuzzy_name_translation(name, args.fuzzy)
-            if tax:
-                all_taxids[tax] = None
-                name2tax[name] = [tax]
-                name2realname[name] = realname
-                name2score[name] = "Fuzzy:%0.2f" %sim
+        name2matches = ncbi.get_fuzzy_name_translator(not_found_names, args.fuzzy)
+        for name, matches in six.iteritems(name2matches):
+            tax, realname, sim = matches[0]
+            all_taxids[tax] = None
+            name2tax[name] = [tax]
+            name2realname[name] = realname
+            name2score[name] = "Fuzzy:%0.2f" %sim
 
     if not_found_names:
         log.warn("[%s] could not be translated into taxids!" %','.join(not_found_names))
@@ -196,3 +210,21 @@ def run(args):
             named_lineage = ','.join(ncbi.translate_to_names(lineage))
             lineage_string = ','.join(map(str, lineage))
             print('\t'.join([str(taxid), name, ranks.get(taxid, ''), named_lineage, lineage_string]))
+
+
+def run_congruence(ncbi, args):
+    from collections import deque
+
+    names = deque()
+    def iter_newicks():
+        for name, nw in iter_source_newicks(args.congruence):
+            names.append(name)
+            yield nw
+
+    print('# ' + '\t'.join(["Tree", "Taxa", "Broken_taxa", "Score", "Broken_taxids", "Broken_names"]))
+    for result in ncbi.iter_broken_clades(iter_newicks(), n_jobs=args.cpus):
+        broken = sorted(result.broken_clades)
+        score = 1.0 - len(broken) / float(result.ntaxa) if result.ntaxa else 0.0
+        print('\t'.join([names.popleft(), str(result.ntaxa), str(len(broken)), "%0.4f" %score,
+                         '|'.join(map(str, broken)),
+                         '|'.join(map(str, ncbi.translate_to_names(broken)))]))
@@ -0,0 +1,89 @@
+# #START_LICENSE###########################################################
+#
+#
+# This file is part of the Environment for Tree Exploration program
+# (ETE).  http://etetoolkit.org
+#
+# ETE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ETE is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ETE.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#                     ABOUT THE ETE PACKAGE
+#                     =====================
+#
+# ETE is distributed under the GPL copyleft license (2008-2015).
+#
+# If you make use of ETE in published work, please cite:
+#
+# Jaime Huerta-Cepas, Joaquin Dopazo and Toni Gabaldon.
+# ETE: a python Environment for Tree Exploration. Jaime BMC
+# Bioinformatics 2010,:24doi:10.1186/1471-2105-11-24
+#
+# Note that extra references to the specific methods implemented in
+# the toolkit may be available in the documentation.
+#
+# More info at http://etetoolkit.org. Contact: huerta@embl.de
+#
+#
+# #END_LICENSE#############################################################
+from __future__ import absolute_import
+from __future__ import print_function
+
+from .common import dump, ref_trees, src_tree_iterator, iter_source_newicks
+
+DESC = """
+ - ete support -
+
+'support' maps the support of a collection of trees containing the same
+leaves (i.e. bootstrap replicates or MCMC samples, given as source trees)
+onto the branches of one or more reference trees, which are printed with
+the new support values. Source trees can be newick strings or files with
+any number of trees, which are read lazily. Leaves are matched using the
+attribute given by --src_tree_attr.
+
+Example:
+
+  ete3 support -r best_tree.nw -t bootstrap_trees.nw --unrooted --cpus 4
+
+"""
+
+def populate_args(support_args_p):
+    support_args = support_args_p.add_argument_group('SUPPORT OPTIONS')
+
+    support_args.add_argument("--transfer", dest="transfer",
+                              action="store_true",
+                              help=("use the transfer bootstrap expectation instead of the"
+                                    " fraction of source trees containing each branch."
+                                    " Trees are always compared as unrooted."))
+
+    support_args.add_argument("--unrooted", dest="unrooted",
+                              action="store_true",
+                              help="compare trees as unrooted")
+
+    support_args.add_argument("--cpus", dest="cpus",
+                              type=int, default=1,
+                              help="number of processes used to read source trees")
+
+def run(args):
+    from .. import Tree
+    from ..coretype.consensus import map_split_support
+
+    # source trees are read once per reference tree
+    sources = list(src_tree_iterator(args))
+    method = "transfer" if args.transfer else "frequency"
+    for _, rtree in ref_trees(args, Tree):
+        newicks = (nw for _, nw in iter_source_newicks(sources))
+        map_split_support(rtree, newicks, method=method, attr=args.src_tree_attr,
+                          unrooted=args.unrooted, newick_format=args.src_newick_format,
+                          n_jobs=args.cpus)
+        dump(rtree)
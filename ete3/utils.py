@@ -224,3 +224,47 @@ def timeit(f):
         return r
     return a_wrapper_accepting_arguments
 
+
+def count_bits(bits):
+    """ Returns the number of bits set in a non negative integer. """
+    return bin(bits).count("1")
+
+def iter_chunks(items, chunksize):
+    """ Yields lists of up to chunksize consecutive items of an iterable. """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# settings shared by the worker processes started by imap_chunks()
+_WORKER_SETTINGS = None
+
+def _init_worker(setup, settings):
+    global _WORKER_SETTINGS
+    _WORKER_SETTINGS = setup(settings) if setup is not None else settings
+
+def _run_worker(task):
+    worker, chunk = task
+    return worker(_WORKER_SETTINGS, chunk)
+
+def imap_chunks(worker, settings, items, n_jobs=None, chunksize=1, ordered=True,
+                setup=None):
+    """ Sends chunks of items to a pool of n_jobs processes and yields the
+    result of worker(settings, chunk) for each of them. Settings are sent
+    once to each process, and are replaced there by setup(settings) if setup
+    is given. Both worker and setup must be module level functions. Items
+    are read lazily, and results are yielded in the order of the chunks
+    unless ordered is False. """
+    from multiprocessing import Pool
+    pool = Pool(n_jobs, _init_worker, (setup, settings))
+    try:
+        imap = pool.imap if ordered else pool.imap_unordered
+        tasks = ((worker, chunk) for chunk in iter_chunks(items, chunksize))
+        for result in imap(_run_worker, tasks):
+            yield result
+    finally:
+        pool.terminate()